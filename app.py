@@ -1,24 +1,45 @@
 import os
-import operator
+import tempfile
+import hashlib
+import json
+import mimetypes
 import bcrypt
 import random
 import datetime, time
+import threading
+from collections import Counter
 from functools import wraps
-from flask import Flask, render_template, send_file, request, redirect, url_for
+from flask import Flask, render_template, send_file, request, redirect, url_for, g, abort, has_request_context, jsonify, Response, session
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import FlaskForm
 from flask_login import UserMixin, current_user, login_user, LoginManager, login_required, logout_user
 from flask_talisman import Talisman
-from sqlalchemy.orm import relationship
+from sqlalchemy import event, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import relationship, selectinload, load_only
+from sqlalchemy.pool import QueuePool
 from wtforms import StringField, TextAreaField, SelectField, SubmitField, PasswordField
 from wtforms.fields.simple import TextField
 from wtforms.validators import DataRequired, InputRequired, Length, ValidationError
 from urllib.parse import quote
+from werkzeug.security import safe_join
 import bleach
+import click
 
 # Specific for this project
-from export import export_catalogus_to_word, export_session_to_word 
+from export import DOCX_MIMETYPE, WerksessieExport, MotivatieExport
+from exportjobs import ExportTaken, ExportWachtrijVol, KLAAR
+from catalogus import Catalogus
+from fragmenten import Fragment
+import fragmenten
+from scoring import STRATEGIEEN, EXCLUDED, PRIORITEITSKLASSEN
+from cache import LRUCache
+from wachtwoorden import Wachtwoorden, WachtwoordWachtrijVol, rondes_van
+from metrics import Metrics
+import migrations
+import onderhoud
+import watals
 
 def setKey(key, default):
     try:
@@ -34,13 +55,48 @@ db_config = {
     "database": setKey('SQL_DB', 'interventie'),
     "port": setKey('SQL_PORT', '1433'),
     "server_type": setKey('SERVER_TYPE', 'mssql+pyodbc'),
-    "force_https": setKey('FORCE_HTTPS', 'TRUE')
+    "force_https": setKey('FORCE_HTTPS', 'TRUE'),
+    "sql_statement_header": setKey('SQL_STATEMENT_HEADER', 'FALSE')
 }
 
 MAINTAINER = setKey('MAINTAINER', "None specified")
 MAINTAINER_EMAIL = setKey('MAINTAINER_EMAIL', "None specified")
+RESULT_CACHE_SIZE = int(setKey('RESULT_CACHE_SIZE', '1000'))    # Aantal gescoorde instrumentlijsten per worker
+RESULT_CACHE_TTL = int(setKey('RESULT_CACHE_TTL', '600'))       # Seconden dat een gescoorde lijst bewaard blijft
+USER_CACHE_TTL = int(setKey('USER_CACHE_TTL', '30'))    # Seconden dat een andere worker een gewijzigde rol nog niet ziet
+EXPORT_DIR = setKey('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'interventie_exports'))  # Gedeeld door alle workers
+EXPORT_WORKERS = int(setKey('EXPORT_WORKERS', '2'))     # Processen per worker die Word-exports maken, 0 is in het request zelf
+EXPORT_MAX_JOBS = int(setKey('EXPORT_MAX_JOBS', '20'))  # Maximum aantal lopende exports per worker
+EXPORT_JOB_TTL = int(setKey('EXPORT_JOB_TTL', '3600'))  # Seconden dat een export te downloaden blijft
+EXPORT_JOB_TIMEOUT = int(setKey('EXPORT_JOB_TIMEOUT', '600'))  # Seconden waarna een export die niet klaar is als mislukt geldt
+METRICS_DIR = setKey('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'interventie_metrics'))  # Gedeeld door alle workers
+ONDERHOUD_INTERVAL = int(setKey('MAINTENANCE_INTERVAL', '86400'))   # Seconden tussen automatische opruimrondes, 0 is uit
+METRICS_TOKEN = setKey('METRICS_TOKEN', '')             # Bearer-token voor /metrics; zonder token alleen vanaf deze machine
+WATALS_MAX_SCENARIOS = int(setKey('WHATIF_MAX_SCENARIOS', '10000'))  # Maximum aantal wat-als-scenario's per request
+WATALS_MAX_RIJEN = int(setKey('WHATIF_MAX_ROWS', '100000'))  # Maximum aantal scenario's maal instrumenten per request
+
+# Metrics voor /metrics, zie metrics.py.
+metrics = Metrics(METRICS_DIR)
+metrics.counter('interventie_requests_total', 'Afgehandelde requests per endpoint, methode en status.')
+metrics.histogram('interventie_request_duration_seconds', 'Duur van requests per endpoint.')
+metrics.histogram('interventie_request_sql_statements', 'Aantal SQL-statements per request, per endpoint.', (0, 1, 2, 5, 10, 20, 50, 100, 200))
+metrics.histogram('interventie_request_db_seconds', 'Tijd in de database per request, per endpoint.')
+metrics.gauge('interventie_db_pool_checked_out', 'Uitgeleende databaseverbindingen.')
+metrics.gauge('interventie_db_pool_overflow', 'Databaseverbindingen boven pool_size.')
+metrics.histogram('interventie_db_pool_wait_seconds', 'Wachttijd op een verbinding uit de pool, inclusief het openen van nieuwe verbindingen.')
+metrics.histogram('interventie_scoring_seconds', 'Tijd voor het scoren van de instrumenten van een werksessie.')
+metrics.histogram('interventie_whatif_seconds', 'Tijd voor het scoren van een reeks wat-als-scenario\'s.')
+metrics.histogram('interventie_export_seconds', 'Duur van het maken van een Word-export, per soort.')
+metrics.histogram('interventie_password_hash_seconds', 'Duur van het hashen of controleren van een wachtwoord.')
+metrics.counter('interventie_cache_hits_total', 'Treffers per cache.')
+metrics.counter('interventie_cache_misses_total', 'Missers per cache.')
+metrics.counter('interventie_maintenance_rows_deleted_total', 'Rijen verwijderd door het onderhoud, per taak.')
+metrics.histogram('interventie_maintenance_seconds', 'Duur van een onderhoudstaak, per taak.')
 
 connection_string = f'{db_config["server_type"]}://{quote(db_config["user"])}:{quote(db_config["password"])}@{db_config["host"]}:{db_config["port"]}/{db_config["database"]}{"?driver=ODBC+Driver+17+for+SQL+Server" if db_config["server_type"]=="mssql+pyodbc" else ""}'
+# Met DATABASE_URI kan een volledige SQLAlchemy-URI worden opgegeven, bijvoorbeeld sqlite:///interventie.db
+# voor ontwikkeling en de benchmarks. Dan worden de losse SQL_-variabelen niet gebruikt.
+connection_string = os.environ.get('DATABASE_URI', connection_string)
 print (connection_string)
 
 app = Flask(__name__)
@@ -51,37 +107,210 @@ if db_config['force_https'] == "TRUE":
 app.config['SECRET_KEY'] = setKey('SECRET_KEY', 'NOKEYSPECIFIED')
 app.config['SQLALCHEMY_DATABASE_URI'] = connection_string
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+class TimedQueuePool(QueuePool):
+    """QueuePool die meet hoe lang een request op een verbinding moet wachten."""
+    def _do_get(self):
+        begin = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe('interventie_db_pool_wait_seconds', time.perf_counter() - begin)
+
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': TimedQueuePool,
     'pool_size': 10,
     'pool_recycle': 60,
     'pool_pre_ping': True
 }
+if connection_string.startswith('sqlite'):
+    # Een SQLite-verbinding uit de pool kan in een andere thread terechtkomen dan waarin hij is geopend.
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'check_same_thread': False}
 
 db = SQLAlchemy(app)
 
+# Statische bestanden met een hash van de inhoud in de naam, gemaakt door build_assets.py. url_for('static', ...)
+# wijst via het manifest naar die bestanden. Omdat ze nooit van inhoud veranderen, mogen browsers en proxies ze
+# een jaar bewaren zonder opnieuw te vragen. Zonder manifest werkt alles zoals voorheen.
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+def laad_asset_manifest():
+    try:
+        with open(os.path.join(app.static_folder, 'dist', 'manifest.json')) as bestand:
+            return json.load(bestand)
+    except (OSError, ValueError):
+        print('*** No static/dist/manifest.json found, serving static files without fingerprints. Run build_assets.py.')
+        return {}
+
+asset_manifest = laad_asset_manifest()
+# Hoort bij de ETag van pagina's: na een nieuwe build verwijzen bewaarde pagina's naar bestanden die niet meer bestaan.
+ASSET_VERSIE = hashlib.md5(json.dumps(asset_manifest, sort_keys=True).encode()).hexdigest()[:10]
+
+@app.url_defaults
+def static_fingerprint(endpoint, values):
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = 'dist/' + asset_manifest[values['filename']]
+
+def static_bestand(filename):
+    """Vervangt de standaard static-view. Bestanden uit dist/ gaan als brotli of gzip over de lijn als de browser
+    dat ondersteunt, met headers die zeggen dat ze nooit veranderen."""
+    if not filename.startswith('dist/'):
+        return app.send_static_file(filename)
+    pad = safe_join(app.static_folder, filename)
+    if pad is None or not os.path.isfile(pad):
+        abort(404)
+    codering = None
+    for kandidaat, extensie in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings.quality(kandidaat) > 0 and os.path.isfile(pad + extensie):
+            codering = kandidaat
+            pad += extensie
+            break
+    response = send_file(pad, mimetype=mimetypes.guess_type(filename)[0], max_age=STATIC_MAX_AGE)
+    if codering is not None:
+        response.headers['Content-Encoding'] = codering
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = static_bestand
+
+# Teller van het aantal SQL-statements per request, om N+1-queries op te sporen. De teller is uit te lezen
+# met sql_statements() of, als SQL_STATEMENT_HEADER op TRUE staat, via de header X-SQL-Statements.
+@event.listens_for(Engine, 'before_cursor_execute')
+def tel_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        conn.info['statement_begin'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def meet_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    begin = conn.info.pop('statement_begin', None)
+    if begin is not None and has_request_context():
+        g.db_tijd = g.get('db_tijd', 0.0) + time.perf_counter() - begin
+
+def sql_statements():
+    """Aantal SQL-statements dat tot nu toe in dit request is uitgevoerd."""
+    return g.get('sql_statements', 0)
+
+@app.before_request
+def start_meting():
+    g.request_begin = time.perf_counter()
+
+@app.after_request
+def meet_request(response):
+    endpoint = request.endpoint or 'onbekend'
+    metrics.inc('interventie_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_begin' in g:
+        metrics.observe('interventie_request_duration_seconds', time.perf_counter() - g.request_begin, endpoint=endpoint)
+    metrics.observe('interventie_request_sql_statements', sql_statements(), endpoint=endpoint)
+    metrics.observe('interventie_request_db_seconds', g.get('db_tijd', 0.0), endpoint=endpoint)
+    metrics.wegschrijven()
+    return response
+
+@metrics.verzamelaar
+def verzamel_pool():
+    pool = db.engine.pool
+    if isinstance(pool, QueuePool):
+        metrics.set('interventie_db_pool_checked_out', pool.checkedout())
+        metrics.set('interventie_db_pool_overflow', max(pool.overflow(), 0))
+
+@app.after_request
+def sql_statement_header(response):
+    if db_config['sql_statement_header'] == 'TRUE':
+        response.headers['X-SQL-Statements'] = str(sql_statements())
+    return response
+
+app.config['BCRYPT_LOG_ROUNDS'] = int(setKey('BCRYPT_LOG_ROUNDS', '12'))   # Werkfactor van nieuwe wachtwoordhashes
 bcrypt=Bcrypt(app)
+# Hashen en controleren van wachtwoorden gebeurt in echte threads, zie wachtwoorden.py.
+wachtwoorden = Wachtwoorden(bcrypt,
+                            threads=int(setKey('BCRYPT_THREADS', '2')),
+                            max_wachtend=int(setKey('BCRYPT_MAX_WAITING', '50')),
+                            op_klaar=lambda duur: metrics.observe('interventie_password_hash_seconds', duur))
+
+def hash_wachtwoord(wachtwoord):
+    return wachtwoorden.hash(wachtwoord, app.config['BCRYPT_LOG_ROUNDS'])
+
+@app.errorhandler(WachtwoordWachtrijVol)
+def wachtwoord_wachtrij_vol(err):
+    return render_template('error.html', melding='Het is even te druk', tekst='Er worden op dit moment te veel wachtwoorden tegelijk gecontroleerd. Probeer het over een paar seconden opnieuw.'), 503
 bleach.ALLOWED_TAGS.append('br')
 
-# Methoden voor het bepalen van de prioriteit op basis van plustags en mintags
-DIFFERENCE = 0
-EXCLUDED = 1
-WEIGH_DOWN = 2
-# Instellingen
+# Standaardinstellingen, zolang er nog geen instellingen in de database staan. De methoden staan in scoring.py.
 METHOD = EXCLUDED    # De gehanteerde methode voor het bepalen van de prioriteit van de instrumenten
 MARGIN = 1                  # Als de score van een instrument minder dan de MARGIN verschilt met de topprioriteit, geef dan ook de topprioriteit
-# Prioriteiten, correspondeert met CSS
-PRIO_HI = 2
-PRIO_MID = 1
-PRIO_LO = 0
+
+# Gescoorde instrumentlijsten per werksessie. De sleutel bevat de gekozen opties, de catalogusversie en de
+# scoringsinstellingen, zodat een lijst na een wijziging nooit meer uit de cache komt.
+aanbevelingen_cache = LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+# Tag hits per werksessie, per catalogusversie. Bij een nieuw antwoord worden alleen de verschillen verwerkt.
+sessiescores = LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+# Word-exports worden op de achtergrond gemaakt, zie exportjobs.py.
+exporttaken = ExportTaken(EXPORT_DIR, workers=EXPORT_WORKERS, max_taken=EXPORT_MAX_JOBS, ttl=EXPORT_JOB_TTL,
+                          timeout=EXPORT_JOB_TIMEOUT,
+                          op_klaar=lambda soort, duur: metrics.observe('interventie_export_seconds', duur, soort=soort))
 
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
 
+class Gebruiker(UserMixin):
+    """De gegevens van een ingelogde gebruiker die de requests nodig hebben, los van de database-sessie,
+    zodat ze tussen requests bewaard kunnen worden."""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.role = user.role
+        self.active_session = user.active_session
+
+# Ingelogde gebruikers per worker, zodat niet elk request de gebruiker uit de database hoeft te halen.
+# De sleutel bevat een stempel uit de sessiecookie. Wijzigt een gebruiker zijn eigen gegevens (actieve werksessie,
+# wachtwoord), dan krijgt de cookie een nieuwe stempel en ziet elke worker de wijziging direct. Wijzigingen door
+# een administrator (rol, verwijderen) zijn op andere workers na hooguit USER_CACHE_TTL seconden zichtbaar.
+# Voor rechten is dat te laat: of iemand administrator is, controleert is_administrator daarom in de database.
+gebruikers_cache = LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+@metrics.verzamelaar
+def verzamel_caches():
+    for naam, cache in (('aanbevelingen', aanbevelingen_cache), ('sessiescores', sessiescores), ('gebruikers', gebruikers_cache)):
+        metrics.set('interventie_cache_hits_total', cache.hits, cache=naam)
+        metrics.set('interventie_cache_misses_total', cache.misses, cache=naam)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    sleutel = (int(user_id), session.get('gebruiker_stempel'))
+    gebruiker = gebruikers_cache.get(sleutel)
+    if gebruiker is None:
+        user = User.query.get(int(user_id))
+        if user is None:
+            return None
+        gebruiker = Gebruiker(user)
+        gebruikers_cache.put(sleutel, gebruiker)
+    return gebruiker
+
+def is_administrator():
+    """Of de ingelogde gebruiker administrator is. Een rol uit de cache kan op deze worker nog van voor het
+    intrekken van de rol of het verwijderen van de gebruiker zijn; daarom wordt een administratorrol eens per
+    request in de database bevestigd. Voor gewone gebruikers kost dit niets: een rol die net is toegekend mag
+    even op zich laten wachten."""
+    if not current_user.is_authenticated or current_user.role != 1:
+        return False
+    if 'administrator' not in g:
+        g.administrator = db.session.query(User.role).filter_by(id=current_user.id).scalar() == 1
+        if not g.administrator:
+            # Bij het volgende request laadt deze worker de gebruiker opnieuw, of niet meer als hij weg is.
+            gebruikers_cache.invalidate(lambda sleutel: sleutel[0] == current_user.id)
+    return g.administrator
+
+def invalideer_gebruiker(user_id):
+    """Aanroepen na elke gewijzigde gebruiker. Gaat het om de ingelogde gebruiker zelf, dan krijgt de
+    sessiecookie een nieuwe stempel, zodat ook de andere workers de gebruiker opnieuw laden."""
+    gebruikers_cache.invalidate(lambda sleutel: sleutel[0] == user_id)
+    if current_user.is_authenticated and current_user.id == user_id:
+        session['gebruiker_stempel'] = os.urandom(8).hex()
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -103,8 +332,8 @@ class Instrument(db.Model):
     links = db.Column(db.Text)
     eigenaar = db.Column(db.String(100), nullable=False)
     eigenaar_email = db.Column(db.String(100), nullable=False)
-    tags = relationship('Tag', secondary="associations_IT")
-    extags = relationship('Tag', secondary="associations_XIT")
+    tags = relationship('Tag', secondary="associations_IT", lazy='selectin')
+    extags = relationship('Tag', secondary="associations_XIT", lazy='selectin')
 
     def __repr__(self):
         return '<Instrument %r>' % self.naam
@@ -116,6 +345,8 @@ class Tag(db.Model):
     def __repr__(self):
         return '<Tag %r>' % self.naam
 
+# De unieke indexen op de koppeltabellen en de indexen op de zoekkolommen staan in migrations.py.
+
 # Tabel met relaties tussen instrumenten en plustags
 associations_IT = db.Table('associations_IT',
                             db.Column('id', db.Integer, primary_key=True),
@@ -133,7 +364,7 @@ class Optie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     naam = db.Column(db.String(200), nullable=False)
     vraag_id = db.Column(db.Integer, db.ForeignKey('vragen.id'), nullable=False)
-    tags = relationship('Tag', secondary="associations_TO")
+    tags = relationship('Tag', secondary="associations_TO", lazy='selectin')
     
     def __repr__(self):
         return '<Optie %r>' % self.naam
@@ -149,7 +380,7 @@ class Vraag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     naam = db.Column(db.String(200), nullable=False)
     categorie_id = db.Column(db.Integer, db.ForeignKey('categorieen.id'), nullable=False)
-    opties = db.relationship('Optie', backref='optie')
+    opties = db.relationship('Optie', backref='optie', lazy='selectin')
     multiselect = db.Column(db.Boolean, nullable=False)
 
     def __repr__(self):
@@ -182,6 +413,8 @@ class Werksessie(db.Model):
         return '<Sessie %r>' % self.naam
 
 
+MOTIVATIE_LENGTE = 499     # Het tekstvak op de vragenlijst heeft maxlength 499; de kolom is String(500)
+
 class Motivaties(db.Model):
     __tablename__ = 'motivaties'
     id = db.Column(db.Integer, primary_key=True)
@@ -205,6 +438,28 @@ associations_Ws_Mot = db.Table('associations_Ws_Mot',
                             db.Column('motivatie_id', db.Integer, db.ForeignKey('motivaties.id'))
                             )
 
+# Versienummer van de catalogus (instrumenten, tags, vragen en opties). Elke wijziging door een administrator
+# verhoogt het nummer, zodat alle workers weten dat hun momentopname van de catalogus verouderd is.
+class CatalogusVersie(db.Model):
+    __tablename__ = 'catalogus_versie'
+    id = db.Column(db.Integer, primary_key=True)
+    versie = db.Column(db.Integer, nullable=False, default=0)
+    gewijzigd = db.Column(db.DateTime, nullable=True)   # Tijdstip (UTC) van de laatste wijziging, voor Last-Modified
+
+    def __repr__(self):
+        return '<CatalogusVersie %r>' % self.versie
+
+# De actieve scoringsstrategie en marge, voor alle workers. Een wijziging verhoogt de catalogusversie,
+# zodat de workers de nieuwe instellingen met hun momentopname van de catalogus oppikken.
+class Instellingen(db.Model):
+    __tablename__ = 'instellingen'
+    id = db.Column(db.Integer, primary_key=True)
+    methode = db.Column(db.Integer, nullable=False)
+    marge = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<Instellingen %r/%r>' % (self.methode, self.marge)
+
 class RegisterForm(FlaskForm):
     username = StringField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder": "Nieuwe naam"})
     password = PasswordField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder": "Wachtwoord"})
@@ -255,32 +510,219 @@ class OptieForm(FlaskForm):
     optie = TextField('Optie', validators=[DataRequired()])
     tags = relationship('Tag', secondary="associations_TO")
 
-def get_instruments(alle_instrumenten, werksessie=None):
-    """Geeft een lijst terug van alle instrumenten. Deze lijst is gesorteerd. Het sorteren is geimplementeerd in een aparte functie."""
+def get_instruments(catalogus, werksessie=None, geselecteerd=None):
+    """Geeft een lijst terug van alle instrumenten. Deze lijst is gesorteerd. Het sorteren is geimplementeerd in een aparte functie.
+    De ranglijst wordt per werksessie bijgehouden en na elk antwoord alleen voor de geraakte instrumenten bijgewerkt,
+    zie SessieScore in scoring.py.
+    Zijn de id's van de gekozen opties al bekend, dan hoeven de opties van de werksessie niet geladen te worden."""
     if werksessie == None:
         # Dit kan niet gebeuren
         pass
 
-    instrument_met_alle_tags = []    
-    tags_in_scope = []
-    for optie in Optie.query.all():
-        if optie in werksessie.geselecteerde_opties:
-            tags_in_scope.extend(optie.tags)
-    # Dit wordt een lijst van alle instrumenten met het aantal tags dat actief is in de werksessie
-    for instrument in alle_instrumenten:
-        tags = []
-        extags = []
-        for tag in instrument.tags:
-            if tag in tags_in_scope:
-                tags.append(tag)
-        for tag in instrument.extags:
-            if tag in tags_in_scope:
-                extags.append(tag)
-
-        instrument_met_alle_tags.append([instrument, tags, extags])
-    instrumenten_sorted = prioritize_instruments(instrument_met_alle_tags)
+    if geselecteerd is None:
+        geselecteerd = frozenset(optie.id for optie in werksessie.geselecteerde_opties)
+
+    def score():
+        begin = time.perf_counter()
+        sessiescore = sessiescores.get_or_compute((werksessie.id, catalogus.versie, catalogus.methode, catalogus.marge),
+                                                  lambda: catalogus.index.sessiescore(catalogus.methode, catalogus.marge))
+        gesorteerd = sessiescore.score(geselecteerd)
+        metrics.observe('interventie_scoring_seconds', time.perf_counter() - begin)
+        return gesorteerd
+
+    sleutel = (werksessie.id, geselecteerd, catalogus.versie, catalogus.methode, catalogus.marge)
+    instrumenten_sorted = aanbevelingen_cache.get_or_compute(sleutel, score)
     return instrumenten_sorted
 
+def invalideer_aanbevelingen(werksessie_id):
+    """Na het wijzigen van de antwoorden van een werksessie zijn de bewaarde lijsten van die sessie niet meer nodig."""
+    aanbevelingen_cache.invalidate(lambda sleutel: sleutel[0] == werksessie_id)
+
+def opgeschoond_instrument(i):
+    """Kopie van een instrument uit de momentopname met teksten die veilig als HTML getoond kunnen worden."""
+    return i._replace(
+        intro=bleach.clean(i.intro),
+        beschrijving=bleach.clean('' if i.beschrijving is None else i.beschrijving).replace('\n', '<br>'),
+        afwegingen=bleach.clean('' if i.afwegingen is None else i.afwegingen).replace('\n', '<br>'),
+        voorbeelden=bleach.clean('' if i.voorbeelden is None else i.voorbeelden).replace('\n', '<br>'),
+        links=bleach.clean('' if i.links is None else i.links).replace('\n', '<br>'),
+        eigenaar=bleach.clean('' if i.eigenaar is None else i.eigenaar),
+        eigenaar_email=bleach.clean('' if i.eigenaar_email is None else i.eigenaar_email))
+
+def laad_catalogus(versie):
+    """Leest de hele catalogus en de scoringsinstellingen in een vast aantal queries uit de database."""
+    instellingen = Instellingen.query.get(1)
+    return Catalogus(versie,
+        gewijzigd=db.session.query(CatalogusVersie.gewijzigd).filter_by(id=1).scalar(),
+        methode=METHOD if instellingen is None else instellingen.methode,
+        marge=MARGIN if instellingen is None else instellingen.marge,
+        opschonen=opgeschoond_instrument,
+        instrumenten=db.session.query(Instrument.id, Instrument.naam, Instrument.intro, Instrument.beschrijving,
+                                      Instrument.afwegingen, Instrument.voorbeelden, Instrument.links,
+                                      Instrument.eigenaar, Instrument.eigenaar_email).order_by(Instrument.naam).all(),
+        tags=db.session.query(Tag.id, Tag.naam).order_by(Tag.naam).all(),
+        categorieen=db.session.query(Categorie.id, Categorie.naam).order_by(Categorie.naam).all(),
+        vragen=db.session.query(Vraag.id, Vraag.naam, Vraag.categorie_id, Vraag.multiselect).order_by(Vraag.id).all(),
+        opties=db.session.query(Optie.id, Optie.naam, Optie.vraag_id).order_by(Optie.id).all(),
+        plustags=db.session.query(associations_IT.c.instrument_id, associations_IT.c.tag_id).order_by(associations_IT.c.id).all(),
+        mintags=db.session.query(associations_XIT.c.instrument_id, associations_XIT.c.tag_id).order_by(associations_XIT.c.id).all(),
+        optietags=db.session.query(associations_TO.c.optie_id, associations_TO.c.tag_id).order_by(associations_TO.c.id).all())
+
+_catalogus = None
+_catalogus_lock = threading.Lock()
+
+def get_catalogus():
+    """Geeft de momentopname van de catalogus. Per request wordt één keer het versienummer in de database gecontroleerd.
+    Alleen als dat nummer veranderd is, laadt deze worker de catalogus opnieuw."""
+    global _catalogus
+    if 'catalogus' not in g:
+        versie = db.session.query(CatalogusVersie.versie).filter_by(id=1).scalar() or 0
+        if _catalogus is None or _catalogus.versie != versie:
+            with _catalogus_lock:
+                if _catalogus is None or _catalogus.versie != versie:
+                    _catalogus = laad_catalogus(versie)
+        g.catalogus = _catalogus
+    return g.catalogus
+
+@app.context_processor
+def navigatie():
+    """Het navigatiemenu met alle instrumenten. De templates krijgen een functie, zodat pagina's zonder menu
+    de catalogus niet hoeven te laden."""
+    return {'navigatie': lambda: get_catalogus().navigatie}
+
+# Conditionele requests. Pagina's en documenten die alleen van de catalogus afhangen krijgen een ETag op basis van
+# de catalogusversie, en een Last-Modified op basis van het tijdstip van die versie. Heeft de browser (of de proxy)
+# die versie al, dan volgt een 304 voordat er een template wordt gerenderd of een document wordt gemaakt.
+def pagina_etag(*delen):
+    """ETag voor alles waar de inhoud van afhangt. Pagina's tonen de gebruikersnaam en, voor administrators,
+    extra links; daarom hoort de gebruiker er bij pagina's ook bij."""
+    return hashlib.md5(repr((ASSET_VERSIE,) + delen).encode()).hexdigest()
+
+def antwoordversie(werksessie):
+    """Alles van een werksessie dat op de samenvatting staat: de gegevens van de casus, de gekozen opties en
+    de motivaties. Verandert bij elk opgeslagen antwoord."""
+    return (werksessie.id, werksessie.naam, werksessie.auteurs, werksessie.datum, werksessie.probleemstelling,
+            werksessie.conclusie, werksessie.showinstruments,
+            sorted(optie.id for optie in werksessie.geselecteerde_opties),
+            sorted((motivatie.vraag or 0, motivatie.motivatie or '') for motivatie in werksessie.motivaties))
+
+def gebruiker_sleutel():
+    if not current_user.is_authenticated:
+        return None
+    return (current_user.id, current_user.username, current_user.role, current_user.active_session)
+
+def _http_tijd(tijdstip):
+    # HTTP-datums hebben een resolutie van een seconde en zijn in UTC.
+    return None if tijdstip is None else tijdstip.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+
+def niet_gewijzigd(etag, gewijzigd=None, publiek=False):
+    """Geeft een 304-response als de client deze versie al heeft, anders None. Alleen een publiek document hangt
+    uitsluitend van de catalogus af; een privé pagina hangt ook van de gebruiker af, wat alleen in de ETag zit.
+    Een If-Modified-Since zonder If-None-Match is dus alleen genoeg voor publieke documenten."""
+    gewijzigd = _http_tijd(gewijzigd)
+    if request.if_none_match:
+        actueel = request.if_none_match.contains(etag)
+    else:
+        actueel = publiek and gewijzigd is not None and request.if_modified_since is not None \
+            and gewijzigd <= request.if_modified_since
+    if actueel:
+        return validatie_headers(Response(status=304), etag, gewijzigd, publiek)
+    return None
+
+def validatie_headers(response, etag, gewijzigd=None, publiek=False):
+    """Zet ETag en Last-Modified, en laat de client bij elk gebruik opnieuw valideren. Pagina's verschillen per
+    gebruiker en zijn dus privé; documenten van de catalogus mogen ook door de proxy bewaard worden."""
+    response.set_etag(etag)
+    if gewijzigd is not None:
+        response.last_modified = _http_tijd(gewijzigd)
+    response.cache_control.no_cache = True
+    if publiek:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+        response.vary.add('Cookie')
+    return response
+
+def verhoog_catalogus_versie():
+    """Aanroepen in elke route die de catalogus wijzigt, voor de commit. De verhoging valt in dezelfde transactie
+    als de wijziging: als de commit mislukt, blijft ook het versienummer staan."""
+    nu = datetime.datetime.utcnow()
+    if CatalogusVersie.query.filter_by(id=1).update({CatalogusVersie.versie: CatalogusVersie.versie + 1,
+                                                     CatalogusVersie.gewijzigd: nu}) == 0:
+        db.session.add(CatalogusVersie(id=1, versie=1, gewijzigd=nu))
+    g.pop('catalogus', None)
+    aanbevelingen_cache.invalidate()
+    sessiescores.invalidate()
+
+def schema_bijwerken(opnieuw=False):
+    """Maakt ontbrekende tabellen aan, zoals catalogus_versie, en voert de openstaande migraties uit (zie
+    migrations.py). Dit moet gebeuren voordat de catalogus wordt geladen of een nieuwe versie krijgt: laad_catalogus
+    en verhoog_catalogus_versie gebruiken catalogus_versie.gewijzigd, die in een bestaande database pas met
+    migratie 1 ontstaat. Daarom roepen ook de commando's die de catalogus gebruiken deze functie eerst aan;
+    before_first_request geldt alleen voor requests."""
+    uitgevoerd = migrations.migreer(db.engine, opnieuw=opnieuw, aanmaken=db.create_all)
+    for migratie in uitgevoerd:
+        print(f'Migratie {migratie} uitgevoerd')
+    return uitgevoerd
+
+@app.before_first_request
+def create_tables():
+    # Starten er meerdere workers tegelijk, dan migreert er één en wachten de andere (zie migrations.vergrendeld).
+    # Mislukt het bijwerken van het schema, dan mislukt dit request ook en probeert het volgende het opnieuw;
+    # de app draait niet door op een half bijgewerkt schema.
+    try:
+        schema_bijwerken()
+    except Exception as err:
+        print(f'Exception bij het migreren: {err}')
+        raise
+
+@app.cli.command('migreer')
+@click.option('--opnieuw', is_flag=True, help='Voer ook de migraties uit die al gedaan zijn.')
+def migreer(opnieuw):
+    """Maakt ontbrekende tabellen aan en voert de openstaande migraties uit."""
+    if not schema_bijwerken(opnieuw):
+        print('Het schema is bij.')
+
+# Opruimen van rijen zonder bovenliggende rij, zie onderhoud.py. Draait via /maintenance, met flask onderhoud,
+# of vanzelf eens per MAINTENANCE_INTERVAL seconden in een van de workers.
+onderhoudsplanning = onderhoud.Planning(ONDERHOUD_INTERVAL)
+
+def voer_onderhoud_uit(namen=None):
+    """Voert de opruimtaken uit binnen een app context. Als er iets uit de catalogus is verwijderd, krijgt de
+    catalogus een nieuwe versie."""
+    resultaten = onderhoud.uitvoeren(db.engine, db.metadata.tables, namen)
+    for resultaat in resultaten:
+        metrics.inc('interventie_maintenance_rows_deleted_total', resultaat.rijen, taak=resultaat.taak)
+        metrics.observe('interventie_maintenance_seconds', resultaat.duur, taak=resultaat.taak)
+    if any(resultaat.catalogus and resultaat.rijen for resultaat in resultaten):
+        verhoog_catalogus_versie()
+        commit_to_database_success()
+    return resultaten
+
+def gepland_onderhoud():
+    with app.app_context():
+        try:
+            if onderhoudsplanning.aan_de_beurt(db.engine):
+                for resultaat in voer_onderhoud_uit():
+                    print(f'Onderhoud {resultaat.taak}: {resultaat.rijen} rijen in {1000 * resultaat.duur:.1f} ms')
+        except Exception as err:
+            print(f'Exception bij het onderhoud: {err}')
+
+@app.after_request
+def start_gepland_onderhoud(response):
+    # Het onderhoud draait in een eigen thread (onder gevent een greenlet), zodat dit request er niet op wacht.
+    if onderhoudsplanning.lokaal_aan_de_beurt():
+        threading.Thread(target=gepland_onderhoud, daemon=True).start()
+    return response
+
+@app.cli.command('onderhoud')
+@click.option('--taak', multiple=True, help='Voer alleen deze taak uit; mag vaker worden opgegeven.')
+def onderhoud_commando(taak):
+    """Ruimt rijen op waarvan de bovenliggende rij niet meer bestaat."""
+    schema_bijwerken()
+    for resultaat in voer_onderhoud_uit(set(taak) or None):
+        print(f'{resultaat.taak:<36}{resultaat.rijen:>8} rijen{1000 * resultaat.duur:>10.1f} ms')
+
 def commit_to_database_success(): 
     success = False
     err = None
@@ -294,43 +736,72 @@ def commit_to_database_success():
         pass
     return success
 
-def prioritize_instruments(instrument_met_alle_tags):
-    """Deze functie dient om de lijst te filteren en te sorteren. Omdat ik nog niet precies weet wat de beste methode gaat zijn heb ik
-    de methode nog flexibel ingevuld als extra argument."""
-    prioritized_list = []
-    max_priority = 0
-    
-    for instrument in instrument_met_alle_tags:
-        # Vaststellen en berekenen van plustags en mintags
-        tag_hits = len(instrument[1])
-        extag_hits = len(instrument[2])
-
-        if METHOD == DIFFERENCE: # Sortering en kleuring op basis van aantal plustags min het aantal mintags.
-            priority = tag_hits - extag_hits
-        if METHOD == EXCLUDED: # Sortering waarbij een enkele actieve mintag het instrument helemaal excludeert.
-            priority = tag_hits * (extag_hits == 0)
-        if METHOD == WEIGH_DOWN: # Sortering waarbij mintags zwaarder tellen dan plustags.
-            priority = tag_hits - 2 * extag_hits
-        priority_class = 0
-        prioritized_list.append([instrument[0], tag_hits, instrument[1], extag_hits, instrument[2], priority, priority_class])
-        max_priority = max(priority, max_priority) # Boekhouding om de hoogste prioriteitsscore later te kunnen gebruiken            
-    for instrument in prioritized_list:
-        # Bepalen van de prioriteitsklassen
-        if instrument[5] == 0:
-            instrument[6] = PRIO_LO
-        elif instrument[5] == max_priority:
-            instrument[6] = PRIO_HI
-        elif instrument[5] >= (max_priority - MARGIN):
-            instrument[6] = PRIO_HI
-        elif instrument[5] > 0:
-            instrument[6] = PRIO_MID
-        else:
-            instrument[6] = PRIO_LO
-
-    return sorted(prioritized_list, key=operator.itemgetter(5), reverse=True)
+def get_werksessie_or_404(werksessie_id):
+    """Laadt een werksessie met de gekozen opties, hun tags en de motivaties in een vast aantal queries.
+    Een werksessie wordt niet standaard zo geladen, omdat de lijsten met werksessies dat niet nodig hebben."""
+    return Werksessie.query.options(selectinload(Werksessie.geselecteerde_opties).selectinload(Optie.tags),
+                                    selectinload(Werksessie.motivaties)).get_or_404(werksessie_id)
+
+def gekozen_opties(werksessie_id):
+    """De id's van de gekozen opties van een werksessie, zonder de opties en hun tags als objecten te laden."""
+    return frozenset(optie_id for optie_id, in db.session.query(associations_OS.c.optie_id)
+                                                     .filter(associations_OS.c.werksessie_id == werksessie_id))
+
+def sla_antwoord_op(werksessie, vraag, optie_ids, motivatie):
+    """Zet het antwoord op een vraag klaar in de huidige transactie; de aanroeper doet de commit.
+    Alleen het verschil met de al gekozen opties wordt geschreven, en de motivatie bij de vraag wordt bijgewerkt
+    in plaats van gewist en opnieuw aangemaakt. De vraag komt uit de momentopname van de catalogus; de optie_ids
+    zijn al gehele getallen. Geeft de id's van alle gekozen opties van de werksessie na dit antwoord."""
+    opties_van_vraag = {optie.id for optie in vraag.opties}
+    gekozen = set(optie_ids)
+    if not gekozen <= opties_van_vraag:
+        abort(404)
+    huidig = gekozen_opties(werksessie.id)
+
+    te_wissen = (huidig & opties_van_vraag) - gekozen
+    if te_wissen:
+        db.session.execute(associations_OS.delete().where(
+            (associations_OS.c.werksessie_id == werksessie.id) & associations_OS.c.optie_id.in_(te_wissen)))
+    toe_te_voegen = gekozen - huidig
+    if toe_te_voegen:
+        db.session.execute(associations_OS.insert(),
+                           [{'werksessie_id': werksessie.id, 'optie_id': optie_id} for optie_id in toe_te_voegen])
+
+    # Er hoort maar één motivatie per vraag te zijn. Eerdere versies maakten er soms meer aan; die worden opgeruimd.
+    motivaties = [m for m in werksessie.motivaties if m.vraag == vraag.id]
+    if motivaties:
+        motivaties[0].motivatie = motivatie
+        overbodig = [m.id for m in motivaties[1:]]
+        if overbodig:
+            db.session.execute(associations_Ws_Mot.delete().where(associations_Ws_Mot.c.motivatie_id.in_(overbodig)))
+            db.session.execute(Motivaties.__table__.delete().where(Motivaties.id.in_(overbodig)))
+    else:
+        nieuwe_motivatie = Motivaties(motivatie=motivatie, vraag=vraag.id)
+        db.session.add(nieuwe_motivatie)
+        db.session.flush()
+        db.session.execute(associations_Ws_Mot.insert(),
+                           {'werksessie_id': werksessie.id, 'motivatie_id': nieuwe_motivatie.id})
+    return (huidig - te_wissen) | toe_te_voegen
+
+def vragenlijst(catalogus, werksessie):
+    """De vragen van de keuzehulp met de antwoorden en motivaties van de werksessie. De HTML van de vragen wordt
+    per catalogusversie één keer gerenderd; per weergave worden alleen de antwoorden ingevuld, zie fragmenten.py."""
+    fragment = catalogus.fragment('vragenlijst', lambda: Fragment(render_template('questionnaire_vragen.html',
+                                                                                  categorieen=catalogus.categorieen,
+                                                                                  plek=fragmenten.plek,
+                                                                                  einde=fragmenten.einde)))
+    gekozen = {optie.id for optie in werksessie.geselecteerde_opties}
+    motivaties = {}
+    sterren = Counter()
+    for motivatie in werksessie.motivaties:
+        motivaties[motivatie.vraag] = motivaties.get(motivatie.vraag, '') + (motivatie.motivatie or '')
+        # Zoals voorheen een ster per motivatie die niet leeg is; een motivatie zonder tekst (None) telt ook.
+        if motivatie.motivatie != '':
+            sterren[motivatie.vraag] += 1
+    return fragment.vul(antwoord=gekozen, gekozen=gekozen, motivatie=motivaties, ster=sterren)
 
 def Verander_werksessie(sessie_id):
-    if current_user.role == 1:
+    if is_administrator():
         # Voor admins kan gewoon worden geselecteerd.
         ws = Werksessie.query.filter_by(id=sessie_id).first()
         if ws is None:
@@ -346,18 +817,58 @@ def Verander_werksessie(sessie_id):
         sessie_id = None
     user_to_update = User.query.filter_by(id=current_user.id).first()
     user_to_update.active_session = sessie_id
-    return commit_to_database_success()
-
-def Beperk_werksessies(werksessies):
-    """Als de gebruiker geen admin is, dan beperkt deze functie de werksessies in de lijst tot die sessies die de gebruiker heweft gemaakt."""
-    if current_user.role == 1:
-        return werksessies
-    else:
-        return_list = []
-        for ws in werksessies:
-            if ws.owner == current_user.id:
-                return_list.append(ws)
-        return return_list
+    if not commit_to_database_success():
+        return False
+    invalideer_gebruiker(current_user.id)
+    current_user.active_session = sessie_id
+    return True
+
+# Lijsten met werksessies en gebruikers worden per pagina opgehaald, met keyset-paginering: de volgende pagina
+# begint na het laatste id (of de laatste naam) van de vorige. Zo blijft elke pagina één query met een index,
+# hoeveel werksessies er in de loop der jaren ook bijkomen.
+WERKSESSIES_PER_PAGINA = 25
+GEBRUIKERS_PER_PAGINA = 50
+
+def pagina_argument(naam, soort=str):
+    waarde = request.args.get(naam, '').strip()
+    try:
+        return soort(waarde) if waarde else None
+    except ValueError:
+        return None
+
+def werksessies_pagina():
+    """Eén pagina van de werksessies die de gebruiker mag zien, nieuwste eerst. Gewone gebruikers zien alleen hun
+    eigen werksessies, administrators alle. Met ?zoek= wordt gezocht in naam, datum en deelnemers, met ?voor= begint
+    de pagina onder dat id. Geeft (werksessies, zoekterm, id voor de volgende pagina of None)."""
+    zoek = pagina_argument('zoek')
+    voor = pagina_argument('voor', int)
+    query = Werksessie.query.options(load_only(Werksessie.id, Werksessie.naam, Werksessie.owner, Werksessie.auteurs,
+                                               Werksessie.datum, Werksessie.probleemstelling))
+    if not is_administrator():
+        query = query.filter(Werksessie.owner == current_user.id)
+    if zoek:
+        query = query.filter(or_(Werksessie.naam.contains(zoek, autoescape=True),
+                                 Werksessie.datum.contains(zoek, autoescape=True),
+                                 Werksessie.auteurs.contains(zoek, autoescape=True)))
+    if voor is not None:
+        query = query.filter(Werksessie.id < voor)
+    werksessies = query.order_by(Werksessie.id.desc()).limit(WERKSESSIES_PER_PAGINA + 1).all()
+    volgende = werksessies[WERKSESSIES_PER_PAGINA - 1].id if len(werksessies) > WERKSESSIES_PER_PAGINA else None
+    return werksessies[:WERKSESSIES_PER_PAGINA], zoek, volgende
+
+def gebruikers_pagina():
+    """Eén pagina van de gebruikers op naam, voor de administrator. Met ?gebruiker= wordt op naam gezocht,
+    met ?na= begint de pagina na die naam. Geeft (gebruikers, zoekterm, naam voor de volgende pagina of None)."""
+    zoek = pagina_argument('gebruiker')
+    na = pagina_argument('na')
+    query = User.query
+    if zoek:
+        query = query.filter(User.username.contains(zoek, autoescape=True))
+    if na is not None:
+        query = query.filter(User.username > na)
+    gebruikers = query.order_by(User.username).limit(GEBRUIKERS_PER_PAGINA + 1).all()
+    volgende = gebruikers[GEBRUIKERS_PER_PAGINA - 1].username if len(gebruikers) > GEBRUIKERS_PER_PAGINA else None
+    return gebruikers[:GEBRUIKERS_PER_PAGINA], zoek, volgende
 
 def werksessie_required(f):
     @wraps(f)
@@ -370,7 +881,7 @@ def werksessie_required(f):
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.role == 1:
+        if not is_administrator():
             return render_template('error.html', melding='Onvoldoende rechten', tekst='Alleen administrators mogen deze handeling uitvoeren.')
         return f(*args, **kwargs)
     return decorated_function
@@ -381,7 +892,16 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user:
-            if bcrypt.check_password_hash(user.password, form.password.data):
+            if wachtwoorden.controleer(user.password, form.password.data):
+                if rondes_van(user.password) != app.config['BCRYPT_LOG_ROUNDS']:
+                    # De werkfactor is gewijzigd sinds dit wachtwoord is opgeslagen. Nu het wachtwoord bekend is,
+                    # kan de hash worden vervangen door een hash met de huidige werkfactor.
+                    gebruiker_id = user.id
+                    user.password = hash_wachtwoord(form.password.data)
+                    if not commit_to_database_success():
+                        # De sessie is teruggedraaid, de oude hash staat er nog en blijft geldig. Het inloggen gaat
+                        # door; bij een volgende login wordt de hash opnieuw vervangen.
+                        print(f'*** Kon de nieuwe wachtwoordhash van gebruiker {gebruiker_id} niet opslaan')
                 login_user(user)
                 Verander_werksessie(user.active_session)
                 return redirect(url_for('intro'))
@@ -389,16 +909,36 @@ def login():
                         maintainer=MAINTAINER, 
                         maintainer_email=MAINTAINER_EMAIL)
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics van alle workers samen, in het tekstformaat van Prometheus."""
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        # Zonder token alleen voor een scraper op dezelfde machine, en niet via een proxy.
+        abort(403)
+    return Response(metrics.tekst(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/info')
 def info():
     db_config_cleaned = db_config
     db_config_cleaned["password"] = "***"
     db_config_cleaned.update({"password":"***",
                         "pool size": db.engine.pool.size()})
+    beheerder = is_administrator()
     return render_template('info.html',
                            maintainer=MAINTAINER, 
                            maintainer_email=MAINTAINER_EMAIL,
-                           db_config=db_config_cleaned)
+                           db_config=db_config_cleaned,
+                           strategieen=STRATEGIEEN.values(),
+                           catalogus=get_catalogus(),
+                           # De interne gegevens van deze worker alleen voor administrators, net als /metrics
+                           # alleen vanaf deze machine of met token.
+                           caches={'Gescoorde instrumentlijsten': aanbevelingen_cache.stats(),
+                                   'Tag hits per werksessie': sessiescores.stats(),
+                                   'Ingelogde gebruikers': gebruikers_cache.stats()} if beheerder else None,
+                           wachtwoorden=wachtwoorden.stats() if beheerder else None)
 
 @app.route('/logout', methods=['GET', 'POST'])
 @login_required
@@ -410,9 +950,10 @@ def logout():
 @admin_required
 def make_admin(user_id):
     """Maakt van deze gebruiker een administrator."""
-    if current_user.role == 1:
+    if is_administrator():
         User.query.filter_by(id=user_id).first().role = 1
         if commit_to_database_success():
+            invalideer_gebruiker(user_id)
             return redirect(url_for('account'))
         else:
             return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
@@ -423,9 +964,10 @@ def make_admin(user_id):
 @admin_required
 def make_user(user_id):
     """Maakt van deze gebruiker een gewone gebruiker (geen admin)."""
-    if current_user.role == 1 and user_id > 2: # User 0 en 1 moeten admin blijven.
+    if is_administrator() and user_id > 2: # User 0 en 1 moeten admin blijven.
         User.query.filter_by(id=user_id).first().role = 0
         if commit_to_database_success():
+            invalideer_gebruiker(user_id)
             return redirect(url_for('account'))
         else:
             return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
@@ -435,11 +977,12 @@ def make_user(user_id):
 @app.route('/delete_user/<int:user_id>')
 @admin_required
 def delete_user(user_id):
-    if current_user.role == 1:
+    if is_administrator():
         user_to_delete = User.query.filter_by(id=user_id).first()
         if user_to_delete.role != 1:
             db.session.delete(user_to_delete)
             if commit_to_database_success():
+                invalideer_gebruiker(user_id)
                 return redirect(url_for('account'))
             else:
                 return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
@@ -453,7 +996,7 @@ def account():
     if request.method == 'POST':
         if formRegister.submit.data:
             if formRegister.validate_on_submit():
-                hashed_password = bcrypt.generate_password_hash(formRegister.password.data)
+                hashed_password = hash_wachtwoord(formRegister.password.data)
                 new_user = User(username=formRegister.username.data, password=hashed_password, role=0)
                 # role 1 is de admin-rol. Standaard zijn alle nieuwe accounts gewone users.
                 # Bestaande administrators kunnen een nieuwe gebruiker admin maken.
@@ -466,29 +1009,34 @@ def account():
         if formPassword.submit.data:
             if formPassword.validate_on_submit():
                 user_to_update = User.query.filter_by(id=current_user.id).first()
-                hashed_password = bcrypt.generate_password_hash(formPassword.password.data)
+                hashed_password = hash_wachtwoord(formPassword.password.data)
                 user_to_update.password = hashed_password
                 # Schrijf het wachtwoord naar de database
                 if commit_to_database_success():
+                    invalideer_gebruiker(current_user.id)
                     return redirect(url_for('account'))
                 else:
                     return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
     
+    users, gebruiker_zoek, volgende_gebruiker = gebruikers_pagina() if is_administrator() else ([], None, None)
     return render_template('account.html', 
                             formRegister=formRegister, 
                             formPassword=formPassword, 
-                            users=User.query.order_by(User.username))
+                            users=users,
+                            gebruiker_zoek=gebruiker_zoek,
+                            volgende_gebruiker=volgende_gebruiker)
 
 
 @app.route('/reset_user_password/<int:user_id>')
 @admin_required
 def resetUserPassword(user_id):
     new_password = ''.join((random.choice('QWERTYUIOPASDFGHJKLZXCVBNM1234567890') for i in range(8)))
-    hashed_password = bcrypt.generate_password_hash(new_password)
+    hashed_password = hash_wachtwoord(new_password)
     user_to_update = User.query.filter_by(id=user_id).first()
     user_to_update.password = hashed_password
 
     if commit_to_database_success():
+        invalideer_gebruiker(user_id)
         return render_template('reset_user_password.html', password=new_password, username=user_to_update.username)
     else:
         return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
@@ -498,43 +1046,34 @@ def resetUserPassword(user_id):
 @login_required
 def intro():
     huidige_werksessie = Werksessie.query.get(current_user.active_session)
-    alle_werksessies = Beperk_werksessies(Werksessie.query.order_by(Werksessie.id).all())
+    werksessies, zoek, volgende = werksessies_pagina()
     return render_template('intro.html', 
                            werksessie=huidige_werksessie,
                            maintainer=MAINTAINER, 
                            maintainer_email=MAINTAINER_EMAIL,
-                           werksessies=alle_werksessies,
+                           werksessies=werksessies,
+                           zoek=zoek,
+                           volgende=volgende,
                            actieve_werksessie=current_user.active_session)
 
 @app.route('/maintenance')
 @admin_required
 def maintenance():
-    for optie in Optie.query.order_by(Optie.id).all():
-        if optie.vraag_id==None:
-            Optie.query.filter_by(id=optie.id).delete()
-    
-    #Onderstaande onderhoud hoeft denk ik niet, want vragen hoeven niet nooodzakelijk tot een categorie te behoren.
-    for vraag in Vraag.query.order_by(Vraag.id).all():
-        if vraag.categorie_id==None:
-            Vraag.query.filter_by(id=vraag.id).delete()
-
-    werksessie = Werksessie.query.get_or_404(current_user.active_session)
-    alle_instrumenten=Instrument.query.order_by(Instrument.naam).all()
-
-
-    if commit_to_database_success():
-        return render_template('questionnaire.html',
-                           werksessie=werksessie,
-                           instrumenten=get_instruments(alle_instrumenten, werksessie),
-                           categorieen=Categorie.query.order_by(Categorie.naam).all())
-    else:
-        return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
+    try:
+        resultaten = voer_onderhoud_uit()
+    except Exception as err:
+        print(f'Exception {err}')
+        return render_template('error.html', melding='Database', tekst='Het onderhoud van de database is mislukt. Misschien is er een probleem met de database?')
+    return render_template('maintenance.html',
+                           resultaten=resultaten,
+                           geschiedenis=onderhoud.geschiedenis(db.engine),
+                           interval=ONDERHOUD_INTERVAL)
 
 @app.route('/start_fresh')  # Met deze functie wordt de huidige werksessie gewist: alle gegeven antwoorden worden weer open gesteld.
 @login_required
 def start_fresh():
     try:
-        werksessie = Werksessie.query.get_or_404(current_user.active_session)
+        werksessie = get_werksessie_or_404(current_user.active_session)
     except:
         werksessie = Werksessie(naam="Start")
         db.session.add(werksessie)
@@ -542,25 +1081,47 @@ def start_fresh():
     werksessie.geselecteerde_opties = []
 
     # Open antwoorden wissen
-    for motivatie in werksessie.motivaties:
+    for motivatie in list(werksessie.motivaties):
         werksessie.motivaties.remove(motivatie)
         db.session.delete(motivatie)
 
-    alle_instrumenten=Instrument.query.order_by(Instrument.naam).all()
     if commit_to_database_success():
+        invalideer_aanbevelingen(werksessie.id)
+        catalogus = get_catalogus()
         return render_template('questionnaire.html',
                            werksessie=werksessie,
-                           instrumenten=get_instruments(alle_instrumenten, werksessie),
-                           categorieen=Categorie.query.order_by(Categorie.naam).all())
+                           instrumenten=get_instruments(catalogus, werksessie),
+                           vragenlijst=vragenlijst(catalogus, werksessie))
     else:
         return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
     
 
+def wijzig_instellingen(**wijzigingen):
+    instellingen = Instellingen.query.get(1)
+    if instellingen is None:
+        catalogus = get_catalogus()
+        instellingen = Instellingen(id=1, methode=catalogus.methode, marge=catalogus.marge)
+        db.session.add(instellingen)
+    for veld, waarde in wijzigingen.items():
+        setattr(instellingen, veld, waarde)
+    verhoog_catalogus_versie()
+    return commit_to_database_success()
+
 @app.route('/change_method/<int:new_method>')
 @admin_required
 def change_sorting_method(new_method):
-    METHOD = new_method
-    return f'Huidige methode van selectie: {str(METHOD)}.'
+    if new_method not in STRATEGIEEN:
+        return render_template('error.html', melding='Onbekende methode', tekst=f'Er is geen methode met nummer {new_method}.')
+    if not wijzig_instellingen(methode=new_method):
+        return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
+    return f'Huidige methode van selectie: {STRATEGIEEN[get_catalogus().methode].naam}.'
+
+@app.route('/change_margin/<int:new_margin>')
+@admin_required
+def change_margin(new_margin):
+    if not wijzig_instellingen(marge=new_margin):
+        return render_template('error.html', melding='Database', tekst='Probleem met schrijven naar de database')
+    return f'Huidige marge: {get_catalogus().marge}.'
 
 @app.route('/add_session')
 @login_required
@@ -584,9 +1145,8 @@ def add_session():
 @werksessie_required
 def case():
     huidige_werksessie = Werksessie.query.get_or_404(current_user.active_session)
-    alle_werksessies = Beperk_werksessies(Werksessie.query.order_by(Werksessie.id).all())
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    alle_categorieen = Categorie.query.order_by(Categorie.naam).all()
+    werksessies, zoek, volgende = werksessies_pagina()
+    catalogus = get_catalogus()
     form = WerksessieForm(naam=huidige_werksessie.naam, 
                           auteurs=huidige_werksessie.auteurs,
                           datum=huidige_werksessie.datum,
@@ -607,9 +1167,10 @@ def case():
     return render_template('case.html',
                                 form=form,
                                 werksessie=huidige_werksessie, 
-                                werksessies=alle_werksessies,
-                                instrumenten=alle_instrumenten, 
-                                categorieen=alle_categorieen,
+                                werksessies=werksessies,
+                                zoek=zoek,
+                                volgende=volgende,
+                                categorieen=catalogus.categorieen,
                                 actieve_werksessie=current_user.active_session)
 
 @app.route('/case/<int:werksessie_id>/showinstruments/<int:enabled>')
@@ -638,11 +1199,11 @@ def activate_session(sessie_id):
 @login_required
 @werksessie_required
 def delete_session(sessie_id):
-    werksessie_to_delete = Werksessie.query.get_or_404(current_user.active_session)
-    if (werksessie_to_delete.owner != current_user.id) and (current_user.role != 1):
+    werksessie_to_delete = get_werksessie_or_404(current_user.active_session)
+    if (werksessie_to_delete.owner != current_user.id) and not is_administrator():
         return render_template('error.html', melding='Mag de werksessie niet verwijderen', tekst='Het verwijderen van de werksessie is mislukt. Alleen de eigenaar of een administrator mag deze werksessie verwijderen.')
 
-    for motivatie in werksessie_to_delete.motivaties:
+    for motivatie in list(werksessie_to_delete.motivaties):
         werksessie_to_delete.motivaties.remove(motivatie)
         db.session.delete(motivatie)
 
@@ -650,6 +1211,7 @@ def delete_session(sessie_id):
     Verander_werksessie(None)
 
     if commit_to_database_success():
+        invalideer_aanbevelingen(werksessie_to_delete.id)
         return redirect(url_for('intro'))
     else:
         return render_template('error.html', melding='Kan werksessie niet verwijderen', tekst='Het verwijderen van de werksessie is mislukt. Misschien is er iets mis met de database?')
@@ -661,64 +1223,39 @@ def delete_session(sessie_id):
 @werksessie_required
 def questionnaire():
     # Deze nieuwe implementatie van de keuzehulp is om motivaties toe te laten.
-    werksessie = Werksessie.query.get_or_404(current_user.active_session)
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
+    werksessie = get_werksessie_or_404(current_user.active_session)
     
     if request.method == 'POST':
-        # Als er een antwoord is gegeven door op Bevestigen te klikken
-        selected_question = Vraag.query.get_or_404(request.form["vraag"])
-        selected_options = request.form.getlist('optie')
-
-        # Eerst alle opties even wissen voor deze vraag.
-        for option_to_remove in selected_question.opties:
-            if option_to_remove in werksessie.geselecteerde_opties:
-                werksessie.geselecteerde_opties.remove(option_to_remove)
-        
-        if commit_to_database_success():
-            pass
-        else:
-            return render_template('error.html', melding='Kan de oude opties niet wissen', tekst='De oude opties kunnen niet worden gewist. Misschien is er een probleem met de database?')   
-
-        # Dan alle geselecteerde opties weer aan zetten.
-        for optie_id in selected_options:
-            werksessie.geselecteerde_opties.append(Optie.query.get_or_404(optie_id))
-
-        if commit_to_database_success():
-            pass
-        else:
-            return render_template('error.html', melding='Kan de niuewe opties niet toevoegen', tekst='De nieuwe opties kunnen niet worden toegevoegd. Misschien is er een probleem met de database?')   
-
-
-        # Bestaande motivaties wissen
-        for motivatie in werksessie.motivaties:
-            if motivatie.vraag == int(request.form["vraag"]):
-                werksessie.motivaties.remove(motivatie)
-                if commit_to_database_success():
-                    pass
-                else:
-                    pass # Soms lukt het niet de bestaande motivatie te wissen. Nu faalt hij stilletjes, dat is niet goed.
-                    #return render_template('error.html', melding='Kan de motivatie niet opslaan', tekst=f'De motivatie kon niet worden opgeslagen. Misschien is er een probleem met de database? Hier ging het mis: {motivatie.vraag}={int(request.form["vraag"])}')
-
-        # Nieuwe motivatie toevoegen
-        motivatie = Motivaties(motivatie=request.form["motivatie"], vraag=request.form["vraag"])
-        werksessie.motivaties.append(motivatie)
-        db.session.add(motivatie)
+        # Als er een antwoord is gegeven door op Bevestigen te klikken. Een formulier met ontbrekende velden of
+        # met id's die geen getal zijn komt niet van de keuzehulp zelf.
+        try:
+            vraag_id = int(request.form['vraag'])
+            optie_ids = [int(optie_id) for optie_id in request.form.getlist('optie')]
+            motivatie = request.form['motivatie']
+        except (KeyError, ValueError):
+            abort(400)
+        vraag = get_catalogus().vragen.get(vraag_id)
+        if vraag is None:
+            abort(404)
+        sla_antwoord_op(werksessie, vraag, optie_ids, motivatie)
         if commit_to_database_success():
+            invalideer_aanbevelingen(werksessie.id)
             return redirect(url_for('questionnaire'))
         else:
-            return render_template('error.html', melding='Kan de motivatie niet opslaan', tekst='De motivatie kon niet worden opgeslagen. Misschien is er een probleem met de database?')   
+            return render_template('error.html', melding='Kan het antwoord niet opslaan', tekst='Het antwoord en de motivatie konden niet worden opgeslagen. Er is niets gewijzigd. Misschien is er een probleem met de database?')   
 
+    catalogus = get_catalogus()
     return render_template('questionnaire.html',
                            werksessie=werksessie,
-                           instrumenten=get_instruments(alle_instrumenten, werksessie),
-                           categorieen=Categorie.query.order_by(Categorie.naam).all())
+                           instrumenten=get_instruments(catalogus, werksessie),
+                           vragenlijst=vragenlijst(catalogus, werksessie))
 
 @app.route('/final', methods=['GET', 'POST'])
 @login_required
 @werksessie_required
 def final():
-    huidige_werksessie = Werksessie.query.get_or_404(current_user.active_session)
-    alle_instrumenten=Instrument.query.order_by(Instrument.naam).all()
+    huidige_werksessie = get_werksessie_or_404(current_user.active_session)
+    catalogus = get_catalogus()
     form = WerksessieForm(conclusie=huidige_werksessie.conclusie)
     if request.method == 'POST':
         huidige_werksessie.conclusie = request.form['conclusie']
@@ -731,8 +1268,8 @@ def final():
                             form=form,
                             werksessie=huidige_werksessie, 
                             actieve_werksessie=current_user.active_session,
-                            instrumenten=get_instruments(alle_instrumenten, huidige_werksessie),
-                            categorieen=Categorie.query.order_by(Categorie.naam).all())
+                            instrumenten=get_instruments(catalogus, huidige_werksessie),
+                            categorieen=catalogus.categorieen)
 
 
 
@@ -740,12 +1277,16 @@ def final():
 @login_required
 @werksessie_required
 def checkout():
-    werksessie = Werksessie.query.get_or_404(current_user.active_session)
-    alle_instrumenten=Instrument.query.order_by(Instrument.naam).all()
-    return render_template('export.html',
-                           werksessie=werksessie,
-                           instrumenten=get_instruments(alle_instrumenten, werksessie),
-                           categorieen=Categorie.query.order_by(Categorie.naam).all())
+    werksessie = get_werksessie_or_404(current_user.active_session)
+    catalogus = get_catalogus()
+    etag = pagina_etag('checkout', catalogus.versie, gebruiker_sleutel(), antwoordversie(werksessie))
+    return niet_gewijzigd(etag) or validatie_headers(
+        app.make_response(render_template('export.html',
+                                          werksessie=werksessie,
+                                          geselecteerd={optie.id for optie in werksessie.geselecteerde_opties},
+                                          instrumenten=get_instruments(catalogus, werksessie),
+                                          categorieen=catalogus.categorieen)),
+        etag)
 
 
 @app.route('/remove_option/<int:optie_id>')
@@ -757,37 +1298,161 @@ def remove_option_from_questionnaire(optie_id):
     werksessie.geselecteerde_opties.remove(option_to_remove)
 
     if commit_to_database_success():
+        invalideer_aanbevelingen(werksessie.id)
         return redirect(url_for('questionnaire'))
     else:
         return render_template('error.html', melding='Kan optie niet deselecteren', tekst='De optie kan niet worden gedeselecteerd. Misschien is er een probleem met de database?')   
 
+# JSON-versie van de keuzehulp. De pagina stuurt een antwoord met fetch en werkt daarna alleen de lijst met
+# instrumenten, de actieve tags en de kop van de vraag bij, in plaats van een redirect en een complete nieuwe pagina.
+# Alleen application/json wordt geaccepteerd: een andere site kan dat niet zonder CORS-toestemming versturen,
+# dus een CSRF-token is niet nodig. Lukt er iets niet, dan verstuurt de pagina het formulier alsnog gewoon.
+def aanbevelingen_json(catalogus, werksessie, gekozen):
+    instrumenten = [{'id': instrument[0].id,
+                     'naam': instrument[0].naam,
+                     'url': url_for('instrument', id=instrument[0].id),
+                     'tag_hits': instrument[1],
+                     'plustags': [tag.naam for tag in instrument[2]],
+                     'extag_hits': instrument[3],
+                     'mintags': [tag.naam for tag in instrument[4]],
+                     'prioriteit': instrument[5],
+                     'klasse': PRIORITEITSKLASSEN[instrument[6]]}
+                    for instrument in get_instruments(catalogus, werksessie, gekozen)]
+    actieve_tags = [tag.naam for tag in catalogus.tags_van_opties(sorted(gekozen))]
+    return {'instrumenten': instrumenten, 'actieve_tags': actieve_tags}
+
+@app.route('/api/aanbevelingen')
+@login_required
+@werksessie_required
+def api_aanbevelingen():
+    werksessie = Werksessie.query.get_or_404(current_user.active_session)
+    return jsonify(aanbevelingen_json(get_catalogus(), werksessie, gekozen_opties(werksessie.id)))
+
+@app.route('/api/antwoord', methods=['POST'])
+@login_required
+@werksessie_required
+def api_antwoord():
+    """Slaat het antwoord op één vraag op, net als een POST naar /questionnaire. Verwacht
+    {"vraag": id, "opties": [id, ...], "motivatie": tekst} en geeft de gekozen opties van de vraag en de nieuwe
+    lijst met instrumenten terug."""
+    if not request.is_json:
+        abort(415)
+    antwoord = request.get_json()
+    catalogus = get_catalogus()
+    try:
+        vraag = catalogus.vragen.get(int(antwoord['vraag']))
+        optie_ids = [int(optie_id) for optie_id in antwoord.get('opties', [])]
+        motivatie = antwoord.get('motivatie', '')
+    except (AttributeError, KeyError, TypeError, ValueError):
+        abort(400)
+    # Net als het tekstvak op de vragenlijst (maxlength) hooguit MOTIVATIE_LENGTE tekens; null of een getal is geen
+    # motivatie.
+    if not isinstance(motivatie, str) or len(motivatie) > MOTIVATIE_LENGTE:
+        abort(400)
+    if vraag is None:
+        abort(404)
+    # Zonder de gekozen opties en hun tags als objecten; alleen de id's zijn nodig.
+    werksessie = Werksessie.query.options(selectinload(Werksessie.motivaties)).get_or_404(current_user.active_session)
+    gekozen = sla_antwoord_op(werksessie, vraag, optie_ids, motivatie)
+    if not commit_to_database_success():
+        return jsonify(melding='Het antwoord en de motivatie konden niet worden opgeslagen.'), 500
+    invalideer_aanbevelingen(werksessie.id)
+
+    uitkomst = aanbevelingen_json(catalogus, werksessie, gekozen)
+    uitkomst.update(vraag=vraag.id,
+                    motivatie=motivatie != '',
+                    antwoorden=[{'naam': optie.naam,
+                                 'verwijderen': url_for('remove_option_from_questionnaire', optie_id=optie.id)}
+                                for optie in vraag.opties if optie.id in gekozen])
+    return jsonify(uitkomst)
+
+# Wat-als-scenario's voor administrators, zie watals.py. Alleen de momentopname van de catalogus wordt gebruikt;
+# er wordt geen werksessie aangemaakt en niets in associations_OS geschreven.
+def evalueer_scenarios(scenarios, top):
+    """Scoort de scenario's uit watals.lees. top is het aantal instrumenten per scenario, 0 is alle instrumenten."""
+    begin = time.perf_counter()
+    uitkomst = watals.evalueer(get_catalogus(), scenarios, top or None)
+    metrics.observe('interventie_whatif_seconds', time.perf_counter() - begin)
+    return uitkomst
+
+@app.route('/api/watals', methods=['POST'])
+@login_required
+@admin_required
+def api_watals():
+    """Geeft de ranglijst van instrumenten voor elk scenario. De scenario's komen als JSON-body, als CSV-body of als
+    geüpload bestand (veld scenarios). Met top (standaard 10, 0 is alle instrumenten) en formaat=csv als
+    query- of formulierparameter."""
+    try:
+        top = int(request.values.get('top', 10))
+        if 'scenarios' in request.files:
+            tekst = request.files['scenarios'].read().decode('utf-8')
+        else:
+            tekst = request.get_data(as_text=True)
+        if top < 0:
+            raise ValueError
+    except (UnicodeDecodeError, ValueError):
+        abort(400)
+    try:
+        scenarios = watals.lees(tekst)
+    except watals.OngeldigeScenarios as err:
+        return jsonify(melding=str(err)), 400
+    # Het request wordt direct doorgerekend, dus het werk en de omvang van het antwoord zijn begrensd: met top=0 komen
+    # alle instrumenten in elke ranglijst en mogen er minder scenario's per keer.
+    instrumenten = len(get_catalogus().matrix.instrumenten)
+    per_scenario = max(min(top, instrumenten) if top else instrumenten, 1)
+    maximum = min(WATALS_MAX_SCENARIOS, WATALS_MAX_RIJEN // per_scenario)
+    if len(scenarios) > maximum:
+        return jsonify(melding=f'Maximaal {maximum} scenario\'s per keer met {per_scenario} instrumenten per '
+                               f'scenario; kies een kleinere top of splits de scenario\'s.'), 413
+    uitkomst = evalueer_scenarios(scenarios, top)
+    if request.values.get('formaat') == 'csv':
+        return Response(watals.naar_csv(uitkomst), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=watals.csv'})
+    return jsonify(uitkomst)
+
+@app.cli.command('watals')
+@click.argument('bestand', type=click.File('r', encoding='utf-8'))
+@click.option('--top', default=10, show_default=True, help='Aantal instrumenten per scenario; 0 is alle instrumenten.')
+@click.option('--formaat', type=click.Choice(['csv', 'json']), default='csv', show_default=True)
+def watals_commando(bestand, top, formaat):
+    """Geeft de ranglijst van instrumenten voor elk scenario in BESTAND (JSON of CSV, - is stdin)."""
+    schema_bijwerken()
+    begin = time.perf_counter()
+    try:
+        uitkomst = evalueer_scenarios(watals.lees(bestand.read()), top)
+    except watals.OngeldigeScenarios as err:
+        raise click.ClickException(str(err))
+    duur = time.perf_counter() - begin
+    if formaat == 'csv':
+        click.echo(watals.naar_csv(uitkomst), nl=False)
+    else:
+        click.echo(json.dumps(uitkomst, indent=2, ensure_ascii=False))
+    click.echo(f'{len(uitkomst["scenarios"])} scenario\'s in {1000 * duur:.0f} ms', err=True)
+
 @app.route('/summary')
 def instrumenten_summary():
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    alle_categorieen = Categorie.query.order_by(Categorie.naam).all()
-    return render_template('instrumenten_summary.html', 
-                           instrumenten=alle_instrumenten, 
-                           categorieen=alle_categorieen)
+    catalogus = get_catalogus()
+    etag = pagina_etag('summary', catalogus.versie, gebruiker_sleutel())
+    return niet_gewijzigd(etag, catalogus.gewijzigd) or validatie_headers(
+        app.make_response(render_template('instrumenten_summary.html', 
+                                          instrumenten=catalogus.instrumenten, 
+                                          categorieen=catalogus.categorieen)),
+        etag, catalogus.gewijzigd)
 
 @app.route('/export_all_instruments')
 def export_all_instruments():
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    catalogus = export_catalogus_to_word(alle_instrumenten, filename='temp.docx')
-    return send_file(catalogus, as_attachment=True, download_name='catalogus.docx')
+    catalogus = get_catalogus()
+    return start_artefact(catalogus, f'catalogus-{catalogus.versie}', 'catalogus.docx', catalogus.instrumenten)
 
 @app.route('/instrument/<int:id>')
 def instrument(id):
-    current_instrument = Instrument.query.get_or_404(id)
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    for i in alle_instrumenten:
-        i.intro=bleach.clean(i.intro)
-        i.beschrijving=bleach.clean('' if i.beschrijving is None else i.beschrijving).replace('\n', '<br>')
-        i.afwegingen=bleach.clean('' if i.afwegingen is None else i.afwegingen).replace('\n', '<br>')
-        i.voorbeelden=bleach.clean('' if i.voorbeelden is None else i.voorbeelden).replace('\n', '<br>')
-        i.links=bleach.clean('' if i.links is None else i.links).replace('\n', '<br>')
-        i.eigenaar=bleach.clean('' if i.eigenaar is None else i.eigenaar)
-        i.eigenaar_email=bleach.clean('' if i.eigenaar_email is None else i.eigenaar_email)
-    return render_template('/instrument.html', instrument=current_instrument, instrumenten=alle_instrumenten)
+    catalogus = get_catalogus()
+    if catalogus.instrument(id) is None:
+        abort(404)
+    etag = pagina_etag('instrument', id, catalogus.versie, gebruiker_sleutel())
+    return niet_gewijzigd(etag, catalogus.gewijzigd) or validatie_headers(
+        app.make_response(render_template('/instrument.html', instrument=catalogus.weergave(id))),
+        etag, catalogus.gewijzigd)
 
 @app.route('/instrument_add', methods=['GET', 'POST'])
 @admin_required
@@ -803,22 +1468,22 @@ def add_instrument():
                                        eigenaar_email=request.form['eigenaar_email']
                                        )
         db.session.add(new_instrument)
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('add_tag_to_instrument', id=new_instrument.id))
         else:
             return render_template('error.html', melding='Kan instrument niet opslaan', tekst='Het opslaan van het instrument is mislukt. Misschien is er een probleem met de database?')
     
     form = InstrumentForm()
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
     return render_template('add_instrument.html',
-                            form=form, 
-                            instrumenten=alle_instrumenten)
+                            form=form)
 
 @app.route('/instrument_delete/<int:id>')
 @admin_required
 def delete_instrument(id):
     instrument_to_delete = Instrument.query.get_or_404(id)
     db.session.delete(instrument_to_delete)
+    verhoog_catalogus_versie()
     if commit_to_database_success():
         return redirect(url_for('instrumenten_summary'))
     else:
@@ -839,6 +1504,7 @@ def update_instrument(id):
         instrument_to_edit.eigenaar=request.form['eigenaar']
         instrument_to_edit.eigenaar_email=request.form['eigenaar_email']
 
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('instrument', id=id ))
         else:
@@ -854,7 +1520,6 @@ def update_instrument(id):
                             eigenaar_email=instrument_to_edit.eigenaar_email)
     return render_template('/add_instrument.html', 
                             instrument=instrument_to_edit, 
-                            instrumenten=Instrument.query.order_by(Instrument.naam).all(), 
                             form=form)
 
 @app.route('/instrument_tags/<int:id>')
@@ -869,8 +1534,10 @@ def add_tag_to_instrument(id, tag_id=-1):
         tag_to_add = Tag.query.get_or_404(tag_id)
         if tag_to_add in instrument_to_edit.extags:
             instrument_to_edit.extags.remove(tag_to_add)
-        instrument_to_edit.tags.append(tag_to_add) 
+        if tag_to_add not in instrument_to_edit.tags:
+            instrument_to_edit.tags.append(tag_to_add)
 
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             pass
         else:
@@ -880,8 +1547,10 @@ def add_tag_to_instrument(id, tag_id=-1):
         tag_to_add = Tag.query.get_or_404(tag_id)
         if tag_to_add in instrument_to_edit.tags:
             instrument_to_edit.tags.remove(tag_to_add)
-        instrument_to_edit.extags.append(tag_to_add) 
+        if tag_to_add not in instrument_to_edit.extags:
+            instrument_to_edit.extags.append(tag_to_add)
 
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             pass
         else:
@@ -894,19 +1563,22 @@ def add_tag_to_instrument(id, tag_id=-1):
         if tag_to_delete in instrument_to_edit.extags:
             instrument_to_edit.extags.remove(tag_to_delete)
 
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             pass
         else:
             return render_template('error.html', melding='Kan tag niet verwijderen', tekst='Het verwijderen van de tag van het instrument is mislukt. Misschien is er een probleem met de database?')
 
+    catalogus = get_catalogus()
+    plustags = {tag.id for tag in instrument_to_edit.tags}
+    mintags = {tag.id for tag in instrument_to_edit.extags}
     selected_tags = []
-    for tag in Tag.query.order_by(Tag.naam).all():
-        selected_tags.append([tag.id, tag.naam, tag in instrument_to_edit.tags, tag in instrument_to_edit.extags])
+    for tag in catalogus.tags:
+        selected_tags.append([tag.id, tag.naam, tag.id in plustags, tag.id in mintags])
 
     return render_template('instrument_tags.html', 
                             instrument=instrument_to_edit, 
-                            tags=selected_tags,
-                            instrumenten=Instrument.query.order_by(Instrument.naam).all())
+                            tags=selected_tags)
 
 @app.route('/tags', methods=['GET', 'POST'])
 @admin_required
@@ -915,20 +1587,21 @@ def tags():
         tag_name = request.form['Tag']
         new_tag = Tag(naam=tag_name)
         db.session.add(new_tag)
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('tags'))
         else:
             return render_template('error.html', melding='Kan tag niet opslaan', tekst='Het opslaan van de tag is mislukt. Misschien is er een probleem met de database?')
 
-    alle_tags = Tag.query.order_by(Tag.naam).all()
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    return render_template('tags.html', tags=alle_tags, instrumenten=alle_instrumenten)
+    catalogus = get_catalogus()
+    return render_template('tags.html', tags=catalogus.tags)
 
 @app.route('/tag_delete/<int:id>')
 @admin_required
 def delete_tag(id):
     tag_to_delete = Tag.query.get_or_404(id)
     db.session.delete(tag_to_delete)
+    verhoog_catalogus_versie()
     if commit_to_database_success():
         return redirect(url_for('tags'))
     else:
@@ -941,26 +1614,23 @@ def update_tag(id):
 
     if request.method == 'POST':
         tag_to_update.naam = request.form['Tag']
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('tags'))
         else:
             return render_template('error.html', melding='Kan tag niet hernoemen', tekst='Het hernoemen van de tag is mislukt. Misschien is er een probleem met de database?')
 
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    return render_template('/update_tag.html', tag=tag_to_update, instrumenten=alle_instrumenten)
+    return render_template('/update_tag.html', tag=tag_to_update)
 
 @app.route('/question_tools', methods=['GET', 'POST'])
 @admin_required
 def question_tools():
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    alle_categorieen = Categorie.query.order_by(Categorie.naam).all()
-    alle_vragen = Vraag.query.order_by(Vraag.categorie_id).all()
-
     if request.method == 'POST':
         if request.form['submit_button'] == 'Categorie toevoegen':
             categorie_name = request.form['Categorie']
             new_categorie = Categorie(naam=categorie_name)
             db.session.add(new_categorie)
+            verhoog_catalogus_versie()
             if commit_to_database_success():
                 return redirect(url_for('question_tools'))
             else:
@@ -971,15 +1641,16 @@ def question_tools():
             vraag_categorie.vragen.append(new_vraag)
             db.session.add(vraag_categorie)
             db.session.add(new_vraag)
+            verhoog_catalogus_versie()
             if commit_to_database_success():
                 return redirect(url_for('question_tools'))
             else:
                 return render_template('error.html', melding='Kan vraag niet opslaan', tekst='Het opslaan van de vraag is mislukt. Misschien is er een probleem met de database?')
 
+    catalogus = get_catalogus()
     return render_template('question_tools.html', 
-                        categorieen=alle_categorieen, 
-                        vragen=alle_vragen,
-                        instrumenten=alle_instrumenten)
+                        categorieen=catalogus.categorieen, 
+                        vragen=sorted(catalogus.vragen.values(), key=lambda vraag: vraag.categorie_id))
 
 
 @app.route('/categorie_delete/<int:id>')
@@ -987,6 +1658,7 @@ def question_tools():
 def delete_categorie(id):
     categorie_to_delete = Categorie.query.get_or_404(id)
     db.session.delete(categorie_to_delete)
+    verhoog_catalogus_versie()
     if commit_to_database_success():
         return redirect(url_for('question_tools'))
     else:
@@ -998,13 +1670,13 @@ def update_categorie(id):
     categorie_to_update = Categorie.query.get_or_404(id)
     if request.method == 'POST':
         categorie_to_update.naam = request.form['Categorie']
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('question_tools'))
         else:
             return render_template('error.html', melding='Kan categorie niet hernoemen', tekst='Het hernoemen van de categorie is mislukt. Misschien is er een probleem met de database?')
 
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    return render_template('/update_category.html', categorie=categorie_to_update, instrumenten=alle_instrumenten)
+    return render_template('/update_category.html', categorie=categorie_to_update)
 
 @app.route('/question/<int:vraag_id>/update', methods=['GET', 'POST'])
 @admin_required
@@ -1014,13 +1686,14 @@ def question_update(vraag_id):
         nieuwe_categorie = Categorie.query.filter_by(naam=request.form['Categorienaam']).first()
         vraag_to_update.naam = request.form['Vraag']
         vraag_to_update.categorie_id = nieuwe_categorie.id
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('question', vraag_id=vraag_to_update.id))
         else:
             return render_template('error.html', melding='Kan vraag niet wijzigen', tekst='Het wijzigen van de vraag is mislukt. Misschien is er een probleem met de database?')
 
     return render_template('/update_question.html', 
-                        categorieen=Categorie.query.order_by(Categorie.naam).all(), 
+                        categorieen=get_catalogus().categorieen, 
                         vraag=vraag_to_update)
 
 @app.route('/question/<int:vraag_id>/enable_multiselect/<int:enabled>')
@@ -1031,15 +1704,13 @@ def toggle_multiselect(vraag_id, enabled=0):
         vraag_to_update.multiselect = True
     else:
         vraag_to_update.multiselect = False
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
-    alle_categorieen = Categorie.query.order_by(Categorie.naam).all()
-    alle_vragen = Vraag.query.order_by(Vraag.categorie_id).all()
+    verhoog_catalogus_versie()
 
     if commit_to_database_success():
+        catalogus = get_catalogus()
         return render_template('question_tools.html', 
-                        categorieen=alle_categorieen, 
-                        vragen=alle_vragen,
-                        instrumenten=alle_instrumenten)
+                        categorieen=catalogus.categorieen, 
+                        vragen=sorted(catalogus.vragen.values(), key=lambda vraag: vraag.categorie_id))
     else:
         return render_template('error.html', melding='Kan vraag niet wijzigen', tekst='Het wijzigen van de vraag is mislukt. Misschien is er een probleem met de database?')
             
@@ -1049,6 +1720,7 @@ def toggle_multiselect(vraag_id, enabled=0):
 def delete_vraag(id):
     vraag_to_delete = Vraag.query.get_or_404(id)
     db.session.delete(vraag_to_delete)
+    verhoog_catalogus_versie()
     if commit_to_database_success():
         return redirect(url_for('question_tools'))
     else:
@@ -1062,6 +1734,7 @@ def question(vraag_id):
     if request.method == 'POST':       
         optie_to_add = Optie(naam=request.form['Optie'])
         huidige_vraag.opties.append(optie_to_add)
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('question', vraag_id=huidige_vraag.id))
         else:
@@ -1069,18 +1742,17 @@ def question(vraag_id):
     
     return render_template('question.html',
                             vraag=huidige_vraag,
-                            categorie=Categorie.query.get_or_404(huidige_vraag.categorie_id),
-                            instrumenten=Instrument.query.order_by(Instrument.naam).all())
+                            categorie=Categorie.query.get_or_404(huidige_vraag.categorie_id))
 
 @app.route('/question/<int:vraag_id>/update_option/<int:option_id>', methods=['GET', 'POST'])
 @admin_required
 def update_option(vraag_id, option_id=0):
     huidige_vraag = Vraag.query.get_or_404(vraag_id)
-    alle_instrumenten = Instrument.query.order_by(Instrument.naam).all()
 
     if request.method == 'POST':       
         optie_to_update = Optie.query.get_or_404(option_id)
         optie_to_update.naam = request.form['Optie']
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             return redirect(url_for('question', vraag_id=huidige_vraag.id))
         else:
@@ -1089,8 +1761,7 @@ def update_option(vraag_id, option_id=0):
 
     return render_template('update_option.html',
                         optie=Optie.query.get_or_404(option_id),
-                        vraag=huidige_vraag,
-                        instrumenten=alle_instrumenten)
+                        vraag=huidige_vraag)
 
 @app.route('/question/<int:vraag_id>/delete_option/<int:option_id>', methods=['GET', 'POST'])
 @admin_required
@@ -1099,6 +1770,7 @@ def delete_option(vraag_id, option_id):
     optie_to_delete.tags=[]
     optie_to_delete.tags_exclusief=[]
     db.session.delete(optie_to_delete)
+    verhoog_catalogus_versie()
     if commit_to_database_success():
         return redirect(url_for('question', vraag_id=vraag_id, option_id=option_id))
     else:
@@ -1113,22 +1785,28 @@ def add_tag_to_option(vraag_id, option_id, tag_id=-1):
     option_to_edit = Optie.query.get_or_404(option_id)
     if "add_tag" in request.path:
         tag_to_add = Tag.query.get_or_404(tag_id)
-        option_to_edit.tags.append(tag_to_add) 
+        if tag_to_add not in option_to_edit.tags:
+            option_to_edit.tags.append(tag_to_add)
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             pass
         else:
             return render_template('error.html', melding='Kan tag niet toevoegen', tekst='Het toevoegen van de tag is mislukt. Misschien is er een probleem met de database?')
     elif "delete_tag" in request.path:
         tag_to_delete = Tag.query.get_or_404(tag_id)
-        option_to_edit.tags.remove(tag_to_delete) 
+        if tag_to_delete in option_to_edit.tags:
+            option_to_edit.tags.remove(tag_to_delete)
+        verhoog_catalogus_versie()
         if commit_to_database_success():
             pass
         else:
             return render_template('error.html', melding='Kan tag niet verwijderen', tekst='Het verwijderen van de tag is mislukt. Misschien is er een probleem met de database?')
 
+    catalogus = get_catalogus()
+    optietags = {tag.id for tag in option_to_edit.tags}
     selected_tags = []
-    for tag in Tag.query.order_by(Tag.naam).all():
-        selected_tags.append([tag.id, tag.naam, tag in option_to_edit.tags])
+    for tag in catalogus.tags:
+        selected_tags.append([tag.id, tag.naam, tag.id in optietags])
     if request.method == 'POST':     
         if commit_to_database_success():
             pass
@@ -1138,30 +1816,91 @@ def add_tag_to_option(vraag_id, option_id, tag_id=-1):
     return render_template('option_tags.html', 
                             vraag=huidige_vraag,
                             optie=option_to_edit, 
-                            tags=selected_tags,
-                            instrumenten=Instrument.query.order_by(Instrument.naam).all())
+                            tags=selected_tags)
 
 
 
+def werksessie_voor_export(werksessie, catalogus):
+    """Platte kopie van de werksessie die naar het exportproces kan. De gekozen opties komen uit de momentopname."""
+    return WerksessieExport(naam=werksessie.naam,
+                            datum=werksessie.datum,
+                            auteurs=werksessie.auteurs,
+                            probleemstelling=werksessie.probleemstelling,
+                            conclusie=werksessie.conclusie,
+                            geselecteerde_opties=tuple(catalogus.opties[optie.id] for optie in werksessie.geselecteerde_opties
+                                                       if optie.id in catalogus.opties),
+                            motivaties=tuple(MotivatieExport(m.vraag, m.motivatie) for m in werksessie.motivaties))
+
+def start_export(soort, downloadnaam, eigenaar, *args):
+    """Zet een export klaar en stuurt de gebruiker door naar de pagina die wacht tot het document klaar is."""
+    try:
+        taak_id = exporttaken.start(soort, downloadnaam, eigenaar, *args)
+    except ExportWachtrijVol:
+        return render_template('error.html', melding='Te veel exports tegelijk', tekst='Er worden op dit moment te veel documenten gemaakt. Probeer het over een minuut opnieuw.'), 503
+    return redirect(url_for('export_taak', taak_id=taak_id))
+
+def start_artefact(catalogus, sleutel, downloadnaam, instrumenten):
+    """Export van (een deel van) de catalogus. Die wordt per catalogusversie één keer gemaakt; is het document er
+    al, dan wordt het meteen verstuurd. Heeft de client het document van deze versie al, dan volgt een 304."""
+    etag = pagina_etag(sleutel)
+    antwoord = niet_gewijzigd(etag, catalogus.gewijzigd, publiek=True)
+    if antwoord is not None:
+        return antwoord
+    try:
+        taak_id = exporttaken.artefact(sleutel, 'catalogus', downloadnaam, instrumenten)
+    except ExportWachtrijVol:
+        return render_template('error.html', melding='Te veel exports tegelijk', tekst='Er worden op dit moment te veel documenten gemaakt. Probeer het over een minuut opnieuw.'), 503
+    taak = exporttaken.status(taak_id)
+    if taak is not None and taak['status'] == KLAAR:
+        return validatie_headers(send_file(exporttaken.bestand(taak_id), mimetype=DOCX_MIMETYPE, as_attachment=True,
+                                           download_name=downloadnaam, conditional=False, etag=False),
+                                 etag, catalogus.gewijzigd, publiek=True)
+    return redirect(url_for('export_taak', taak_id=taak_id))
+
+def get_exporttaak_or_404(taak_id):
+    """Een export van een werksessie is alleen te zien voor de gebruiker die hem gestart heeft."""
+    taak = exporttaken.status(taak_id)
+    if taak is None:
+        abort(404)
+    if taak['eigenaar'] is not None and (not current_user.is_authenticated or current_user.id != taak['eigenaar']):
+        abort(404)
+    return taak
+
 @app.route('/export_session')
 @login_required
 @werksessie_required
 def export_session_word():
-    werksessie = Werksessie.query.get_or_404(current_user.active_session)
-    alle_instrumenten=Instrument.query.order_by(Instrument.naam).all()
-    categorieen=Categorie.query.order_by(Categorie.naam).all()
-    sessie = export_session_to_word(werksessie=werksessie, 
-                                    vraagcategorieen=categorieen, 
-                                    instrumenten=get_instruments(alle_instrumenten, werksessie), 
-                                    filename='temp.docx')
-    return send_file(sessie, as_attachment=True, download_name=f'Verslag {werksessie.naam}.docx')
+    werksessie = get_werksessie_or_404(current_user.active_session)
+    catalogus = get_catalogus()
+    return start_export('sessie', f'Verslag {werksessie.naam}.docx', current_user.id,
+                        werksessie_voor_export(werksessie, catalogus),
+                        catalogus.categorieen,
+                        get_instruments(catalogus, werksessie))
 
 @app.route('/export_instrument/<int:instrument_id>')
 @login_required
 def export_instrument_word(instrument_id):
-    instrument_to_export = Instrument.query.get_or_404(instrument_id)
-    instrument_word = export_catalogus_to_word([instrument_to_export], filename='temp.docx')
-    return send_file(instrument_word, as_attachment=True, download_name=f'{instrument_to_export.naam}.docx')
+    catalogus = get_catalogus()
+    instrument_to_export = catalogus.instrument(instrument_id)
+    if instrument_to_export is None:
+        abort(404)
+    return start_artefact(catalogus, f'instrument-{instrument_id}-{catalogus.versie}', f'{instrument_to_export.naam}.docx', [instrument_to_export])
+
+@app.route('/export/<taak_id>')
+def export_taak(taak_id):
+    return render_template('export_job.html', taak_id=taak_id, taak=get_exporttaak_or_404(taak_id))
+
+@app.route('/export/<taak_id>/status')
+def export_taak_status(taak_id):
+    taak = get_exporttaak_or_404(taak_id)
+    return jsonify(status=taak['status'], download=url_for('export_taak_download', taak_id=taak_id) if taak['status'] == KLAAR else None)
+
+@app.route('/export/<taak_id>/download')
+def export_taak_download(taak_id):
+    taak = get_exporttaak_or_404(taak_id)
+    if taak['status'] != KLAAR:
+        return redirect(url_for('export_taak', taak_id=taak_id))
+    return send_file(exporttaken.bestand(taak_id), mimetype=DOCX_MIMETYPE, as_attachment=True, download_name=taak['downloadnaam'])
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", debug=True)
\ No newline at end of file
@@ -0,0 +1,181 @@
+# Benchmark van de app tegen een lokale SQLite-database met een synthetische catalogus.
+#
+# Gebruik: python benchmarks/bench_app.py --instrumenten 500 --tags 300 --sessies 50
+#          python benchmarks/bench_app.py --vergelijk benchmarks/resultaten/<eerder>.json
+# Gemeten worden get_instruments (koud en met gevulde caches), prioritize_instruments, het renderen van de
+# keuzehulp, export_session_to_word en export_catalogus_to_word. De resultaten komen als JSON in
+# benchmarks/resultaten, met de commit erbij, zodat runs van verschillende commits te vergelijken zijn.
+# Met --vergelijk wordt de mediaan per meting naast die van een eerdere run gezet; de exitcode is 1 als
+# een meting meer dan --drempel keer zo traag is geworden.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetisch
+from scoring import prioritize_instruments
+
+RESULTATEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultaten')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def meet(functie, herhalingen, voorbereiding=None):
+    """Voert functie herhalingen keer uit en geeft statistieken van de duur in milliseconden."""
+    tijden = []
+    for _ in range(herhalingen):
+        if voorbereiding is not None:
+            voorbereiding()
+        begin = time.perf_counter()
+        functie()
+        tijden.append(1000 * (time.perf_counter() - begin))
+    return {'n': len(tijden), 'min': min(tijden), 'mediaan': statistics.median(tijden),
+            'gemiddelde': statistics.mean(tijden), 'max': max(tijden)}
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bereid_app_voor(map):
+    """Importeert app.py met een SQLite-database en exportmappen in map. De omgevingsvariabelen moeten gezet zijn
+    voordat app.py wordt geïmporteerd."""
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(map, 'benchmark.db')
+    os.environ.setdefault('FORCE_HTTPS', 'FALSE')
+    os.environ['EXPORT_DIR'] = os.path.join(map, 'exports')
+    os.environ['EXPORT_WORKERS'] = '0'
+    os.environ['METRICS_DIR'] = os.path.join(map, 'metrics')
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+    import app as A
+    A.app.config['WTF_CSRF_ENABLED'] = False
+    return A
+
+
+def benchmark(args):
+    grootte = {naam: getattr(args, naam) for naam in ('instrumenten', 'tags', 'tags_per_instrument', 'mintags_per_instrument',
+                                                      'categorieen', 'vragen_per_categorie', 'opties_per_vraag', 'tags_per_optie')}
+    rijen = synthetisch.catalogus_rijen(seed=args.seed, **grootte)
+    sessies = synthetisch.antwoorden(synthetisch.catalogus(**grootte, seed=args.seed),
+                                     sessies=args.sessies, fractie=args.fractie, seed=args.seed)
+
+    map = tempfile.mkdtemp(prefix='interventie-benchmark-')
+    A = bereid_app_voor(map)
+    import export
+    import migrations
+
+    with A.app.app_context():
+        A.db.create_all()
+        A.db.session.add(A.User(id=1, username='benchmark', password=A.bcrypt.generate_password_hash('benchmark'), role=1))
+        A.db.session.commit()
+        werksessie_ids = synthetisch.vul_database(A, rijen, sessies)
+        migrations.migreer(A.db.engine)
+
+    resultaten = {}
+    with A.app.test_request_context():
+        catalogus = A.get_catalogus()
+        werksessies = [A.get_werksessie_or_404(id) for id in werksessie_ids]
+
+        def caches_legen():
+            A.aanbevelingen_cache.invalidate()
+            A.sessiescores.invalidate()
+
+        resultaten['get_instruments koud'] = meet(
+            lambda: [A.get_instruments(catalogus, ws) for ws in werksessies], args.herhalingen, caches_legen)
+        resultaten['get_instruments warm'] = meet(
+            lambda: [A.get_instruments(catalogus, ws) for ws in werksessies], args.herhalingen)
+
+        gescoord = [catalogus.matrix.score(catalogus.matrix.scope(catalogus.tags_van_opties(opties))) for opties in sessies]
+        resultaten['prioritize_instruments'] = meet(
+            lambda: [prioritize_instruments(lijst, catalogus.methode, catalogus.marge) for lijst in gescoord], args.herhalingen)
+
+        werksessie = werksessies[0]
+        instrumenten = A.get_instruments(catalogus, werksessie)
+        gegevens = A.werksessie_voor_export(werksessie, catalogus)
+        resultaten['export_session_to_word'] = meet(
+            lambda: export.export_session_to_word(gegevens, catalogus.categorieen, instrumenten), args.herhalingen)
+        resultaten['export_catalogus_to_word'] = meet(
+            lambda: export.export_catalogus_to_word(catalogus.instrumenten), args.herhalingen)
+
+    client = A.app.test_client()
+    client.post('/login', data={'username': 'benchmark', 'password': 'benchmark'})
+    client.get(f'/activate_session/{werksessie_ids[0]}')
+
+    def keuzehulp():
+        if client.get('/questionnaire').status_code != 200:
+            raise RuntimeError('De keuzehulp geeft geen status 200.')
+    resultaten['questionnaire render'] = meet(keuzehulp, args.herhalingen)
+    shutil.rmtree(map, ignore_errors=True)
+
+    return {'commit': commit(),
+            'tijdstip': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'grootte': dict(grootte, sessies=args.sessies, fractie=args.fractie, seed=args.seed, herhalingen=args.herhalingen),
+            'resultaten': resultaten}
+
+
+def vergelijk(oud, nieuw, drempel):
+    """Drukt de medianen van twee runs naast elkaar af. Geeft True als er een meting boven de drempel is vertraagd."""
+    if oud['grootte'] != nieuw['grootte']:
+        print('*** Let op: de runs zijn met een andere grootte gedaan.')
+    print(f'{"meting":<28}{"oud (ms)":>12}{"nieuw (ms)":>12}{"factor":>9}')
+    trager = False
+    for naam, resultaat in nieuw['resultaten'].items():
+        if naam not in oud['resultaten']:
+            continue
+        factor = resultaat['mediaan'] / oud['resultaten'][naam]['mediaan']
+        markering = ' !' if factor > drempel else ''
+        trager = trager or factor > drempel
+        print(f'{naam:<28}{oud["resultaten"][naam]["mediaan"]:>12.2f}{resultaat["mediaan"]:>12.2f}{factor:>9.2f}{markering}')
+    return trager
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark van de app tegen een synthetische catalogus in SQLite.')
+    parser.add_argument('--instrumenten', type=int, default=200)
+    parser.add_argument('--tags', type=int, default=300)
+    parser.add_argument('--tags-per-instrument', type=int, default=8)
+    parser.add_argument('--mintags-per-instrument', type=int, default=2)
+    parser.add_argument('--categorieen', type=int, default=5)
+    parser.add_argument('--vragen-per-categorie', type=int, default=6)
+    parser.add_argument('--opties-per-vraag', type=int, default=4)
+    parser.add_argument('--tags-per-optie', type=int, default=3)
+    parser.add_argument('--sessies', type=int, default=50)
+    parser.add_argument('--fractie', type=float, default=0.5, help='Fractie van de vragen die per sessie beantwoord is')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--herhalingen', type=int, default=5)
+    parser.add_argument('--uitvoer', help='Pad van het JSON-bestand; standaard in benchmarks/resultaten')
+    parser.add_argument('--vergelijk', help='JSON-bestand van een eerdere run om mee te vergelijken')
+    parser.add_argument('--drempel', type=float, default=1.25, help='Factor waarboven een meting als vertraagd geldt')
+    args = parser.parse_args()
+
+    uitkomst = benchmark(args)
+    uitvoer = args.uitvoer
+    if uitvoer is None:
+        os.makedirs(RESULTATEN, exist_ok=True)
+        uitvoer = os.path.join(RESULTATEN, f'{datetime.datetime.now():%Y%m%d-%H%M%S}-{uitkomst["commit"] or "onbekend"}.json')
+    with open(uitvoer, 'w') as bestand:
+        json.dump(uitkomst, bestand, indent=2)
+
+    print(f'{"meting":<28}{"mediaan (ms)":>14}{"min (ms)":>12}')
+    for naam, resultaat in uitkomst['resultaten'].items():
+        print(f'{naam:<28}{resultaat["mediaan"]:>14.2f}{resultaat["min"]:>12.2f}')
+    print(f'Resultaten opgeslagen in {uitvoer}')
+
+    if args.vergelijk:
+        with open(args.vergelijk) as bestand:
+            if vergelijk(json.load(bestand), uitkomst, args.drempel):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Micro-benchmark van alle scoringsstrategieen in scoring.STRATEGIEEN op een synthetische catalogus.
+#
+# Gebruik: python benchmarks/bench_strategieen.py --instrumenten 5000 --tags 2000 --sessies 200
+# Per strategie worden drie dingen gemeten: de strategie zelf (alleen de prioriteiten uit de hits), de
+# volledige prioritize_instruments, inclusief prioriteitsklassen en sorteren, en de SessieScore van een werksessie
+# die antwoord voor antwoord wordt ingevuld (per antwoord, tegen het volledig opnieuw scoren met de matrix).
+
+import argparse
+import timeit
+
+import synthetisch
+from scoring import STRATEGIEEN, prioritize_instruments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark van de scoringsstrategieen.")
+    parser.add_argument('--instrumenten', type=int, default=1000)
+    parser.add_argument('--tags', type=int, default=500)
+    parser.add_argument('--sessies', type=int, default=100)
+    parser.add_argument('--herhalingen', type=int, default=3)
+    args = parser.parse_args()
+
+    catalogus = synthetisch.catalogus(instrumenten=args.instrumenten, tags=args.tags)
+    matrix = catalogus.matrix
+    gescoord = [matrix.score(matrix.scope(catalogus.tags_van_opties(opties)))
+                for opties in synthetisch.antwoorden(catalogus, sessies=args.sessies)]
+    hits = [([len(i[1]) for i in lijst], [len(i[2]) for i in lijst]) for lijst in gescoord]
+
+    print(f'{args.instrumenten} instrumenten, {args.tags} tags, {args.sessies} sessies; tijd per sessie')
+    antwoorden = synthetisch.antwoorden(catalogus, sessies=args.sessies)
+    # Elke sessie wordt vraag voor vraag beantwoord: per stap één optie erbij.
+    stappen = [[frozenset(list(opties)[:n]) for n in range(1, len(opties) + 1)] for opties in antwoorden]
+    aantal_stappen = sum(len(reeks) for reeks in stappen)
+
+    print(f'{"strategie":<16}{"strategie (ms)":>16}{"prioritize (ms)":>18}{"per antwoord (ms)":>20}{"opnieuw (ms)":>15}')
+    for strategie in STRATEGIEEN.values():
+        alleen = min(timeit.repeat(lambda: [strategie.functie(*h) for h in hits],
+                                   number=1, repeat=args.herhalingen))
+        volledig = min(timeit.repeat(lambda: [prioritize_instruments(lijst, strategie.nummer) for lijst in gescoord],
+                                     number=1, repeat=args.herhalingen))
+
+        def sessies_invullen():
+            for reeks in stappen:
+                sessiescore = catalogus.index.sessiescore(strategie.nummer)
+                for opties in reeks:
+                    sessiescore.score(opties)
+
+        def opnieuw_scoren():
+            for reeks in stappen:
+                for opties in reeks:
+                    prioritize_instruments(matrix.score(matrix.scope(catalogus.tags_van_opties(opties))), strategie.nummer)
+        per_antwoord = min(timeit.repeat(sessies_invullen, number=1, repeat=args.herhalingen))
+        opnieuw = min(timeit.repeat(opnieuw_scoren, number=1, repeat=args.herhalingen))
+        print(f'{strategie.naam:<16}{1000 * alleen / args.sessies:>16.3f}{1000 * volledig / args.sessies:>18.3f}'
+              f'{1000 * per_antwoord / aantal_stappen:>20.3f}{1000 * opnieuw / aantal_stappen:>15.3f}')
+
+
+if __name__ == '__main__':
+    main()
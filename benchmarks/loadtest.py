@@ -0,0 +1,360 @@
+# Belastingtest van een complete workshop tegen een draaiende gunicorn-server.
+#
+# Gebruik: python benchmarks/loadtest.py --start --gebruikers 50 --rondes 3
+#          python benchmarks/loadtest.py --url http://127.0.0.1:8000 --gebruikers 20 --wachtwoord geheim
+# Met --start wordt een SQLite-database (of de database uit --database-uri, bijvoorbeeld een lokale MySQL-container)
+# gevuld met een synthetische catalogus en de virtuele gebruikers vu001, vu002, ..., waarna gunicorn met
+# gevent-workers wordt gestart, net als in de Dockerfile. Zonder --start moeten de gebruikers al bestaan.
+#
+# Elke virtuele gebruiker doorloopt per ronde: inloggen, add_session, de casus invullen, een aantal vragen van de
+# keuzehulp beantwoorden (met --api via /api/antwoord, zoals de pagina doet als JavaScript aan staat), de conclusie
+# opslaan en de werksessie exporteren. Per stap worden de aantallen, de fouten
+# en p50/p95/p99 van de duur gemeten. Een stap telt als fout bij een HTTP-fout, bij de foutpagina van de app
+# (bijvoorbeeld een mislukte commit) en bij een export waarin niet de eigen werksessie staat. Dat laatste vangt
+# exports die elkaars tijdelijke bestand overschrijven.
+
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+
+import synthetisch
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Alleen error.html heeft dit script; zo is de foutpagina te herkennen, ook al komt die met status 200.
+FOUTPAGINA = 'function goBack()'
+
+# add_session stuurt door naar /case; die tijd valt onder add_session.
+STAPPEN = ('login', 'add_session', 'case opslaan', 'questionnaire', 'antwoord', 'final', 'final opslaan',
+           'export', 'export status', 'export klaar', 'download')
+
+
+class StapMislukt(Exception):
+    """Een stap van de workshop gaf niet het verwachte antwoord."""
+
+
+class Resultaten:
+    """Duur en fouten per stap, gedeeld door alle virtuele gebruikers."""
+
+    def __init__(self):
+        self.tijden = {stap: [] for stap in STAPPEN}
+        self.fouten = {stap: {} for stap in STAPPEN}
+        self.rondes = 0
+        self._lock = threading.Lock()
+
+    def tijd(self, stap, duur):
+        with self._lock:
+            self.tijden[stap].append(duur)
+
+    def fout(self, stap, reden):
+        with self._lock:
+            self.fouten[stap][reden] = self.fouten[stap].get(reden, 0) + 1
+
+    def ronde(self):
+        with self._lock:
+            self.rondes += 1
+
+
+def percentiel(tijden, p):
+    """Percentiel volgens de nearest-rank-methode."""
+    if not tijden:
+        return None
+    gesorteerd = sorted(tijden)
+    return gesorteerd[max(0, min(len(gesorteerd) - 1, int(round(p / 100 * len(gesorteerd) + 0.5)) - 1))]
+
+
+class VirtueleGebruiker:
+
+    def __init__(self, url, gebruikersnaam, wachtwoord, resultaten, args, nummer):
+        self.url = url.rstrip('/')
+        self.gebruikersnaam = gebruikersnaam
+        self.wachtwoord = wachtwoord
+        self.resultaten = resultaten
+        self.args = args
+        self.random = random.Random(args.seed * 100003 + nummer)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def verzoek(self, stap, pad, data=None, json_data=None):
+        """Doet een request, meet de duur en geeft (url na redirects, body) terug."""
+        verzoek = urllib.request.Request(self.url + pad)
+        if data is not None:
+            verzoek.data = urllib.parse.urlencode(data, doseq=True).encode()
+        if json_data is not None:
+            verzoek.data = json.dumps(json_data).encode()
+            verzoek.add_header('Content-Type', 'application/json')
+        begin = time.perf_counter()
+        try:
+            with self.opener.open(verzoek, timeout=self.args.timeout) as antwoord:
+                body = antwoord.read()
+                eind_url = antwoord.geturl()
+        except urllib.error.HTTPError as err:
+            self.resultaten.tijd(stap, time.perf_counter() - begin)
+            raise StapMislukt(f'HTTP {err.code}')
+        except (urllib.error.URLError, socket.timeout, ConnectionError) as err:
+            self.resultaten.tijd(stap, time.perf_counter() - begin)
+            raise StapMislukt(type(getattr(err, 'reason', err)).__name__)
+        self.resultaten.tijd(stap, time.perf_counter() - begin)
+        if body[:2] != b'PK':
+            tekst = body.decode('utf-8', 'replace')
+            if FOUTPAGINA in tekst:
+                melding = re.search(r'<h1[^>]*>\s*(.*?)\s*</h1>', tekst, re.S)
+                raise StapMislukt('foutpagina: ' + (melding.group(1) if melding else 'onbekend'))
+            if '/login' in urllib.parse.urlparse(eind_url).path and stap != 'login':
+                raise StapMislukt('niet ingelogd')
+            return eind_url, tekst
+        return eind_url, body
+
+    def stap(self, stap, pad, data=None, json_data=None):
+        try:
+            return self.verzoek(stap, pad, data, json_data)
+        except StapMislukt as err:
+            self.resultaten.fout(stap, str(err))
+            raise
+
+    def denk(self):
+        if self.args.denktijd:
+            time.sleep(self.random.uniform(0, 2 * self.args.denktijd))
+
+    def ronde(self, nummer):
+        _, pagina = self.stap('login', '/login')
+        self.stap('login', '/login', {'csrf_token': csrf_token(pagina), 'username': self.gebruikersnaam,
+                                      'password': self.wachtwoord, 'submit': 'Login'})
+        self.denk()
+
+        _, pagina = self.stap('add_session', '/add_session')
+        naam = f'Belastingtest {self.gebruikersnaam} ronde {nummer} {self.random.getrandbits(32):08x}'
+        self.denk()
+        self.stap('case opslaan', '/case', {'csrf_token': csrf_token(pagina), 'naam': naam,
+                                            'auteurs': self.gebruikersnaam, 'datum': time.strftime('%d-%m-%Y'),
+                                            'probleemstelling': 'Synthetische probleemstelling', 'submit': 'Opslaan'})
+        self.denk()
+
+        _, pagina = self.stap('questionnaire', '/questionnaire')
+        vragen = vragen_van(pagina)
+        for vraag, opties, meerkeuze in self.random.sample(vragen, min(self.args.antwoorden, len(vragen))):
+            keuze = self.random.sample(opties, self.random.randint(1, len(opties))) if meerkeuze else [self.random.choice(opties)]
+            if self.args.api:
+                self.stap('antwoord', '/api/antwoord', json_data={'vraag': vraag, 'opties': keuze,
+                                                                  'motivatie': f'Motivatie van {self.gebruikersnaam}'})
+            else:
+                self.stap('antwoord', '/questionnaire', {'vraag': vraag, 'optie': keuze,
+                                                         'motivatie': f'Motivatie van {self.gebruikersnaam}'})
+            self.denk()
+
+        self.stap('final', '/final')
+        self.stap('final opslaan', '/final', {'conclusie': f'Conclusie van {naam}', 'submit': 'Opslaan'})
+        self.denk()
+
+        self.exporteer(naam)
+        self.resultaten.ronde()
+
+    def exporteer(self, naam):
+        eind_url, _ = self.stap('export', '/export_session')
+        taak = re.search(r'/export/([0-9a-f]{32})', eind_url)
+        if taak is None:
+            self.resultaten.fout('export', 'geen exporttaak')
+            raise StapMislukt('geen exporttaak')
+        begin = time.perf_counter()
+        while True:
+            _, status = self.stap('export status', f'/export/{taak.group(1)}/status')
+            status = json.loads(status)
+            if status['status'] != 'bezig':
+                break
+            if time.perf_counter() - begin > self.args.timeout:
+                self.resultaten.fout('export klaar', 'timeout')
+                raise StapMislukt('timeout')
+            time.sleep(0.1)
+        self.resultaten.tijd('export klaar', time.perf_counter() - begin)
+        if status['status'] != 'klaar':
+            self.resultaten.fout('export klaar', status['status'])
+            raise StapMislukt(status['status'])
+
+        _, document = self.stap('download', f'/export/{taak.group(1)}/download')
+        try:
+            with zipfile.ZipFile(io.BytesIO(document)) as docx:
+                xml = docx.read('word/document.xml').decode('utf-8')
+        except (zipfile.BadZipFile, KeyError, TypeError):
+            self.resultaten.fout('download', 'geen geldig docx')
+            raise StapMislukt('geen geldig docx')
+        if naam not in xml:
+            self.resultaten.fout('download', 'document van een andere werksessie')
+            raise StapMislukt('document van een andere werksessie')
+
+    def draai(self, einde):
+        nummer = 0
+        while (time.time() < einde) if einde is not None else (nummer < self.args.rondes):
+            nummer += 1
+            try:
+                self.ronde(nummer)
+            except StapMislukt:
+                pass    # De fout is al geteld; de volgende ronde begint weer bij het inloggen.
+
+
+def csrf_token(pagina):
+    gevonden = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', pagina) \
+        or re.search(r'value="([^"]+)"[^>]*name="csrf_token"', pagina)
+    return gevonden.group(1) if gevonden else ''
+
+
+def vragen_van(pagina):
+    """Geeft (vraag_id, optie_ids, meerkeuze) voor elk formulier op de pagina van de keuzehulp."""
+    vragen = []
+    for formulier in re.findall(r'<form method="post">(.*?)</form>', pagina, re.S):
+        vraag = re.search(r'name="vraag" value="(\d+)"', formulier)
+        opties = re.findall(r'name="optie" value="(\d+)"', formulier)
+        if vraag and opties:
+            vragen.append((vraag.group(1), opties, 'type="checkbox"' in formulier))
+    return vragen
+
+
+def vul_database(args, map):
+    """Maakt de tabellen, een synthetische catalogus en de virtuele gebruikers aan in de database van de server."""
+    os.environ['DATABASE_URI'] = args.database_uri
+    os.environ.setdefault('FORCE_HTTPS', 'FALSE')
+    os.environ['EXPORT_DIR'] = os.path.join(map, 'exports-vullen')
+    os.environ['METRICS_DIR'] = os.path.join(map, 'metrics-vullen')
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.bcrypt_rondes)
+    import app as A
+
+    rijen = synthetisch.catalogus_rijen(instrumenten=args.instrumenten, tags=args.tags, seed=args.seed)
+    with A.app.app_context():
+        A.db.create_all()
+        if A.Instrument.query.first() is None:
+            synthetisch.vul_database(A, rijen, [])
+        wachtwoord_hash = A.bcrypt.generate_password_hash(args.wachtwoord, args.bcrypt_rondes).decode('utf-8')
+        for i in range(1, args.gebruikers + 1):
+            naam = f'vu{i:03d}'
+            if A.User.query.filter_by(username=naam).first() is None:
+                A.db.session.add(A.User(username=naam, password=wachtwoord_hash, role=0))
+        A.db.session.commit()
+
+
+def start_server(args, map):
+    poort = args.poort
+    omgeving = dict(os.environ, DATABASE_URI=args.database_uri, FORCE_HTTPS='FALSE',
+                    EXPORT_DIR=os.path.join(map, 'exports'), METRICS_DIR=os.path.join(map, 'metrics'),
+                    BCRYPT_LOG_ROUNDS=str(args.bcrypt_rondes))
+    omgeving.setdefault('SECRET_KEY', os.urandom(16).hex())
+    server = subprocess.Popen(['gunicorn', '--worker-class', 'gevent', '--workers', str(args.workers),
+                               '--bind', f'127.0.0.1:{poort}', '--timeout', '120', 'patched:app'],
+                              cwd=REPO, env=omgeving,
+                              stdout=subprocess.DEVNULL if not args.serverlog else None,
+                              stderr=subprocess.DEVNULL if not args.serverlog else None)
+    url = f'http://127.0.0.1:{poort}'
+    for _ in range(300):
+        if server.poll() is not None:
+            raise SystemExit('gunicorn is direct gestopt; draai opnieuw met --serverlog.')
+        try:
+            urllib.request.urlopen(url + '/login', timeout=1).close()
+            return server, url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.1)
+    server.terminate()
+    raise SystemExit('gunicorn reageert niet op ' + url)
+
+
+def rapport(resultaten, duur, args):
+    stappen = {}
+    for stap in STAPPEN:
+        tijden = resultaten.tijden[stap]
+        fouten = sum(resultaten.fouten[stap].values())
+        stappen[stap] = {'n': len(tijden), 'fouten': fouten,
+                         'foutpercentage': 100 * fouten / len(tijden) if tijden else 0.0,
+                         'p50': percentiel(tijden, 50), 'p95': percentiel(tijden, 95), 'p99': percentiel(tijden, 99),
+                         'redenen': resultaten.fouten[stap]}
+    requests = sum(len(tijden) for tijden in resultaten.tijden.values())
+    return {'gebruikers': args.gebruikers, 'workers': args.workers if args.start else None, 'duur': duur,
+            'requests': requests, 'requests per seconde': requests / duur, 'rondes': resultaten.rondes,
+            'rondes per seconde': resultaten.rondes / duur, 'stappen': stappen}
+
+
+def druk_af(uitkomst):
+    print(f'{"stap":<16}{"n":>7}{"fouten":>8}{"fout %":>8}{"p50 (ms)":>11}{"p95 (ms)":>11}{"p99 (ms)":>11}')
+    for stap, s in uitkomst['stappen'].items():
+        if not s['n']:
+            continue
+        print(f'{stap:<16}{s["n"]:>7}{s["fouten"]:>8}{s["foutpercentage"]:>8.1f}'
+              f'{1000 * s["p50"]:>11.1f}{1000 * s["p95"]:>11.1f}{1000 * s["p99"]:>11.1f}')
+    print(f'{uitkomst["requests"]} requests in {uitkomst["duur"]:.1f} s: {uitkomst["requests per seconde"]:.1f} requests/s, '
+          f'{uitkomst["rondes"]} complete workshops ({uitkomst["rondes per seconde"]:.2f}/s)')
+    for stap, s in uitkomst['stappen'].items():
+        for reden, aantal in sorted(s['redenen'].items()):
+            print(f'*** {stap}: {aantal}x {reden}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Belastingtest van complete workshops tegen gunicorn met gevent.')
+    parser.add_argument('--url', help='Adres van een draaiende server; niet nodig met --start')
+    parser.add_argument('--start', action='store_true', help='Vul de database en start zelf gunicorn')
+    parser.add_argument('--database-uri', help='Database voor --start, standaard een nieuwe SQLite-database')
+    parser.add_argument('--workers', type=int, default=2, help='Aantal gunicorn-workers met --start')
+    parser.add_argument('--poort', type=int, default=8765)
+    parser.add_argument('--serverlog', action='store_true', help='Laat de uitvoer van gunicorn zien')
+    parser.add_argument('--instrumenten', type=int, default=200)
+    parser.add_argument('--tags', type=int, default=300)
+    parser.add_argument('--bcrypt-rondes', type=int, default=12)
+    parser.add_argument('--gebruikers', type=int, default=20, help='Aantal gelijktijdige virtuele gebruikers')
+    parser.add_argument('--wachtwoord', default='belastingtest')
+    parser.add_argument('--rondes', type=int, default=1, help='Aantal workshops per virtuele gebruiker')
+    parser.add_argument('--duur', type=float, help='Blijf workshops doorlopen tot dit aantal seconden voorbij is')
+    parser.add_argument('--antwoorden', type=int, default=10, help='Aantal beantwoorde vragen per workshop')
+    parser.add_argument('--api', action='store_true', help='Beantwoord vragen via /api/antwoord in plaats van het formulier')
+    parser.add_argument('--denktijd', type=float, default=0.0, help='Gemiddelde pauze tussen stappen in seconden')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--uitvoer', help='Sla het rapport ook als JSON op')
+    args = parser.parse_args()
+    if not args.start and not args.url:
+        parser.error('geef --url of --start')
+
+    map = tempfile.mkdtemp(prefix='interventie-loadtest-')
+    server = None
+    try:
+        if args.start:
+            if args.database_uri is None:
+                args.database_uri = 'sqlite:///' + os.path.join(map, 'loadtest.db')
+            vul_database(args, map)
+            server, args.url = start_server(args, map)
+
+        resultaten = Resultaten()
+        gebruikers = [VirtueleGebruiker(args.url, f'vu{i:03d}', args.wachtwoord, resultaten, args, i)
+                      for i in range(1, args.gebruikers + 1)]
+        einde = time.time() + args.duur if args.duur else None
+        threads = [threading.Thread(target=gebruiker.draai, args=(einde,), daemon=True) for gebruiker in gebruikers]
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        uitkomst = rapport(resultaten, time.perf_counter() - begin, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(map, ignore_errors=True)
+
+    druk_af(uitkomst)
+    if args.uitvoer:
+        with open(args.uitvoer, 'w') as bestand:
+            json.dump(uitkomst, bestand, indent=2)
+    if any(s['fouten'] for s in uitkomst['stappen'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Generator voor synthetische catalogi, voor benchmarks met catalogi die veel groter zijn dan de echte.
+#
+# De generator levert rijen in dezelfde vorm als laad_catalogus in app.py ze uit de database haalt,
+# zodat er direct een Catalogus van gemaakt kan worden. Met vul_database komen dezelfde rijen, plus werksessies
+# met antwoorden, in een echte database (bijvoorbeeld SQLite) voor benchmarks van de hele app.
+
+import random
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from catalogus import Catalogus
+from scoring import EXCLUDED
+
+
+def catalogus_rijen(instrumenten=100, tags=200, tags_per_instrument=8, mintags_per_instrument=2,
+                    categorieen=5, vragen_per_categorie=6, opties_per_vraag=4, tags_per_optie=3, seed=0):
+    """Geeft een dict met de rijen van een willekeurige catalogus. Alle id's beginnen bij 1."""
+    rnd = random.Random(seed)
+    tag_ids = list(range(1, tags + 1))
+    rijen = {
+        'instrumenten': [(i, f'Instrument {i:05d}', f'Intro {i}', f'Beschrijving {i}', f'Afwegingen {i}',
+                          f'Voorbeelden {i}', f'https://example.org/{i}', f'Eigenaar {i}', f'eigenaar{i}@example.org')
+                         for i in range(1, instrumenten + 1)],
+        'tags': [(t, f'tag{t:05d}') for t in tag_ids],
+        'categorieen': [(c, f'Categorie {c}') for c in range(1, categorieen + 1)],
+        'vragen': [],
+        'opties': [],
+        'plustags': [],
+        'mintags': [],
+        'optietags': [],
+    }
+    for i in range(1, instrumenten + 1):
+        gekozen = rnd.sample(tag_ids, min(tags, tags_per_instrument + mintags_per_instrument))
+        rijen['plustags'].extend((i, t) for t in gekozen[:tags_per_instrument])
+        rijen['mintags'].extend((i, t) for t in gekozen[tags_per_instrument:])
+    vraag_id = optie_id = 0
+    for c in range(1, categorieen + 1):
+        for _ in range(vragen_per_categorie):
+            vraag_id += 1
+            rijen['vragen'].append((vraag_id, f'Vraag {vraag_id}', c, vraag_id % 2 == 0))
+            for _ in range(opties_per_vraag):
+                optie_id += 1
+                rijen['opties'].append((optie_id, f'Optie {optie_id}', vraag_id))
+                rijen['optietags'].extend((optie_id, t) for t in rnd.sample(tag_ids, min(tags, tags_per_optie)))
+    return rijen
+
+
+def catalogus(methode=EXCLUDED, marge=1, **grootte):
+    """Een Catalogus-momentopname van een synthetische catalogus."""
+    return Catalogus(1, methode=methode, marge=marge, **catalogus_rijen(**grootte))
+
+
+def antwoorden(catalogus, sessies=100, fractie=0.5, seed=0):
+    """Per sessie een willekeurige set gekozen opties: bij ongeveer de gegeven fractie van de vragen één optie."""
+    rnd = random.Random(seed)
+    vragen = list(catalogus.vragen.values())
+    return [frozenset(rnd.choice(vraag.opties).id for vraag in vragen if vraag.opties and rnd.random() < fractie)
+            for _ in range(sessies)]
+
+
+def vul_database(app_module, rijen, sessies, eigenaar=1):
+    """Schrijft de rijen van catalogus_rijen en een werksessie per set gekozen opties in de database van app.py.
+    Bij elke beantwoorde vraag komt ook een motivatie. Moet binnen een app context worden aangeroepen;
+    de tabellen moeten al bestaan. Geeft de id's van de werksessies terug."""
+    A = app_module
+    sessie = A.db.session
+    kolommen = ('id', 'naam', 'intro', 'beschrijving', 'afwegingen', 'voorbeelden', 'links', 'eigenaar', 'eigenaar_email')
+    sessie.execute(A.Instrument.__table__.insert(), [dict(zip(kolommen, rij)) for rij in rijen['instrumenten']])
+    sessie.execute(A.Tag.__table__.insert(), [{'id': id, 'naam': naam} for id, naam in rijen['tags']])
+    sessie.execute(A.Categorie.__table__.insert(), [{'id': id, 'naam': naam} for id, naam in rijen['categorieen']])
+    sessie.execute(A.Vraag.__table__.insert(), [{'id': id, 'naam': naam, 'categorie_id': categorie_id, 'multiselect': multiselect}
+                                                for id, naam, categorie_id, multiselect in rijen['vragen']])
+    sessie.execute(A.Optie.__table__.insert(), [{'id': id, 'naam': naam, 'vraag_id': vraag_id}
+                                                for id, naam, vraag_id in rijen['opties']])
+    for tabel, bron, sleutels in ((A.associations_IT, 'plustags', ('instrument_id', 'tag_id')),
+                                  (A.associations_XIT, 'mintags', ('instrument_id', 'tag_id')),
+                                  (A.associations_TO, 'optietags', ('optie_id', 'tag_id'))):
+        if rijen[bron]:
+            sessie.execute(tabel.insert(), [dict(zip(sleutels, paar)) for paar in rijen[bron]])
+
+    vraag_van_optie = {id: vraag_id for id, naam, vraag_id in rijen['opties']}
+    werksessie_ids = []
+    motivatie_id = 0
+    for nummer, opties in enumerate(sessies, start=1):
+        sessie.execute(A.Werksessie.__table__.insert(),
+                       {'id': nummer, 'naam': f'Werksessie {nummer}', 'auteurs': 'Benchmark', 'datum': '2024-01-01',
+                        'probleemstelling': f'Probleemstelling {nummer}', 'conclusie': f'Conclusie {nummer}',
+                        'owner': eigenaar, 'showinstruments': True})
+        if opties:
+            sessie.execute(A.associations_OS.insert(), [{'optie_id': optie, 'werksessie_id': nummer} for optie in sorted(opties)])
+        for vraag_id in sorted({vraag_van_optie[optie] for optie in opties}):
+            motivatie_id += 1
+            sessie.execute(A.Motivaties.__table__.insert(), {'id': motivatie_id, 'motivatie': f'Motivatie {motivatie_id}', 'vraag_id': vraag_id})
+            sessie.execute(A.associations_Ws_Mot.insert(), {'werksessie_id': nummer, 'motivatie_id': motivatie_id})
+        werksessie_ids.append(nummer)
+    sessie.commit()
+    return werksessie_ids
@@ -0,0 +1,68 @@
+# Bouwt de statische bestanden voor productie.
+#
+# Elk bestand in static/ wordt gekopieerd naar static/dist/ met een hash van de inhoud in de naam,
+# bijvoorbeeld css/main.3f2a9c1b0d.css. Omdat de naam verandert zodra de inhoud verandert, mag een browser
+# (of een proxy) het bestand onbeperkt bewaren. Naast elk bestand komen een gzip- en, als het pakket Brotli
+# geïnstalleerd is, een brotli-variant. static/dist/manifest.json koppelt de oorspronkelijke namen aan de nieuwe;
+# app.py gebruikt dat om url_for('static', ...) naar de nieuwe namen te laten wijzen.
+#
+# Gebruik: python build_assets.py (in de Dockerfile gebeurt dit bij het bouwen van de image).
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST = os.path.join(STATIC, 'dist')
+MANIFEST = os.path.join(DIST, 'manifest.json')
+
+# Afbeeldingen zijn al gecomprimeerd; een gzip-variant levert daar niets op.
+COMPRIMEERBAAR = ('.css', '.js', '.svg', '.txt', '.html', '.json')
+
+
+def fingerprint(inhoud):
+    return hashlib.sha256(inhoud).hexdigest()[:10]
+
+
+def bouw():
+    """Bouwt static/dist opnieuw op en geeft het manifest terug."""
+    shutil.rmtree(DIST, ignore_errors=True)
+    manifest = {}
+    for map, submappen, bestanden in os.walk(STATIC):
+        submappen[:] = [submap for submap in submappen if os.path.join(map, submap) != DIST]
+        for bestand in sorted(bestanden):
+            bron = os.path.join(map, bestand)
+            naam = os.path.relpath(bron, STATIC).replace(os.sep, '/')
+            with open(bron, 'rb') as f:
+                inhoud = f.read()
+            stam, extensie = os.path.splitext(naam)
+            doelnaam = f'{stam}.{fingerprint(inhoud)}{extensie}'
+            doel = os.path.join(DIST, doelnaam)
+            os.makedirs(os.path.dirname(doel), exist_ok=True)
+            with open(doel, 'wb') as f:
+                f.write(inhoud)
+            if extensie.lower() in COMPRIMEERBAAR:
+                with open(doel + '.gz', 'wb') as f:
+                    f.write(gzip.compress(inhoud, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(doel + '.br', 'wb') as f:
+                        f.write(brotli.compress(inhoud, quality=11))
+            manifest[naam] = doelnaam
+    with open(MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    manifest = bouw()
+    for naam, doelnaam in sorted(manifest.items()):
+        print(f'{naam} -> dist/{doelnaam}')
+    if brotli is None:
+        print('*** Pakket Brotli niet gevonden, alleen gzip-varianten gemaakt.')
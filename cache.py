@@ -0,0 +1,62 @@
+# Eenvoudige LRU-cache met een maximale levensduur per item.
+#
+# De cache leeft per worker in het geheugen. Sleutels bevatten daarom alles waar de waarde van afhangt
+# (zoals het versienummer van de catalogus), zodat een verouderd item nooit terugkomt, ook niet als een
+# andere worker de wijziging heeft gedaan. Expliciet invalideren houdt de cache alleen klein.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bewaart maximaal maxsize items, elk hooguit ttl seconden. Houdt bij hoe vaak een item gevonden werd."""
+
+    def __init__(self, maxsize=1000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()     # sleutel -> (verlooptijd, waarde), oudste eerst
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Geeft de waarde uit de cache, of berekent en bewaart hem als hij er niet (meer) in staat."""
+        value = self.get(key, self)
+        if value is self:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, predicate=None):
+        """Verwijdert alle items, of alleen de items waarvan de sleutel aan predicate voldoet."""
+        with self._lock:
+            if predicate is None:
+                self._items.clear()
+            else:
+                for key in [key for key in self._items if predicate(key)]:
+                    del self._items[key]
+
+    def stats(self):
+        with self._lock:
+            return {'items': len(self._items), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,95 @@
+# Onveranderlijke momentopname van de catalogus: instrumenten, tags, categorieen, vragen, opties en hun koppelingen.
+#
+# Elke worker houdt één momentopname in het geheugen. De momentopname hoort bij een versienummer van de catalogus
+# dat in de database staat en door elke wijziging van een administrator wordt verhoogd. Zolang het versienummer
+# niet verandert kunnen alle leesroutes de momentopname gebruiken in plaats van de database.
+# De objecten hebben dezelfde attributen als de modellen in app.py, zodat templates en export.py er niets van merken.
+
+from collections import namedtuple
+from scoring import TagMatrix, OptieIndex
+
+Tag = namedtuple('Tag', 'id naam')
+Instrument = namedtuple('Instrument', 'id naam intro beschrijving afwegingen voorbeelden links eigenaar eigenaar_email tags extags')
+Optie = namedtuple('Optie', 'id naam vraag_id tags')
+Vraag = namedtuple('Vraag', 'id naam categorie_id multiselect opties')
+Categorie = namedtuple('Categorie', 'id naam vragen')
+InstrumentNaam = namedtuple('InstrumentNaam', 'id naam')
+
+
+def _koppel(paren, doelen):
+    """Zet (bron id, doel id)-paren uit een associatietabel om naar een dict van bron id naar een tuple van doelen.
+    Dubbele paren tellen net als in de relaties van SQLAlchemy maar één keer mee."""
+    gekoppeld = {}
+    for bron_id, doel_id in paren:
+        lijst = gekoppeld.setdefault(bron_id, [])
+        if doel_id in doelen and doelen[doel_id] not in lijst:
+            lijst.append(doelen[doel_id])
+    return {bron_id: tuple(lijst) for bron_id, lijst in gekoppeld.items()}
+
+
+class Catalogus:
+    """Momentopname van de catalogus bij een bepaalde versie. De rijen komen uit de database (zie laad_catalogus in app.py)
+    en zijn al gesorteerd zoals de routes ze tonen: instrumenten, tags en categorieen op naam, vragen en opties op id.
+    De scoringsinstellingen (methode en marge) horen bij dezelfde versie en reizen mee met de momentopname."""
+
+    def __init__(self, versie, instrumenten, tags, categorieen, vragen, opties, plustags, mintags, optietags,
+                 methode, marge, opschonen=None, gewijzigd=None):
+        self.versie = versie
+        self.gewijzigd = gewijzigd      # Tijdstip (UTC) waarop deze versie ontstond, of None als dat niet bekend is
+        self.methode = methode
+        self.marge = marge
+
+        self.tags = tuple(Tag(*rij) for rij in tags)
+        tags_per_id = {tag.id: tag for tag in self.tags}
+
+        plustags_per_instrument = _koppel(plustags, tags_per_id)
+        mintags_per_instrument = _koppel(mintags, tags_per_id)
+        self.instrumenten = tuple(Instrument(*rij,
+                                             tags=plustags_per_instrument.get(rij[0], ()),
+                                             extags=mintags_per_instrument.get(rij[0], ()))
+                                  for rij in instrumenten)
+
+        tags_per_optie = _koppel(optietags, tags_per_id)
+        self.opties = {rij[0]: Optie(*rij, tags=tags_per_optie.get(rij[0], ())) for rij in opties}
+
+        opties_per_vraag = _koppel(((optie.vraag_id, optie.id) for optie in self.opties.values()), self.opties)
+        self.vragen = {rij[0]: Vraag(*rij, opties=opties_per_vraag.get(rij[0], ())) for rij in vragen}
+
+        vragen_per_categorie = _koppel(((vraag.categorie_id, vraag.id) for vraag in self.vragen.values()), self.vragen)
+        self.categorieen = tuple(Categorie(*rij, vragen=vragen_per_categorie.get(rij[0], ())) for rij in categorieen)
+
+        self.instrumenten_per_id = {instrument.id: instrument for instrument in self.instrumenten}
+        # Alleen id en naam, voor het navigatiemenu met alle instrumenten.
+        self.navigatie = tuple(InstrumentNaam(instrument.id, instrument.naam) for instrument in self.instrumenten)
+        self.matrix = TagMatrix(self.instrumenten)
+        self.index = OptieIndex(self.matrix, self.opties.values())
+
+        self._opschonen = opschonen     # Maakt van een instrument een kopie met teksten die direct getoond kunnen worden
+        self._weergave = {}
+        self._fragmenten = {}
+
+    def instrument(self, instrument_id):
+        return self.instrumenten_per_id.get(instrument_id)
+
+    def weergave(self, instrument_id):
+        """Het instrument met opgeschoonde teksten voor de instrumentpagina. Elk instrument wordt per versie
+        hooguit één keer opgeschoond; een wijziging van een administrator levert een nieuwe versie op."""
+        weergave = self._weergave.get(instrument_id)
+        if weergave is None:
+            instrument = self.instrument(instrument_id)
+            if instrument is None:
+                return None
+            weergave = self._weergave[instrument_id] = self._opschonen(instrument)
+        return weergave
+
+    def fragment(self, naam, maken):
+        """Een stuk HTML dat alleen van de catalogus afhangt, zoals de vragen van de keuzehulp. Wordt per versie
+        hooguit één keer gemaakt met maken()."""
+        fragment = self._fragmenten.get(naam)
+        if fragment is None:
+            fragment = self._fragmenten[naam] = maken()
+        return fragment
+
+    def tags_van_opties(self, optie_ids):
+        """Alle tags van de gegeven opties. Opties die niet (meer) in de catalogus staan worden overgeslagen."""
+        return [tag for optie_id in optie_ids if optie_id in self.opties for tag in self.opties[optie_id].tags]
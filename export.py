@@ -1,19 +1,48 @@
+import copy
 import datetime
+import io
+import os
+from collections import namedtuple
 from bleach.sanitizer import Cleaner
 from docx import Document
 from docx.shared import Cm
 
 WordCleaner = Cleaner(tags='', strip=True)
 
-def export_catalogus_to_word(instrumenten, filename):
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Template.docx')
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+_template = None
+
+# Platte gegevens van een werksessie voor het verslag. Exports worden in een ander proces gemaakt (zie exportjobs.py),
+# dus alles wat erheen gaat moet te picklen zijn; ORM-objecten zijn dat niet.
+WerksessieExport = namedtuple('WerksessieExport', 'naam datum auteurs probleemstelling conclusie geselecteerde_opties motivaties')
+MotivatieExport = namedtuple('MotivatieExport', 'vraag motivatie')
+
+def nieuw_document():
+    """Geeft een nieuw document op basis van de template. De template wordt per worker één keer ingelezen;
+    elke export werkt op een eigen kopie in het geheugen."""
+    global _template
+    if _template is None:
+        _template = Document(TEMPLATE)
+    return copy.deepcopy(_template)
+
+def als_bytes(document):
+    """Slaat het document op in het geheugen, zodat er geen tijdelijk bestand nodig is dat gedeeld wordt tussen requests."""
+    buffer = io.BytesIO()
+    document.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+def export_catalogus_to_word(instrumenten):
     # De export is gebaseerd op een template waarin de juiste stijlen zijn gedefinieerd. 
     # Deze template staat in de root folder van het project.
+    # Geeft het document terug als BytesIO.
     # Standaard worden alle gebruikte HTML-tags integraal verwijderd (en dus niet vervangen door Word-opmaak).
 
 
     # BEKENDE FOUT: Als een veld een getal bevat denkt Python dat het een int is, en dat gaan Wordcleaner.clean niet goed!
 
-    catalogus = Document('Template.docx')
+    catalogus = nieuw_document()
     section = catalogus.sections[0]
     footer = section.footer.paragraphs[0]
 
@@ -64,13 +93,13 @@ def export_catalogus_to_word(instrumenten, filename):
         if not instrument == instrumenten[-1]:
             # Plaats geen page break na het laatste instrument.
             catalogus.add_page_break()
-    catalogus.save(filename)
-    return filename
+    return als_bytes(catalogus)
 
 
-def export_session_to_word(werksessie, vraagcategorieen, instrumenten, filename):
+def export_session_to_word(werksessie, vraagcategorieen, instrumenten):
+    # Geeft het verslag terug als BytesIO.
     # Titelblad
-    verslag = Document('Template.docx')
+    verslag = nieuw_document()
     verslag.add_heading('Verslag werksessie', level=0)
     verslag.add_heading(f'{WordCleaner.clean(werksessie.naam)}', level=0)
     
@@ -102,12 +131,14 @@ def export_session_to_word(werksessie, vraagcategorieen, instrumenten, filename)
     verslag.add_heading('Geselecteerde antwoorden', level=1)
     verslag.add_paragraph('Hieronder volgt een overzicht van de gegeven antwoorden op de vragen.')
 
+    # De vraagcategorieen komen uit de momentopname van de catalogus, dus de opties worden op id vergeleken.
+    geselecteerd = {optie.id for optie in werksessie.geselecteerde_opties}
     for categorie in vraagcategorieen:
         verslag.add_heading(categorie.naam, level=2)
         for vraag in categorie.vragen:
             verslag.add_paragraph(vraag.naam, style='Vraag')
             for optie in vraag.opties:
-                if optie in werksessie.geselecteerde_opties:
+                if optie.id in geselecteerd:
                     verslag.add_paragraph(optie.naam, style='Optie')
                     
             for motivatie in werksessie.motivaties:
@@ -174,5 +205,4 @@ def export_session_to_word(werksessie, vraagcategorieen, instrumenten, filename)
             if not instrument == instrumenten[-1]:
                 # Plaats geen page break na het laatste instrument.
                 verslag.add_page_break()
-    verslag.save(filename)
-    return filename
+    return als_bytes(verslag)
@@ -0,0 +1,202 @@
+# Exports naar Word als achtergrondtaak.
+#
+# Een export met python-docx kost veel CPU. Binnen een request blokkeert dat de hele gevent-worker, dus ook alle
+# andere gebruikers op die worker. Een exportroute zet daarom alleen een taak klaar. Een begrensde pool van
+# processen maakt het document, en de gebruiker wacht op een pagina die de status opvraagt.
+# De documenten komen in een gedeelde map. Zo kan elke worker de status geven en het bestand versturen,
+# ongeacht welke worker de taak heeft aangemaakt. Per taak staan er in die map:
+#   <taak>.json   gegevens van de taak (downloadnaam, eigenaar, aanmaaktijd)
+#   <taak>.docx   het document, zodra het klaar is
+#   <taak>.fout   de foutmelding, als het maken van het document mislukt is
+# Een taak die na de timeout nog geen document of foutmelding heeft, is mislukt: het proces is gestorven of de
+# worker die de taak had is herstart. Zo wacht niemand eeuwig op een taak die nooit meer klaar komt.
+#
+# Documenten die alleen van de catalogus afhangen (de hele catalogus, een enkel instrument) zijn artefacten:
+# hun id volgt uit een sleutel met de catalogusversie. Ze worden per versie één keer gemaakt en daarna
+# als gewoon bestand verstuurd.
+
+import concurrent.futures
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+
+import export
+
+RENDERERS = {
+    'catalogus': export.export_catalogus_to_word,
+    'sessie': export.export_session_to_word,
+}
+
+BEZIG = 'bezig'
+KLAAR = 'klaar'
+FOUT = 'fout'
+
+
+class ExportWachtrijVol(Exception):
+    """Er lopen al zoveel exports dat er geen nieuwe bij kan."""
+
+
+def _render(map, taak_id, soort, args):
+    """Draait in een proces uit de pool. Schrijft eerst naar een tijdelijk bestand, zodat een half document
+    nooit als klaar wordt gezien. Geeft de duur van het renderen in seconden terug."""
+    begin = time.perf_counter()
+    pad = os.path.join(map, taak_id)
+    try:
+        buffer = RENDERERS[soort](*args)
+        with open(pad + '.tmp', 'wb') as bestand:
+            bestand.write(buffer.getvalue())
+        os.replace(pad + '.tmp', pad + '.docx')
+    except Exception as err:
+        with open(pad + '.fout', 'w') as bestand:
+            bestand.write(repr(err))
+    return time.perf_counter() - begin
+
+
+class ExportTaken:
+    """Wachtrij van exporttaken voor deze worker. Met workers=0 wordt elke export direct in het request gemaakt,
+    wat handig is voor ontwikkeling en benchmarks. op_klaar(soort, duur) wordt aangeroepen na elke export.
+    Een taak die na timeout seconden niet klaar is geldt als mislukt."""
+
+    def __init__(self, map, workers=2, max_taken=20, ttl=3600, op_klaar=None, timeout=600):
+        self.map = map
+        self.workers = workers
+        self.max_taken = max_taken
+        self.ttl = ttl
+        self.timeout = timeout
+        self.op_klaar = op_klaar
+        self._lopend = set()
+        self._pool = None
+        self._lock = threading.Lock()
+        os.makedirs(map, exist_ok=True)
+
+    def _get_pool(self):
+        if self._pool is None:
+            # 'spawn' in plaats van fork: een geforkt proces zou de gevent-hub van de worker erven.
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                                mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _fout(self, taak_id, melding):
+        """Legt vast dat de taak mislukt is, tenzij het document er toch al is."""
+        pad = os.path.join(self.map, taak_id)
+        try:
+            if not os.path.exists(pad + '.docx'):
+                with open(pad + '.fout', 'w') as bestand:
+                    bestand.write(melding)
+        except OSError:
+            pass
+
+    def _klaar(self, taak_id, soort, future):
+        with self._lock:
+            self._lopend.discard(future)
+        fout = concurrent.futures.CancelledError() if future.cancelled() else future.exception()
+        if fout is not None:
+            # _render vangt zijn eigen fouten af. Dit is een proces dat gestorven is (BrokenProcessPool) of een
+            # taak die niet meer gedraaid heeft; dan heeft niemand een .fout geschreven.
+            self._fout(taak_id, repr(fout))
+        elif self.op_klaar is not None:
+            self.op_klaar(soort, future.result())
+
+    def _submit(self, *args):
+        try:
+            return self._get_pool().submit(_render, *args)
+        except BrokenProcessPool:
+            # Na een gestorven proces neemt de pool geen taken meer aan; dan komt er een nieuwe.
+            self._pool = None
+            return self._get_pool().submit(_render, *args)
+
+    def start(self, soort, downloadnaam, eigenaar, *args):
+        """Zet een export klaar en geeft het id van de taak terug. Eigenaar is het id van de gebruiker die het
+        bestand mag downloaden, of None als iedereen dat mag."""
+        taak_id = uuid.uuid4().hex
+        self._start(taak_id, soort, downloadnaam, eigenaar, args)
+        return taak_id
+
+    def artefact(self, sleutel, soort, downloadnaam, *args):
+        """Zoals start, maar voor een document dat alleen van de sleutel afhangt. Het id volgt uit de sleutel, dus
+        alle workers vinden hetzelfde bestand. Het json-bestand wordt exclusief aangemaakt: alleen de worker die
+        dat lukt maakt het document, alle andere aanvragen wachten op dezelfde taak."""
+        taak_id = hashlib.md5(sleutel.encode()).hexdigest()
+        taak = self.status(taak_id)
+        if taak is not None and taak['status'] != FOUT:
+            return taak_id
+        if taak is not None:
+            # Een mislukte poging wordt opnieuw gedaan.
+            for extensie in ('.fout', '.json'):
+                try:
+                    os.remove(os.path.join(self.map, taak_id + extensie))
+                except OSError:
+                    pass
+        self._start(taak_id, soort, downloadnaam, None, args)
+        return taak_id
+
+    def _start(self, taak_id, soort, downloadnaam, eigenaar, args):
+        self.opruimen()
+        with self._lock:
+            if len(self._lopend) >= self.max_taken:
+                raise ExportWachtrijVol()
+            try:
+                bestand = os.fdopen(os.open(os.path.join(self.map, taak_id + '.json'),
+                                            os.O_WRONLY | os.O_CREAT | os.O_EXCL), 'w')
+            except FileExistsError:
+                return      # Een andere aanvraag maakt dit document al.
+            with bestand:
+                json.dump({'downloadnaam': downloadnaam, 'eigenaar': eigenaar, 'aangemaakt': time.time()}, bestand)
+            if self.workers == 0:
+                duur = _render(self.map, taak_id, soort, args)
+                if self.op_klaar is not None:
+                    self.op_klaar(soort, duur)
+            else:
+                future = self._submit(self.map, taak_id, soort, args)
+                self._lopend.add(future)
+                future.add_done_callback(functools.partial(self._klaar, taak_id, soort))
+
+    def status(self, taak_id):
+        """Geeft de gegevens van de taak met de status erbij, of None als de taak niet (meer) bestaat. Een taak die
+        langer dan de timeout bezig is, wordt als mislukt vastgelegd."""
+        if not re.fullmatch('[0-9a-f]{32}', taak_id):
+            return None
+        pad = os.path.join(self.map, taak_id)
+        try:
+            with open(pad + '.json') as bestand:
+                taak = json.load(bestand)
+        except (OSError, ValueError):
+            return None
+        if os.path.exists(pad + '.docx'):
+            taak['status'] = KLAAR
+        elif os.path.exists(pad + '.fout'):
+            taak['status'] = FOUT
+        elif time.time() - taak['aangemaakt'] > self.timeout:
+            self._fout(taak_id, f'Niet klaar na {self.timeout} seconden')
+            taak['status'] = FOUT
+        else:
+            taak['status'] = BEZIG
+        return taak
+
+    def bestand(self, taak_id):
+        return os.path.join(self.map, taak_id + '.docx')
+
+    def opruimen(self):
+        """Verwijdert de bestanden van taken die ouder zijn dan de ttl. Van een taak zonder .docx of .fout die nog
+        binnen de timeout valt blijft alles staan: die loopt nog, en zonder .json zou niemand hem meer vinden."""
+        nu = time.time()
+        namen = os.listdir(self.map)
+        afgerond = {naam.split('.')[0] for naam in namen if naam.endswith(('.docx', '.fout'))}
+        for naam in namen:
+            pad = os.path.join(self.map, naam)
+            try:
+                gewijzigd = os.path.getmtime(pad)
+                if gewijzigd >= nu - self.ttl:
+                    continue
+                if naam.split('.')[0] not in afgerond and gewijzigd >= nu - self.timeout:
+                    continue
+                os.remove(pad)
+            except OSError:
+                pass    # Een andere worker was net eerder.
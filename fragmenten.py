@@ -0,0 +1,60 @@
+# Vooraf gerenderde stukken HTML met open plekken voor de gegevens van één werksessie.
+#
+# De vragen en opties van de keuzehulp veranderen alleen als de catalogus verandert, maar werden bij elke weergave
+# opnieuw gerenderd, met voor elke optie een zoektocht door de gekozen opties. Een Fragment wordt één keer per
+# catalogusversie gerenderd. Het template markeert daarbij de plekken die per werksessie verschillen met
+# plek(soort, sleutel) ... einde(). Bij elke weergave hoeven alleen die plekken nog te worden ingevuld:
+#   - is de waarde voor een soort een set, dan blijft de gemarkeerde inhoud alleen staan als de sleutel in de set zit
+#     (een aangevinkte optie, een ster bij een vraag met motivatie);
+#   - is de waarde een Counter, dan komt de gemarkeerde inhoud zo vaak op de plek als de telling bij de sleutel
+#     (een ster per motivatie bij een vraag);
+#   - is de waarde een dict, dan komt de (ge-escapete) tekst bij de sleutel op de plek (de tekst van een motivatie).
+# De markeringen zijn controletekens die niet in HTML voorkomen en die de escaping van Jinja ongemoeid laat.
+
+import collections
+import re
+
+from markupsafe import Markup, escape
+
+_OPEN = '\x00'
+_MIDDEN = '\x01'
+_SLUIT = '\x02'
+_PLEK = re.compile(f'{_OPEN}(\\w+):(\\d+){_MIDDEN}(.*?){_SLUIT}', re.S)
+
+
+def plek(soort, sleutel):
+    return Markup(f'{_OPEN}{soort}:{sleutel}{_MIDDEN}')
+
+
+def einde():
+    return Markup(_SLUIT)
+
+
+class Fragment:
+    """Gerenderde HTML, opgedeeld in vaste tekst en open plekken."""
+
+    def __init__(self, html):
+        self.delen = []
+        positie = 0
+        for gevonden in _PLEK.finditer(html):
+            self.delen.append(html[positie:gevonden.start()])
+            self.delen.append((gevonden.group(1), int(gevonden.group(2)), gevonden.group(3)))
+            positie = gevonden.end()
+        self.delen.append(html[positie:])
+
+    def vul(self, **waarden):
+        """Geeft de HTML met de plekken ingevuld; per soort een set, een Counter of een dict, zie boven."""
+        uitvoer = []
+        for deel in self.delen:
+            if isinstance(deel, str):
+                uitvoer.append(deel)
+                continue
+            soort, sleutel, inhoud = deel
+            waarde = waarden[soort]
+            if isinstance(waarde, collections.Counter):
+                uitvoer.append(' '.join([inhoud] * waarde[sleutel]))
+            elif isinstance(waarde, dict):
+                uitvoer.append(escape(waarde.get(sleutel, '')))
+            elif sleutel in waarde:
+                uitvoer.append(inhoud)
+        return Markup(''.join(uitvoer))
@@ -0,0 +1,229 @@
+# Metrics in het tekstformaat van Prometheus.
+#
+# Elke gunicorn-worker houdt zijn eigen tellers en histogrammen bij. Een scrape van /metrics komt maar bij één
+# worker binnen, dus elke worker schrijft zijn stand regelmatig (en bij elke scrape) naar een eigen JSON-bestand
+# in een gedeelde map. De worker die de scrape afhandelt telt alle bestanden bij elkaar op.
+# Het bestand heet naar een willekeurig id per proces, niet naar het pid: een nieuw proces met een hergebruikt pid
+# zou anders de tellers van zijn voorganger overschrijven.
+# Tellers en histogrammen van workers die gestopt zijn blijven meetellen, zodat de totalen niet teruglopen. Bij een
+# scrape worden de bestanden van gestopte workers op deze machine opgeteld bij totaal.json en verwijderd, zodat de
+# map niet blijft groeien. Gauges (zoals het aantal uitgeleende databaseverbindingen) tellen alleen mee als het
+# bestand recent is. De map hoort bij één machine (container); alleen daar is te zien of een worker nog leeft.
+
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:     # Windows: dan worden de bestanden van gestopte workers niet opgeruimd.
+    fcntl = None
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Standaardgrenzen voor tijden in seconden, dezelfde als in de Prometheus-clients
+SECONDEN = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_tekst(labels, extra=()):
+    paren = list(labels) + list(extra)
+    if not paren:
+        return ''
+    def escape(waarde):
+        return str(waarde).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{naam}="{escape(waarde)}"' for naam, waarde in paren) + '}'
+
+
+def _leeft(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass    # Het proces bestaat, maar is van een andere gebruiker.
+    return True
+
+
+def _lees(pad):
+    try:
+        with open(pad) as bestand:
+            return json.load(bestand)
+    except (OSError, ValueError):
+        return None     # Een worker is net aan het schrijven of gestopt.
+
+
+def _getal(waarde):
+    if waarde == float('inf'):
+        return '+Inf'
+    return repr(float(waarde)) if isinstance(waarde, float) else str(waarde)
+
+
+class Metrics:
+    """Register van alle metrics van deze worker. Labels worden als keyword-argumenten meegegeven."""
+
+    def __init__(self, map, interval=5, gauge_ttl=60):
+        self.map = map
+        self.interval = interval
+        self.gauge_ttl = gauge_ttl
+        self._definities = {}   # naam -> (type, help, grenzen)
+        self._waarden = {}      # (naam, labels) -> getal, of [aantallen per grens..., som, aantal] bij een histogram
+        self._verzamelaars = []
+        self._geschreven = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._id = None
+        self._host = socket.gethostname()
+        os.makedirs(map, exist_ok=True)
+
+    def counter(self, naam, help):
+        self._definities[naam] = (COUNTER, help, None)
+
+    def gauge(self, naam, help):
+        self._definities[naam] = (GAUGE, help, None)
+
+    def histogram(self, naam, help, grenzen=SECONDEN):
+        self._definities[naam] = (HISTOGRAM, help, tuple(grenzen))
+
+    def verzamelaar(self, functie):
+        """Functie die vlak voor het wegschrijven wordt aangeroepen, om gauges bij te werken. Bruikbaar als decorator."""
+        self._verzamelaars.append(functie)
+        return functie
+
+    def inc(self, naam, waarde=1, **labels):
+        sleutel = (naam, tuple(sorted(labels.items())))
+        with self._lock:
+            self._waarden[sleutel] = self._waarden.get(sleutel, 0) + waarde
+
+    def set(self, naam, waarde, **labels):
+        with self._lock:
+            self._waarden[(naam, tuple(sorted(labels.items())))] = waarde
+
+    def observe(self, naam, waarde, **labels):
+        grenzen = self._definities[naam][2]
+        sleutel = (naam, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._waarden.get(sleutel)
+            if histogram is None:
+                histogram = self._waarden[sleutel] = [0] * len(grenzen) + [0.0, 0]
+            for i, grens in enumerate(grenzen):
+                if waarde <= grens:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += waarde
+            histogram[-1] += 1
+
+    def wegschrijven(self, forceer=False):
+        """Schrijft de stand van deze worker naar de gedeelde map, hooguit eens per interval tenzij geforceerd."""
+        nu = time.time()
+        if not forceer and nu - self._geschreven < self.interval:
+            return
+        self._geschreven = nu
+        for functie in self._verzamelaars:
+            functie()
+        with self._lock:
+            waarden = [[naam, labels, waarde] for (naam, labels), waarde in self._waarden.items()]
+        if self._pid != os.getpid():
+            # Ook een geforkt proces krijgt een eigen id, en dus een eigen bestand.
+            self._pid = os.getpid()
+            self._id = uuid.uuid4().hex
+        pad = os.path.join(self.map, f'worker-{self._id}.json')
+        with open(pad + '.tmp', 'w') as bestand:
+            json.dump({'tijd': nu, 'pid': self._pid, 'host': self._host, 'waarden': waarden}, bestand)
+        os.replace(pad + '.tmp', pad)
+
+    @contextlib.contextmanager
+    def _vergrendeld(self):
+        """Eén scrape tegelijk: het samenvoegen van gestopte workers mag niet half gezien worden."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.map, 'samenvoegen.lock'), 'w') as slot:
+            fcntl.flock(slot, fcntl.LOCK_EX)
+            yield
+
+    def _optellen(self, standen, totaal, gauges=True):
+        for stand in standen:
+            for metric, labels, waarde in stand['waarden']:
+                definitie = self._definities.get(metric)
+                if definitie is None or (definitie[0] == GAUGE and not gauges):
+                    continue
+                sleutel = (metric, tuple(tuple(paar) for paar in labels))
+                if definitie[0] == HISTOGRAM:
+                    huidig = totaal.setdefault(sleutel, [0] * len(waarde))
+                    for i, deel in enumerate(waarde):
+                        huidig[i] += deel
+                else:
+                    totaal[sleutel] = totaal.get(sleutel, 0) + waarde
+        return totaal
+
+    def _gestopte_workers_samenvoegen(self):
+        """Telt de tellers en histogrammen van gestopte workers op deze machine op bij totaal.json en verwijdert
+        hun bestanden. totaal.json onthoudt welke bestanden erin zitten, voor het geval het verwijderen mislukt."""
+        pad_totaal = os.path.join(self.map, 'totaal.json')
+        totaal = _lees(pad_totaal) or {'tijd': 0, 'waarden': [], 'samengevoegd': []}
+        samengevoegd = set(totaal['samengevoegd'])
+        gestopt = {}
+        for naam in os.listdir(self.map):
+            if not (naam.startswith('worker-') and naam.endswith('.json')) or naam in samengevoegd:
+                continue
+            stand = _lees(os.path.join(self.map, naam))
+            if stand is not None and stand.get('host') == self._host and not _leeft(stand['pid']):
+                gestopt[naam] = stand
+        if gestopt:
+            opgeteld = self._optellen([totaal] + list(gestopt.values()), {}, gauges=False)
+            with open(pad_totaal + '.tmp', 'w') as bestand:
+                json.dump({'tijd': 0, 'waarden': [[naam, labels, waarde] for (naam, labels), waarde in opgeteld.items()],
+                           'samengevoegd': sorted(set(gestopt) | {naam for naam in samengevoegd
+                                                                  if os.path.exists(os.path.join(self.map, naam))})},
+                          bestand)
+            os.replace(pad_totaal + '.tmp', pad_totaal)
+        for naam in samengevoegd | set(gestopt):
+            try:
+                os.remove(os.path.join(self.map, naam))
+            except OSError:
+                pass
+
+    def samenvoegen(self):
+        """Telt de standen van alle workers bij elkaar op, inclusief die van gestopte workers in totaal.json."""
+        nu = time.time()
+        with self._vergrendeld():
+            if fcntl is not None:
+                self._gestopte_workers_samenvoegen()
+            totaal = _lees(os.path.join(self.map, 'totaal.json')) or {'samengevoegd': []}
+            standen = []
+            for naam in os.listdir(self.map):
+                if naam.endswith('.json') and naam not in totaal['samengevoegd']:
+                    stand = _lees(os.path.join(self.map, naam))
+                    if stand is not None:
+                        standen.append(stand)
+        totaal = {}
+        self._optellen([stand for stand in standen if nu - stand['tijd'] < self.gauge_ttl], totaal)
+        return self._optellen([stand for stand in standen if nu - stand['tijd'] >= self.gauge_ttl], totaal, gauges=False)
+
+    def tekst(self):
+        """Alle metrics van alle workers in het tekstformaat van Prometheus."""
+        self.wegschrijven(forceer=True)
+        totaal = self.samenvoegen()
+        regels = []
+        for metric, (soort, help, grenzen) in sorted(self._definities.items()):
+            regels.append(f'# HELP {metric} {help}')
+            regels.append(f'# TYPE {metric} {soort}')
+            for (naam, labels), waarde in sorted(totaal.items()):
+                if naam != metric:
+                    continue
+                if soort == HISTOGRAM:
+                    cumulatief = 0
+                    for grens, aantal in zip(grenzen + (float('inf'),), waarde[:-2] + [waarde[-1] - sum(waarde[:-2])]):
+                        cumulatief += aantal
+                        regels.append(f'{metric}_bucket{_labels_tekst(labels, [("le", _getal(grens))])} {cumulatief}')
+                    regels.append(f'{metric}_sum{_labels_tekst(labels)} {_getal(waarde[-2])}')
+                    regels.append(f'{metric}_count{_labels_tekst(labels)} {waarde[-1]}')
+                else:
+                    regels.append(f'{metric}{_labels_tekst(labels)} {_getal(waarde)}')
+        return '\n'.join(regels) + '\n'
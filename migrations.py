@@ -0,0 +1,176 @@
+# Versiebeheer van het databaseschema.
+#
+# db.create_all() maakt alleen ontbrekende tabellen aan; een nieuwe kolom of index op een bestaande tabel komt
+# er zo nooit bij. Wijzigingen aan bestaande tabellen staan daarom hier als genummerde migraties. De tabel
+# schema_versie houdt bij welke migraties al zijn uitgevoerd. Elke migratie controleert zelf of haar werk al gedaan
+# is (bestaat de kolom of index al?), zodat ze ook opnieuw kan draaien: op een database die met create_all net is
+# aangemaakt, na een half gelukte poging, en op MySQL, waar een ALTER TABLE niet binnen de transactie valt.
+# Alles gaat via SQLAlchemy Core, zodat dezelfde migraties op MSSQL, MySQL en SQLite werken.
+#
+# Starten er meerdere workers tegelijk, dan migreert er maar één: zie vergrendeld. Een migratie die mislukt geeft
+# een exception; de app draait niet door op een half bijgewerkt schema.
+#
+# Gebruik: flask migreer (of flask migreer --opnieuw om alle migraties nog eens te draaien).
+# De app draait de openstaande migraties ook zelf, bij het eerste request en vóór de commando's die de catalogus
+# gebruiken (zie schema_bijwerken in app.py).
+
+import contextlib
+import datetime
+import os
+import socket
+import time
+
+import sqlalchemy as sa
+
+import onderhoud
+
+metadata = sa.MetaData()
+
+schema_versie = sa.Table('schema_versie', metadata,
+                         sa.Column('versie', sa.Integer, primary_key=True, autoincrement=False),
+                         sa.Column('naam', sa.String(100), nullable=False),
+                         sa.Column('toegepast', sa.DateTime, nullable=False))
+
+# Versie 0 in schema_versie is geen migratie, maar de claim van het proces dat op dit moment migreert.
+VERGRENDELING = 0
+
+
+class MigratieBezet(Exception):
+    """Een ander proces is aan het migreren en is na de wachttijd nog niet klaar."""
+
+
+# Koppeltabellen met het paar kolommen dat uniek hoort te zijn. De kolom waarop het vaakst wordt gezocht staat
+# vooraan, zodat de unieke index ook die zoekopdracht dekt.
+KOPPELTABELLEN = (
+    ('associations_IT', ('instrument_id', 'tag_id')),
+    ('associations_XIT', ('instrument_id', 'tag_id')),
+    ('associations_TO', ('optie_id', 'tag_id')),
+    ('associations_OS', ('werksessie_id', 'optie_id')),
+    ('associations_Ws_Mot', ('werksessie_id', 'motivatie_id')),
+)
+
+# (naam, tabel, kolommen, uniek)
+INDEXEN = tuple((f'uq_{tabel}_paar', tabel, kolommen, True) for tabel, kolommen in KOPPELTABELLEN) + (
+    ('ix_associations_Ws_Mot_motivatie_id', 'associations_Ws_Mot', ('motivatie_id',), False),
+    ('ix_werksessies_owner', 'werksessies', ('owner', 'id'), False),     # Lijst met werksessies per gebruiker
+    ('ix_motivaties_vraag_id', 'motivaties', ('vraag_id',), False),
+    ('ix_opties_vraag_id', 'opties', ('vraag_id',), False),
+)
+
+
+def _tabel(verbinding, naam):
+    return sa.Table(naam, sa.MetaData(), autoload_with=verbinding)
+
+
+def kolom_gewijzigd(verbinding):
+    """catalogus_versie.gewijzigd is later toegevoegd; create_all zet de kolom niet in een bestaande tabel."""
+    inspector = sa.inspect(verbinding)
+    if 'gewijzigd' in {kolom['name'] for kolom in inspector.get_columns('catalogus_versie')}:
+        return
+    quote = verbinding.dialect.identifier_preparer.quote
+    verbinding.execute(sa.text(f'ALTER TABLE {quote("catalogus_versie")} ADD {quote("gewijzigd")} '
+                               f'{sa.DateTime().compile(dialect=verbinding.dialect)} NULL'))
+
+
+def dubbele_koppelingen_verwijderen(verbinding):
+    """Verwijdert dubbele paren uit de koppeltabellen; per paar blijft de rij met het laagste id staan.
+    Dubbele paren ontstonden doordat een tag opnieuw aan een instrument of optie kon worden toegevoegd."""
+    for naam, kolommen in KOPPELTABELLEN:
+        tabel = _tabel(verbinding, naam)
+        # De extra subquery is nodig voor MySQL, dat anders niet uit een tabel wil verwijderen waarin het ook zoekt.
+        bewaren = sa.select(sa.func.min(tabel.c.id).label('id')) \
+            .group_by(*(tabel.c[kolom] for kolom in kolommen)).subquery('bewaren')
+        verwijderd = verbinding.execute(tabel.delete().where(tabel.c.id.notin_(sa.select(bewaren.c.id)))).rowcount
+        if verwijderd:
+            print(f'*** {verwijderd} dubbele rijen verwijderd uit {naam}')
+
+
+def indexen_aanmaken(verbinding):
+    """Unieke indexen op de paren in de koppeltabellen en indexen op de kolommen waarop veel wordt gezocht."""
+    inspector = sa.inspect(verbinding)
+    for naam, tabelnaam, kolommen, uniek in INDEXEN:
+        if naam in {index['name'] for index in inspector.get_indexes(tabelnaam)}:
+            continue
+        tabel = _tabel(verbinding, tabelnaam)
+        sa.Index(naam, *(tabel.c[kolom] for kolom in kolommen), unique=uniek).create(verbinding)
+
+
+def tabel_onderhoud_log(verbinding):
+    onderhoud.onderhoud_log.create(verbinding, checkfirst=True)
+
+
+def planningsrij(verbinding):
+    onderhoud.planningsrij_aanmaken(verbinding)
+
+
+# (versie, naam, functie). Nieuwe migraties komen achteraan, met het volgende nummer.
+MIGRATIES = (
+    (1, 'catalogus_versie.gewijzigd', kolom_gewijzigd),
+    (2, 'dubbele koppelingen verwijderen', dubbele_koppelingen_verwijderen),
+    (3, 'indexen op koppeltabellen en zoekkolommen', indexen_aanmaken),
+    (4, 'tabel onderhoud_log', tabel_onderhoud_log),
+    (5, 'planningsrij in onderhoud_log', planningsrij),
+)
+
+
+def _schema_versie_aanmaken(engine):
+    try:
+        schema_versie.create(engine, checkfirst=True)
+    except sa.exc.DatabaseError:
+        # Een ander proces heeft de tabel tussen de controle en de CREATE TABLE aangemaakt.
+        if not sa.inspect(engine).has_table(schema_versie.name):
+            raise
+
+
+@contextlib.contextmanager
+def vergrendeld(engine, wachttijd=300, verlopen=900):
+    """Laat maar één proces tegelijk migreren. De claim is een rij met versie VERGRENDELING in schema_versie: door
+    de primaire sleutel lukt die insert op elke database maar één proces. De andere wachten tot de rij weg is en
+    zien dan dat er niets meer te doen is. Een claim die ouder is dan verlopen seconden is van een proces dat tijdens
+    het migreren is gestopt; die wordt weggehaald."""
+    begin = time.monotonic()
+    while True:
+        try:
+            with engine.begin() as verbinding:
+                verbinding.execute(schema_versie.insert(), {'versie': VERGRENDELING,
+                                                            'naam': f'migratie bezig: {socket.gethostname()} {os.getpid()}'[:100],
+                                                            'toegepast': datetime.datetime.utcnow()})
+            break
+        except sa.exc.IntegrityError:
+            pass
+        with engine.begin() as verbinding:
+            verbinding.execute(schema_versie.delete().where(
+                (schema_versie.c.versie == VERGRENDELING) &
+                (schema_versie.c.toegepast < datetime.datetime.utcnow() - datetime.timedelta(seconds=verlopen))))
+        if time.monotonic() - begin > wachttijd:
+            raise MigratieBezet(f'Na {wachttijd} seconden migreert een ander proces nog steeds.')
+        time.sleep(0.5)
+    try:
+        yield
+    finally:
+        with engine.begin() as verbinding:
+            verbinding.execute(schema_versie.delete().where(schema_versie.c.versie == VERGRENDELING))
+
+
+def migreer(engine, opnieuw=False, aanmaken=None):
+    """Voert de migraties uit die nog niet in schema_versie staan, of met opnieuw=True alle migraties.
+    aanmaken (bijvoorbeeld db.create_all) maakt de ontbrekende tabellen van de app aan; dat gebeurt binnen dezelfde
+    claim. Zonder aanmaken moeten de tabellen al bestaan. Geeft de namen van de uitgevoerde migraties terug."""
+    _schema_versie_aanmaken(engine)
+    uitgevoerd = []
+    with vergrendeld(engine):
+        if aanmaken is not None:
+            aanmaken()
+        with engine.connect() as verbinding:
+            toegepast = set(verbinding.execute(sa.select(schema_versie.c.versie)
+                                               .where(schema_versie.c.versie != VERGRENDELING)).scalars())
+        for versie, naam, functie in MIGRATIES:
+            if versie in toegepast and not opnieuw:
+                continue
+            with engine.begin() as verbinding:
+                functie(verbinding)
+                if versie not in toegepast:
+                    verbinding.execute(schema_versie.insert(), {'versie': versie, 'naam': naam,
+                                                                'toegepast': datetime.datetime.utcnow()})
+            uitgevoerd.append(f'{versie}: {naam}')
+    return uitgevoerd
@@ -0,0 +1,152 @@
+# Onderhoud van de database: opruimen van rijen waarvan de bovenliggende rij niet meer bestaat.
+#
+# Bij het verwijderen van werksessies, vragen, opties en tags blijven er soms rijen achter: motivaties zonder
+# werksessie, koppelingen naar verwijderde opties of tags, en op SQLite (dat foreign keys niet afdwingt) ook opties
+# zonder vraag. Elke taak hieronder is één DELETE met NOT EXISTS, zodat de database het werk in één keer doet in
+# plaats van dat de app alle rijen ophaalt en ze een voor een verwijdert.
+# De volgorde doet ertoe: eerst de vragen en opties, dan de koppelingen die daardoor los zijn komen te hangen,
+# en als laatste de motivaties die aan geen enkele werksessie meer gekoppeld zijn.
+#
+# Elke uitvoering komt met het aantal verwijderde rijen en de duur in de tabel onderhoud_log. Daarin staat ook een
+# rij met taak PLANNING, waarmee een worker het geplande onderhoud claimt (zie Planning.aan_de_beurt).
+
+import collections
+import datetime
+import time
+
+import sqlalchemy as sa
+
+metadata = sa.MetaData()
+
+onderhoud_log = sa.Table('onderhoud_log', metadata,
+                         sa.Column('id', sa.Integer, primary_key=True),
+                         sa.Column('taak', sa.String(100), nullable=False),
+                         sa.Column('rijen', sa.Integer, nullable=False),
+                         sa.Column('duur', sa.Float, nullable=False),
+                         sa.Column('tijdstip', sa.DateTime, nullable=False))
+
+PLANNING = 'planning'
+
+Resultaat = collections.namedtuple('Resultaat', 'taak rijen duur catalogus')
+
+
+def _ontbreekt(kolom, doel):
+    """Waar als de kolom leeg is of verwijst naar een rij in doel die niet (meer) bestaat."""
+    return kolom.is_(None) | ~sa.exists().where(doel.c.id == kolom)
+
+
+def _vragen_zonder_categorie(t):
+    return t['vragen'].delete().where(_ontbreekt(t['vragen'].c.categorie_id, t['categorieen']))
+
+
+def _opties_zonder_vraag(t):
+    return t['opties'].delete().where(_ontbreekt(t['opties'].c.vraag_id, t['vragen']))
+
+
+def _koppelingen(tabel, *kolommen):
+    """Koppelingen waarvan een van de kanten niet meer bestaat. kolommen zijn paren (kolom, doeltabel)."""
+    def taak(t):
+        koppeling = t[tabel]
+        return koppeling.delete().where(sa.or_(*(_ontbreekt(koppeling.c[kolom], t[doel]) for kolom, doel in kolommen)))
+    return taak
+
+
+def _motivatiekoppelingen(t):
+    # Naast losse koppelingen ook die naar een motivatie bij een vraag die niet meer bestaat.
+    koppeling, motivaties = t['associations_Ws_Mot'], t['motivaties']
+    bij_verwijderde_vraag = sa.exists().where((motivaties.c.id == koppeling.c.motivatie_id)
+                                              & ~sa.exists().where(t['vragen'].c.id == motivaties.c.vraag_id))
+    return koppeling.delete().where(_ontbreekt(koppeling.c.werksessie_id, t['werksessies'])
+                                    | _ontbreekt(koppeling.c.motivatie_id, motivaties)
+                                    | bij_verwijderde_vraag)
+
+
+def _motivaties_zonder_werksessie(t):
+    motivaties = t['motivaties']
+    return motivaties.delete().where(~sa.exists().where(t['associations_Ws_Mot'].c.motivatie_id == motivaties.c.id))
+
+
+# (naam, hoort bij de catalogus, functie die de DELETE maakt uit de tabellen van de app)
+TAKEN = (
+    ('vragen zonder categorie', True, _vragen_zonder_categorie),
+    ('opties zonder vraag', True, _opties_zonder_vraag),
+    ('koppelingen instrument-plustag', True, _koppelingen('associations_IT', ('instrument_id', 'instrumenten'), ('tag_id', 'tags'))),
+    ('koppelingen instrument-mintag', True, _koppelingen('associations_XIT', ('instrument_id', 'instrumenten'), ('tag_id', 'tags'))),
+    ('koppelingen optie-tag', True, _koppelingen('associations_TO', ('optie_id', 'opties'), ('tag_id', 'tags'))),
+    ('gekozen opties', False, _koppelingen('associations_OS', ('werksessie_id', 'werksessies'), ('optie_id', 'opties'))),
+    ('koppelingen werksessie-motivatie', False, _motivatiekoppelingen),
+    ('motivaties zonder werksessie', False, _motivaties_zonder_werksessie),
+)
+
+
+def uitvoeren(engine, tabellen, namen=None):
+    """Voert de taken uit, of alleen die uit namen, elk in een eigen transactie. tabellen is db.metadata.tables.
+    Geeft per taak een Resultaat met het aantal verwijderde rijen en de duur in seconden."""
+    resultaten = []
+    for naam, catalogus, functie in TAKEN:
+        if namen is not None and naam not in namen:
+            continue
+        with engine.begin() as verbinding:
+            begin = time.perf_counter()
+            rijen = verbinding.execute(functie(tabellen)).rowcount
+            duur = time.perf_counter() - begin
+            verbinding.execute(onderhoud_log.insert(), {'taak': naam, 'rijen': rijen, 'duur': duur,
+                                                        'tijdstip': datetime.datetime.utcnow()})
+        resultaten.append(Resultaat(naam, rijen, duur, catalogus))
+    return resultaten
+
+
+def geschiedenis(engine, aantal=50):
+    """De laatste uitvoeringen, nieuwste eerst."""
+    with engine.connect() as verbinding:
+        return verbinding.execute(sa.select(onderhoud_log).where(onderhoud_log.c.taak != PLANNING)
+                                  .order_by(onderhoud_log.c.id.desc()).limit(aantal)).all()
+
+
+def planningsrij_aanmaken(verbinding):
+    """Zet de rij neer waarmee Planning het onderhoud claimt, als die er nog niet is. Het tijdstip ligt ver in het
+    verleden, zodat de eerste controle het onderhoud meteen mag claimen."""
+    if verbinding.execute(sa.select(onderhoud_log.c.id).where(onderhoud_log.c.taak == PLANNING)).first() is None:
+        verbinding.execute(onderhoud_log.insert(), {'taak': PLANNING, 'rijen': 0, 'duur': 0,
+                                                    'tijdstip': datetime.datetime(2000, 1, 1)})
+
+
+class Planning:
+    """Houdt bij of het onderhoud weer aan de beurt is. Elke worker kijkt hooguit eens per interval in de database
+    wanneer het onderhoud voor het laatst is gedaan, door welke worker dan ook. Met interval 0 staat de planning uit."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        # De eerste controle volgt kort na de start; workers worden vaak vaker herstart dan het interval.
+        self._volgende = time.time() + min(interval, 60)
+
+    def lokaal_aan_de_beurt(self):
+        """Goedkope controle zonder database, voor elk request."""
+        if not self.interval or time.time() < self._volgende:
+            return False
+        self._volgende = time.time() + self.interval
+        return True
+
+    def aan_de_beurt(self, engine):
+        """Waar als deze worker het onderhoud nu moet doen. Alle workers kijken rond hetzelfde moment; alleen de
+        worker wiens UPDATE van de planningsrij slaagt, krijgt het onderhoud. Die UPDATE zet het tijdstip alleen als
+        het ouder is dan het interval, en de database voert zulke UPDATEs na elkaar uit, dus de rest vindt daarna
+        geen rij meer. Onderhoud dat binnen het interval met de hand is gedaan, telt ook mee."""
+        nu = datetime.datetime.utcnow()
+        grens = nu - datetime.timedelta(seconds=self.interval)
+        with engine.connect() as verbinding:
+            laatste = verbinding.execute(sa.select(sa.func.max(onderhoud_log.c.tijdstip))
+                                         .where(onderhoud_log.c.taak != PLANNING)).scalar()
+        if laatste is not None and laatste > grens:
+            return False
+        claimen = onderhoud_log.update() \
+            .where((onderhoud_log.c.taak == PLANNING) & (onderhoud_log.c.tijdstip <= grens)).values(tijdstip=nu)
+        with engine.begin() as verbinding:
+            if verbinding.execute(claimen).rowcount:
+                return True
+            # Zonder planningsrij (bijvoorbeeld met de hand weggehaald) claimt niemand; zet hem terug en probeer
+            # het nog een keer. Zetten twee workers hem tegelijk terug, dan raakt de UPDATE beide rijen, maar slaagt
+            # hij nog steeds voor maar één worker.
+            planningsrij_aanmaken(verbinding)
+        with engine.begin() as verbinding:
+            return verbinding.execute(claimen).rowcount > 0
@@ -0,0 +1,319 @@
+# Scoring van instrumenten op basis van de tags die in een werksessie actief zijn.
+#
+# De koppelingen tussen instrumenten en tags worden eenmalig vastgelegd in een incidentiematrix.
+# Elke rij van de matrix is een bitset (een gewone Python int): bit i staat aan als tag i aan het
+# instrument gekoppeld is. Er is een matrix voor de plustags en een matrix voor de mintags.
+# Het scoren van alle instrumenten is dan één matrix-vectorproduct: per rij een AND met de bitset
+# van de tags in scope, en daarna tellen hoeveel bits er aan staan.
+#
+# Voor een werksessie die antwoord voor antwoord wordt ingevuld hoeft niet steeds alles opnieuw te worden
+# gescoord: de OptieIndex wijst per antwoordoptie de geraakte instrumenten aan, en een SessieScore past alleen
+# de hits en de plek in de ranglijst van die instrumenten aan. Voor losse sets van opties zonder werksessie, zoals de wat-als-scenario's van
+# watals.py, telt scoor_scenarios de hits met dezelfde index op, voor alle scenario's in één keer.
+#
+# Uit de hits volgt per instrument een prioriteit. Hoe plustags en mintags daarbij tegen elkaar wegen bepaalt
+# de scoringsstrategie. Alle strategieen staan in het register STRATEGIEEN en werken op hele lijsten van hits
+# tegelijk; welke strategie actief is staat in de database (zie Instellingen in app.py).
+
+import bisect
+import heapq
+import operator
+import threading
+from collections import namedtuple
+
+# Methoden voor het bepalen van de prioriteit op basis van plustags en mintags
+DIFFERENCE = 0
+EXCLUDED = 1
+WEIGH_DOWN = 2
+WEIGH_DOWN_3 = 3
+# Prioriteiten, correspondeert met CSS
+PRIO_HI = 2
+PRIO_MID = 1
+PRIO_LO = 0
+PRIORITEITSKLASSEN = {PRIO_HI: 'prio_hi', PRIO_MID: 'prio_mid', PRIO_LO: 'prio_lo'}
+
+Strategie = namedtuple('Strategie', 'nummer naam omschrijving functie')
+STRATEGIEEN = {}
+
+def registreer_strategie(nummer, naam, omschrijving, functie):
+    """Een strategie krijgt de lijsten met plustag hits en mintag hits van alle instrumenten en geeft per
+    instrument de prioriteit terug."""
+    STRATEGIEEN[nummer] = Strategie(nummer, naam, omschrijving, functie)
+
+def verschil(tag_hits, extag_hits):
+    return [tags - extags for tags, extags in zip(tag_hits, extag_hits)]
+
+def uitsluiten(tag_hits, extag_hits):
+    return [tags * (extags == 0) for tags, extags in zip(tag_hits, extag_hits)]
+
+def gewogen(plusgewicht, mingewicht):
+    """Maakt een strategie waarin plustags en mintags elk hun eigen gewicht hebben."""
+    def strategie(tag_hits, extag_hits):
+        return [plusgewicht * tags - mingewicht * extags for tags, extags in zip(tag_hits, extag_hits)]
+    return strategie
+
+registreer_strategie(DIFFERENCE, 'DIFFERENCE', 'Aantal plustags min het aantal mintags.', verschil)
+registreer_strategie(EXCLUDED, 'EXCLUDED', 'Een enkele actieve mintag sluit het instrument helemaal uit.', uitsluiten)
+registreer_strategie(WEIGH_DOWN, 'WEIGH_DOWN', 'Mintags tellen twee keer zo zwaar als plustags.', gewogen(1, 2))
+registreer_strategie(WEIGH_DOWN_3, 'WEIGH_DOWN_3', 'Mintags tellen drie keer zo zwaar als plustags.', gewogen(1, 3))
+
+
+def prioriteitsklasse(priority, max_priority, marge=1):
+    """De prioriteitsklasse van één instrument. Als de score van een instrument minder dan de marge verschilt met de
+    topprioriteit, krijgt het instrument ook de topprioriteit."""
+    if priority == 0:
+        return PRIO_LO
+    elif priority == max_priority:
+        return PRIO_HI
+    elif priority >= (max_priority - marge):
+        return PRIO_HI
+    elif priority > 0:
+        return PRIO_MID
+    else:
+        return PRIO_LO
+
+
+def prioriteiten(tag_hits, extag_hits, methode=EXCLUDED, marge=1):
+    """Geeft per instrument de prioriteit en de prioriteitsklasse, uit de aantallen plustags en mintags in scope."""
+    priorities = STRATEGIEEN[methode].functie(tag_hits, extag_hits)
+    max_priority = max([0] + priorities) # Boekhouding om de hoogste prioriteitsscore te kunnen gebruiken
+    return priorities, [prioriteitsklasse(priority, max_priority, marge) for priority in priorities]
+
+
+def prioritize_instruments(instrument_met_alle_tags, methode=EXCLUDED, marge=1):
+    """Deze functie dient om de lijst te filteren en te sorteren. De methode is het nummer van een strategie in
+    STRATEGIEEN; zie prioriteiten voor de marge."""
+    tag_hits = [len(instrument[1]) for instrument in instrument_met_alle_tags]
+    extag_hits = [len(instrument[2]) for instrument in instrument_met_alle_tags]
+    priorities, priority_classes = prioriteiten(tag_hits, extag_hits, methode, marge)
+
+    prioritized_list = []
+    for instrument, tags, extags, priority, priority_class in zip(instrument_met_alle_tags, tag_hits, extag_hits,
+                                                                   priorities, priority_classes):
+        prioritized_list.append([instrument[0], tags, instrument[1], extags, instrument[2], priority, priority_class])
+
+    return sorted(prioritized_list, key=operator.itemgetter(5), reverse=True)
+
+
+def popcount(bits):
+    """Aantal bits dat aan staat. int.bit_count() bestaat pas vanaf Python 3.10."""
+    return bin(bits).count('1')
+
+
+class TagMatrix:
+    """Incidentiematrix van alle instrumenten tegen hun plustags en mintags."""
+
+    def __init__(self, instrumenten):
+        self.instrumenten = list(instrumenten)
+        self.tag_bits = {}      # tag id -> bit in de bitsets
+        self.plus = []          # per instrument de bitset van de plustags
+        self.min = []           # per instrument de bitset van de mintags
+        for instrument in self.instrumenten:
+            self.plus.append(self._bitset(instrument.tags))
+            self.min.append(self._bitset(instrument.extags))
+
+    def _bitset(self, tags):
+        bits = 0
+        for tag in tags:
+            bit = self.tag_bits.get(tag.id)
+            if bit is None:
+                bit = self.tag_bits[tag.id] = 1 << len(self.tag_bits)
+            bits |= bit
+        return bits
+
+    def scope(self, tags):
+        """Bitset van de tags in scope. Tags die aan geen enkel instrument gekoppeld zijn vallen weg."""
+        bits = 0
+        for tag in tags:
+            bits |= self.tag_bits.get(tag.id, 0)
+        return bits
+
+    def hits(self, scope):
+        """Het matrix-vectorproduct: per instrument het aantal plustags en mintags in scope."""
+        return ([popcount(row & scope) for row in self.plus],
+                [popcount(row & scope) for row in self.min])
+
+    def _in_scope(self, tags, scope):
+        return [tag for tag in tags if self.tag_bits[tag.id] & scope]
+
+    def score(self, scope):
+        """Geeft per instrument [instrument, plustags in scope, mintags in scope], de invoer voor prioritize_instruments.
+        Alleen voor instrumenten met een treffer worden de tags zelf opgezocht."""
+        instrument_met_alle_tags = []
+        for instrument, plus_bits, min_bits in zip(self.instrumenten, self.plus, self.min):
+            tags = self._in_scope(instrument.tags, scope) if plus_bits & scope else []
+            extags = self._in_scope(instrument.extags, scope) if min_bits & scope else []
+            instrument_met_alle_tags.append([instrument, tags, extags])
+        return instrument_met_alle_tags
+
+
+class OptieIndex:
+    """Omgekeerde index van antwoordoptie naar de instrumenten die via de tags van die optie geraakt worden.
+    Per optie staan de tags die aan minstens één instrument gekoppeld zijn, per tag de posities van de instrumenten
+    in de matrix die de tag als plustag of als mintag hebben."""
+
+    def __init__(self, matrix, opties):
+        self.matrix = matrix
+        self.plus_postings = {}
+        self.min_postings = {}
+        for i, instrument in enumerate(matrix.instrumenten):
+            for tag in instrument.tags:
+                self.plus_postings.setdefault(tag.id, []).append(i)
+            for tag in instrument.extags:
+                self.min_postings.setdefault(tag.id, []).append(i)
+        self.opties = {optie.id: tuple(tag.id for tag in optie.tags if tag.id in matrix.tag_bits)
+                       for optie in opties}
+
+    def sessiescore(self, methode=EXCLUDED, marge=1):
+        return SessieScore(self, methode, marge)
+
+    def scope(self, opties):
+        """De id's van de tags die bij de gegeven gekozen opties in scope zijn."""
+        return frozenset(tag_id for optie_id in opties for tag_id in self.opties.get(optie_id, ()))
+
+    def hits(self, scope):
+        """Per instrument het aantal plustags en mintags in scope, opgeteld uit de postings van de tags in scope."""
+        plus_hits = [0] * len(self.matrix.instrumenten)
+        min_hits = [0] * len(self.matrix.instrumenten)
+        for tag_id in scope:
+            for i in self.plus_postings.get(tag_id, ()):
+                plus_hits[i] += 1
+            for i in self.min_postings.get(tag_id, ()):
+                min_hits[i] += 1
+        return plus_hits, min_hits
+
+
+class SessieScore:
+    """Ranglijst van alle instrumenten voor één werksessie, bijgehouden met de omgekeerde index.
+    Bij een gewijzigd antwoord worden alleen de postings van de toegevoegde en verwijderde opties bijgewerkt, en
+    alleen de geraakte instrumenten krijgen een nieuwe prioriteit, een nieuwe rij en een nieuwe plek in de ranglijst.
+    Een tag telt per instrument één keer mee, ook als meerdere gekozen opties dezelfde tag hebben; daarom
+    wordt per tag bijgehouden door hoeveel gekozen opties hij in scope is.
+
+    De ranglijst is een gesorteerde lijst van (-prioriteit, positie in de matrix); dat is dezelfde volgorde als het
+    stabiele sorteren in prioritize_instruments. De prioriteitsklasse hangt ook af van de topprioriteit: verandert
+    die, dan worden ook de rijen bovenin de ranglijst vernieuwd waarvan de klasse daardoor kan veranderen.
+    Rijen worden nooit aangepast maar vervangen, zodat eerder teruggegeven lijsten (in de cache) kloppen."""
+
+    def __init__(self, index, methode=EXCLUDED, marge=1):
+        self.index = index
+        self.strategie = STRATEGIEEN[methode].functie
+        self.marge = marge
+        self.opties = frozenset()
+        self.tag_telling = {}
+        self.scope = 0
+        self.plus_hits = [0] * len(index.matrix.instrumenten)
+        self.min_hits = [0] * len(index.matrix.instrumenten)
+        self.priorities = self.strategie(self.plus_hits, self.min_hits)
+        self.max_priority = max([0] + self.priorities)
+        self.rang = sorted((-priority, i) for i, priority in enumerate(self.priorities))
+        # Zonder gekozen opties heeft geen enkel instrument tags in scope.
+        self.rijen = [[instrument, 0, [], 0, [], priority, prioriteitsklasse(priority, self.max_priority, marge)]
+                      for instrument, priority in zip(index.matrix.instrumenten, self.priorities)]
+        self._lock = threading.Lock()
+
+    def _tel(self, optie_id, stap, geraakt):
+        for tag_id in self.index.opties.get(optie_id, ()):
+            telling = self.tag_telling.get(tag_id, 0) + stap
+            self.tag_telling[tag_id] = telling
+            # Alleen als de tag in of uit scope gaat veranderen de hits van de instrumenten.
+            if (stap == 1 and telling == 1) or (stap == -1 and telling == 0):
+                self.scope ^= self.index.matrix.tag_bits[tag_id]
+                for i in self.index.plus_postings.get(tag_id, ()):
+                    self.plus_hits[i] += stap
+                    geraakt.add(i)
+                for i in self.index.min_postings.get(tag_id, ()):
+                    self.min_hits[i] += stap
+                    geraakt.add(i)
+
+    def _rij(self, i):
+        """De rij van prioritize_instruments voor het instrument op positie i."""
+        matrix = self.index.matrix
+        instrument = matrix.instrumenten[i]
+        tag_hits, extag_hits, priority = self.plus_hits[i], self.min_hits[i], self.priorities[i]
+        tags = matrix._in_scope(instrument.tags, self.scope) if tag_hits else []
+        extags = matrix._in_scope(instrument.extags, self.scope) if extag_hits else []
+        return [instrument, tag_hits, tags, extag_hits, extags, priority,
+                prioriteitsklasse(priority, self.max_priority, self.marge)]
+
+    def _herschik(self, geraakt):
+        posities = sorted(geraakt)
+        nieuw = self.strategie([self.plus_hits[i] for i in posities], [self.min_hits[i] for i in posities])
+        if len(posities) > len(self.rang) // 8:
+            # Bij veel geraakte instrumenten is opnieuw sorteren goedkoper dan elk instrument apart verplaatsen.
+            for i, priority in zip(posities, nieuw):
+                self.priorities[i] = priority
+            self.rang = sorted((-priority, i) for i, priority in enumerate(self.priorities))
+        else:
+            for i, priority in zip(posities, nieuw):
+                if priority != self.priorities[i]:
+                    del self.rang[bisect.bisect_left(self.rang, (-self.priorities[i], i))]
+                    bisect.insort(self.rang, (-priority, i))
+                    self.priorities[i] = priority
+
+        max_priority = max(0, -self.rang[0][0])
+        if max_priority != self.max_priority:
+            # Onder deze grens is de klasse MID of LO, welke topprioriteit er ook is; prioriteit 0 is altijd LO.
+            grens = min(max_priority, self.max_priority) - max(self.marge, 0)
+            for min_priority, i in self.rang:
+                if -min_priority < max(grens, 1):
+                    break
+                geraakt.add(i)
+            if grens < 0:
+                # Negatieve prioriteiten vlak onder nul zijn HI als ze binnen de marge van de topprioriteit vallen.
+                begin = bisect.bisect_left(self.rang, (1, -1))
+                geraakt.update(i for _, i in self.rang[begin:bisect.bisect_left(self.rang, (1 - grens, -1))])
+            self.max_priority = max_priority
+        for i in geraakt:
+            self.rijen[i] = self._rij(i)
+
+    def score(self, opties):
+        """Werkt de ranglijst bij naar de gegeven gekozen opties en geeft dezelfde lijst als prioritize_instruments
+        met TagMatrix.score. Het bijwerken kost alleen werk voor de geraakte instrumenten; de lijst zelf is een
+        kopie van de verwijzingen naar de rijen, in de volgorde van de ranglijst."""
+        opties = frozenset(opties)
+        with self._lock:
+            geraakt = set()
+            for optie_id in opties - self.opties:
+                self._tel(optie_id, 1, geraakt)
+            for optie_id in self.opties - opties:
+                self._tel(optie_id, -1, geraakt)
+            self.opties = opties
+            if geraakt:
+                self._herschik(geraakt)
+            rijen = self.rijen
+            return [rijen[i] for _, i in self.rang]
+
+
+Ranglijst = namedtuple('Ranglijst', 'scope instrumenten')
+
+
+def scoor_scenarios(index, scenarios, methode=EXCLUDED, marge=1, top=None):
+    """Scoort een hele reeks sets van gekozen opties in één keer, zonder werksessie en zonder database.
+    Scenario's met dezelfde opties, of met opties die samen dezelfde tags in scope brengen, worden maar één keer
+    gescoord. Geeft per scenario, in dezelfde volgorde, een Ranglijst: de tag id's in scope en per instrument
+    (positie in de matrix, plustags in scope, mintags in scope, prioriteit, prioriteitsklasse), gesorteerd zoals
+    prioritize_instruments dat doet en met top ingevuld alleen de eerste top instrumenten."""
+    per_opties = {}
+    per_scope = {}
+    ranglijsten = []
+    for opties in scenarios:
+        opties = frozenset(opties)
+        ranglijst = per_opties.get(opties)
+        if ranglijst is None:
+            scope = index.scope(opties)
+            ranglijst = per_scope.get(scope)
+            if ranglijst is None:
+                plus_hits, min_hits = index.hits(scope)
+                priorities, priority_classes = prioriteiten(plus_hits, min_hits, methode, marge)
+                posities = range(len(priorities))
+                if top is None:
+                    volgorde = sorted(posities, key=priorities.__getitem__, reverse=True)
+                else:
+                    # Zelfde volgorde als sorted(..., reverse=True)[:top], zonder alles te sorteren.
+                    volgorde = heapq.nlargest(top, posities, key=priorities.__getitem__)
+                ranglijst = per_scope[scope] = Ranglijst(scope, [(i, plus_hits[i], min_hits[i], priorities[i],
+                                                                  priority_classes[i]) for i in volgorde])
+            per_opties[opties] = ranglijst
+        ranglijsten.append(ranglijst)
+    return ranglijsten
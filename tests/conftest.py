@@ -0,0 +1,52 @@
+# Gedeelde voorzieningen voor de tests. De tests draaien vanuit de hoofdmap met: python -m pytest -q
+
+import os
+import sys
+
+HOOFDMAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, HOOFDMAP)
+sys.path.insert(0, os.path.join(HOOFDMAP, 'benchmarks'))
+
+import pytest
+
+import synthetisch
+
+
+@pytest.fixture(scope='session')
+def A(tmp_path_factory):
+    """app.py met een SQLite-database in een tijdelijke map, zoals benchmarks/bench_app.py dat doet. app.py kan maar
+    één keer per proces worden geïmporteerd; tests die een andere catalogus nodig hebben gebruiken vul_app."""
+    import bench_app
+    return bench_app.bereid_app_voor(str(tmp_path_factory.mktemp('app')))
+
+
+def vul_app(A, sessies=3, fractie=0.5, seed=0, **grootte):
+    """Maakt de database van app.py leeg en vult hem met een synthetische catalogus, een administrator 'beheerder'
+    (wachtwoord 'wachtwoord') en werksessies met antwoorden. Ook de caches van de worker worden geleegd."""
+    import migrations
+    import onderhoud
+    rijen = synthetisch.catalogus_rijen(seed=seed, **grootte)
+    antwoorden = synthetisch.antwoorden(synthetisch.catalogus(seed=seed, **grootte),
+                                        sessies=sessies, fractie=fractie, seed=seed)
+    with A.app.app_context():
+        A.db.drop_all()
+        migrations.metadata.drop_all(A.db.engine)
+        onderhoud.metadata.drop_all(A.db.engine)
+        A.db.create_all()
+        migrations.migreer(A.db.engine)
+        A.db.session.add(A.User(id=1, username='beheerder', password=A.hash_wachtwoord('wachtwoord'), role=1))
+        A.db.session.commit()
+        synthetisch.vul_database(A, rijen, antwoorden)
+    A._catalogus = None
+    for cache in (A.aanbevelingen_cache, A.sessiescores, A.gebruikers_cache):
+        cache.invalidate()
+    return antwoorden
+
+
+def inloggen(A, gebruikersnaam='beheerder', wachtwoord='wachtwoord', werksessie=1):
+    client = A.app.test_client()
+    antwoord = client.post('/login', data={'username': gebruikersnaam, 'password': wachtwoord})
+    assert antwoord.status_code == 302, antwoord.get_data(as_text=True)
+    if werksessie is not None:
+        client.get(f'/activate_session/{werksessie}')
+    return client
@@ -0,0 +1,103 @@
+# Antwoorden op de keuzehulp via het formulier (/questionnaire) en via de JSON-API (/api/antwoord): invoer die niet
+# van de keuzehulp zelf komt geeft een 400 en verandert niets.
+
+import pytest
+
+from conftest import vul_app, inloggen
+
+GROOTTE = dict(instrumenten=10, tags=20, tags_per_instrument=3, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=2, opties_per_vraag=3, tags_per_optie=2)
+
+
+@pytest.fixture
+def client(A):
+    vul_app(A, sessies=1, fractie=0.0, **GROOTTE)
+    return inloggen(A)
+
+
+def test_formulier_slaat_antwoord_op(A, client):
+    antwoord = client.post('/questionnaire', data={'vraag': '1', 'optie': ['2'], 'motivatie': 'Omdat'})
+    assert antwoord.status_code == 302
+    with A.app.app_context():
+        assert A.gekozen_opties(1) == {2}
+
+
+@pytest.mark.parametrize('formulier', [
+    {'vraag': 'een', 'optie': ['1'], 'motivatie': ''},
+    {'vraag': '1', 'optie': ['1x'], 'motivatie': ''},
+    {'optie': ['1'], 'motivatie': ''},
+    {'vraag': '1', 'optie': ['1']},
+])
+def test_formulier_ongeldig(A, client, formulier):
+    assert client.post('/questionnaire', data=formulier).status_code == 400
+    with A.app.app_context():
+        assert A.gekozen_opties(1) == frozenset()
+
+
+def test_ster_per_motivatie(A, client):
+    # Een ster per motivatie die niet leeg is, ook als er (door oude dubbele rijen) meer dan één is; een motivatie
+    # zonder tekst telt mee, net als voorheen.
+    with A.app.app_context():
+        for vraag, tekst in ((1, 'Omdat'), (1, 'En daarom'), (1, ''), (2, None)):
+            motivatie = A.Motivaties(motivatie=tekst, vraag=vraag)
+            A.db.session.add(motivatie)
+            A.db.session.flush()
+            A.db.session.execute(A.associations_Ws_Mot.insert(), {'werksessie_id': 1, 'motivatie_id': motivatie.id})
+        A.db.session.commit()
+    html = client.get('/questionnaire').get_data(as_text=True)
+    sterren = html.split('<span class="ster">')[1:]
+    assert [ster.split('</span>')[0].strip() for ster in sterren] == ['* *', '*']
+    assert 'None' not in html
+
+
+def test_api_slaat_antwoord_op(A, client):
+    antwoord = client.post('/api/antwoord', json={'vraag': 1, 'opties': [2], 'motivatie': 'x' * 499})
+    assert antwoord.status_code == 200
+    assert antwoord.get_json()['motivatie'] is True
+    with A.app.app_context():
+        assert A.gekozen_opties(1) == {2}
+
+
+@pytest.mark.parametrize('antwoord', [
+    {'vraag': 1, 'opties': [2], 'motivatie': None},
+    {'vraag': 1, 'opties': [2], 'motivatie': 12},
+    {'vraag': 1, 'opties': [2], 'motivatie': ['Omdat']},
+    {'vraag': 1, 'opties': [2], 'motivatie': 'x' * 500},
+    {'vraag': 1, 'opties': ['twee']},
+    [1, [2]],
+])
+def test_api_ongeldig(A, client, antwoord):
+    assert client.post('/api/antwoord', json=antwoord).status_code == 400
+    with A.app.app_context():
+        assert A.gekozen_opties(1) == frozenset()
+        assert A.Motivaties.query.count() == 0
+
+
+def test_bewaarde_aanbevelingen_volgen_antwoorden_en_catalogus(A, client):
+    def ophalen():
+        voor = A.aanbevelingen_cache.stats()
+        uitkomst = client.get('/api/aanbevelingen').get_json()
+        na = A.aanbevelingen_cache.stats()
+        return uitkomst, (na['hits'] - voor['hits'], na['misses'] - voor['misses'])
+
+    leeg, telling = ophalen()
+    assert telling == (0, 1)
+    assert ophalen() == (leeg, (1, 0))
+    assert leeg['actieve_tags'] == []
+
+    # Een ander antwoord geeft een andere lijst; het antwoord zelf heeft hem al berekend.
+    assert client.post('/api/antwoord', json={'vraag': 1, 'opties': [2], 'motivatie': ''}).status_code == 200
+    beantwoord, telling = ophalen()
+    assert telling == (1, 0)
+    assert beantwoord['actieve_tags'] != [] and beantwoord != leeg
+
+    # Een administrator geeft de gekozen optie een extra tag: de bewaarde lijst is dan van een oude catalogus.
+    with A.app.app_context():
+        optietags = {tag.id for tag in A.Optie.query.get(2).tags}
+        extra = A.Tag.query.filter(A.Tag.id.notin_(optietags)).order_by(A.Tag.id).first()
+        extra_id, extra_naam = extra.id, extra.naam
+    assert client.get(f'/question/1/option/2/add_tag/{extra_id}').status_code == 200
+    gewijzigd, telling = ophalen()
+    assert telling == (0, 1)
+    assert extra_naam in gewijzigd['actieve_tags'] and extra_naam not in beantwoord['actieve_tags']
+    assert ophalen() == (gewijzigd, (1, 0))
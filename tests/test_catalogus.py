@@ -0,0 +1,86 @@
+# De momentopname van de catalogus wordt per worker bewaard. Een andere worker die de catalogus wijzigt, verhoogt
+# catalogus_versie in de database; bij het volgende request laadt deze worker de catalogus dan opnieuw. De opgeschoonde
+# weergave van een instrument hoort bij de momentopname en wordt na een wijziging dus ook opnieuw gemaakt.
+
+import pytest
+import sqlalchemy as sa
+
+from conftest import vul_app, inloggen
+
+GROOTTE = dict(instrumenten=5, tags=10, tags_per_instrument=2, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=1, opties_per_vraag=2, tags_per_optie=1)
+
+
+@pytest.fixture
+def client(A):
+    vul_app(A, sessies=1, **GROOTTE)
+    return inloggen(A)
+
+
+def andere_worker(A, sql, versie_verhogen=True):
+    """Wijzigt de database buiten deze worker om; _catalogus blijft zoals hij was."""
+    with A.app.app_context(), A.db.engine.begin() as verbinding:
+        verbinding.execute(sa.text(sql))
+        # Zoals verhoog_catalogus_versie: een nieuwe database heeft nog geen versierij.
+        if versie_verhogen and not verbinding.execute(
+                sa.text('UPDATE catalogus_versie SET versie = versie + 1 WHERE id = 1')).rowcount:
+            verbinding.execute(sa.text('INSERT INTO catalogus_versie (id, versie) VALUES (1, 1)'))
+
+
+def test_andere_worker_verhoogt_versie(A, client):
+    assert b'Nieuwe naam' not in client.get('/summary').data
+    oud = A._catalogus
+
+    # Zonder nieuwe versie blijft de bewaarde momentopname in gebruik.
+    andere_worker(A, "UPDATE instrumenten SET naam = 'Nieuwe naam' WHERE id = 1", versie_verhogen=False)
+    assert b'Nieuwe naam' not in client.get('/summary').data
+    assert A._catalogus is oud
+
+    andere_worker(A, "UPDATE instrumenten SET naam = 'Nieuwe naam' WHERE id = 1")
+    assert b'Nieuwe naam' in client.get('/summary').data
+    assert A._catalogus is not oud and A._catalogus.versie == oud.versie + 1
+    nieuw = A._catalogus
+    client.get('/summary')
+    assert A._catalogus is nieuw
+
+
+def test_verhoog_catalogus_versie(A, client):
+    andere_worker(A, 'SELECT 1')
+    client.get('/summary')
+    oud = A._catalogus
+    with A.app.test_request_context():
+        assert A.get_catalogus() is oud
+        A.verhoog_catalogus_versie()
+        A.db.session.commit()
+        assert A.get_catalogus().versie == oud.versie + 1     # Ook binnen hetzelfde request
+        versie, gewijzigd = A.db.session.query(A.CatalogusVersie.versie, A.CatalogusVersie.gewijzigd).one()
+    assert versie == oud.versie + 1 and gewijzigd is not None
+    assert A.aanbevelingen_cache.stats()['items'] == 0 and A.sessiescores.stats()['items'] == 0
+
+
+def test_verhoog_zonder_versierij(A, client):
+    andere_worker(A, 'DELETE FROM catalogus_versie', versie_verhogen=False)     # Zoals na vul_app
+    with A.app.test_request_context():
+        A.verhoog_catalogus_versie()
+        A.db.session.commit()
+        assert A.db.session.query(A.CatalogusVersie.versie).scalar() == 1
+
+
+def test_gewijzigd_instrument_wordt_opnieuw_opgeschoond(A, client):
+    with A.app.app_context():
+        instrument = A.Instrument.query.get(1)
+        oud = instrument.beschrijving
+        formulier = {veld: getattr(instrument, veld) or '' for veld in
+                     ('naam', 'intro', 'beschrijving', 'afwegingen', 'voorbeelden', 'links', 'eigenaar', 'eigenaar_email')}
+    pagina = client.get('/instrument/1').get_data(as_text=True)
+    assert oud in pagina
+    weergave = A._catalogus.weergave(1)
+
+    formulier['beschrijving'] = 'Nieuwe tekst <script>alert(1)</script>\nTweede regel'
+    assert client.post('/instrument_update/1', data=formulier).status_code == 302
+    pagina = client.get('/instrument/1').get_data(as_text=True)
+    assert 'Nieuwe tekst' in pagina and 'Tweede regel' in pagina
+    assert '<script>alert(1)' not in pagina
+    assert oud not in pagina
+    assert A._catalogus.weergave(1) is not weergave
+    assert '<script>' not in A._catalogus.weergave(1).beschrijving
@@ -0,0 +1,36 @@
+# De template van de Word-exports wordt per worker één keer ingelezen; elke export werkt op een kopie. Een export mag
+# dus niets achterlaten in de template dat in de volgende export terechtkomt.
+
+import docx
+
+import export
+from conftest import vul_app
+
+GROOTTE = dict(instrumenten=5, tags=10, tags_per_instrument=2, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=2, opties_per_vraag=2, tags_per_optie=1)
+
+
+def tekst(buffer):
+    document = docx.Document(buffer)
+    return [alinea.text for alinea in document.paragraphs] + \
+        [cel.text for tabel in document.tables for rij in tabel.rows for cel in rij.cells]
+
+
+def test_template_blijft_ongewijzigd(A):
+    vul_app(A, sessies=2, fractie=0.5, **GROOTTE)
+    with A.app.test_request_context():
+        catalogus = A.get_catalogus()
+        exports = []
+        for werksessie_id in (1, 2, 1):
+            werksessie = A.Werksessie.query.get(werksessie_id)
+            exports.append((A.werksessie_voor_export(werksessie, catalogus),
+                            A.get_instruments(catalogus, werksessie)))
+    leeg = tekst(export.als_bytes(export.nieuw_document()))
+
+    eerste, tweede, derde = (tekst(export.export_session_to_word(gegevens, catalogus.categorieen, instrumenten))
+                             for gegevens, instrumenten in exports)
+    assert eerste == derde
+    assert eerste != tweede
+    assert 'Werksessie 1' in eerste and 'Werksessie 2' not in ' '.join(eerste)
+    assert len(eerste) > len(leeg)
+    assert tekst(export.als_bytes(export.nieuw_document())) == leeg
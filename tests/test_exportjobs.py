@@ -0,0 +1,74 @@
+# Exporttaken die mislukken zonder dat _render een .fout kon schrijven: een gestorven proces, een worker die is
+# herstart. Zulke taken moeten als mislukt gelden, en opruimen mag de bestanden van lopende taken niet weghalen.
+
+import json
+import os
+import time
+
+import pytest
+
+from exportjobs import ExportTaken, BEZIG, KLAAR, FOUT
+
+
+class Sterf:
+    """Argument voor een export dat het proces in de pool doodt zodra het wordt uitgepakt."""
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def wacht_op(taken, taak_id, seconden=60):
+    einde = time.time() + seconden
+    while taken.status(taak_id)['status'] == BEZIG:
+        assert time.time() < einde, 'De taak is niet afgerond'
+        time.sleep(0.1)
+    return taken.status(taak_id)
+
+
+def taak_json(taken, taak_id, aangemaakt, leeftijd=0):
+    pad = os.path.join(taken.map, taak_id + '.json')
+    with open(pad, 'w') as bestand:
+        json.dump({'downloadnaam': 'x.docx', 'eigenaar': None, 'aangemaakt': aangemaakt}, bestand)
+    os.utime(pad, (time.time() - leeftijd, time.time() - leeftijd))
+
+
+def test_gestorven_proces_geeft_fout_en_nieuwe_pool(tmp_path):
+    taken = ExportTaken(str(tmp_path), workers=1)
+    try:
+        taak_id = taken.start('catalogus', 'x.docx', None, Sterf())
+        assert wacht_op(taken, taak_id)['status'] == FOUT
+        # De kapotte pool wordt vervangen; de volgende export lukt gewoon.
+        taak_id = taken.start('catalogus', 'x.docx', None, [])
+        assert wacht_op(taken, taak_id)['status'] == KLAAR
+    finally:
+        taken._pool.shutdown()
+
+
+def test_taak_zonder_resultaat_verloopt(tmp_path):
+    taken = ExportTaken(str(tmp_path), workers=0, timeout=60)
+    taak_json(taken, 'a' * 32, time.time() - 30)
+    taak_json(taken, 'b' * 32, time.time() - 120)
+    assert taken.status('a' * 32)['status'] == BEZIG
+    assert taken.status('b' * 32)['status'] == FOUT
+    assert os.path.exists(os.path.join(taken.map, 'b' * 32 + '.fout'))
+
+
+def test_verlopen_artefact_wordt_opnieuw_gemaakt(tmp_path):
+    taken = ExportTaken(str(tmp_path), workers=0, timeout=60)
+    taak_id = taken.artefact('sleutel', 'catalogus', 'x.docx', [])
+    os.remove(taken.bestand(taak_id))
+    taak_json(taken, taak_id, time.time() - 120)
+    assert taken.artefact('sleutel', 'catalogus', 'x.docx', []) == taak_id
+    assert taken.status(taak_id)['status'] == KLAAR
+
+
+@pytest.mark.parametrize('timeout, blijft', [(600, True), (60, False)])
+def test_opruimen_laat_lopende_taken_staan(tmp_path, timeout, blijft):
+    taken = ExportTaken(str(tmp_path), workers=0, ttl=30, timeout=timeout)
+    taak_json(taken, 'a' * 32, time.time() - 100, leeftijd=100)     # Loopt nog (of is verlopen)
+    taak_json(taken, 'b' * 32, time.time() - 100, leeftijd=100)     # Klaar
+    open(taken.bestand('b' * 32), 'wb').close()
+    os.utime(taken.bestand('b' * 32), (time.time() - 100, time.time() - 100))
+    taken.opruimen()
+    assert os.path.exists(os.path.join(taken.map, 'a' * 32 + '.json')) == blijft
+    assert os.listdir(taken.map) == (['a' * 32 + '.json'] if blijft else [])
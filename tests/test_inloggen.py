@@ -0,0 +1,51 @@
+# Inloggen met een wachtwoordhash van een oude werkfactor: de hash wordt vervangen, en als dat niet lukt gaat het
+# inloggen gewoon door met de oude hash.
+
+import bcrypt as _bcrypt
+import pytest
+
+from wachtwoorden import rondes_van
+from conftest import vul_app
+
+GROOTTE = dict(instrumenten=5, tags=10, tags_per_instrument=2, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=1, opties_per_vraag=2, tags_per_optie=1)
+
+
+@pytest.fixture
+def oude_hash(A):
+    vul_app(A, sessies=1, **GROOTTE)
+    oud = _bcrypt.hashpw(b'wachtwoord', _bcrypt.gensalt(5)).decode()
+    with A.app.app_context():
+        A.User.query.get(1).password = oud
+        A.db.session.commit()
+    return oud
+
+
+def wachtwoordhash(A):
+    with A.app.app_context():
+        return A.User.query.get(1).password
+
+
+def test_hash_wordt_vervangen(A, oude_hash):
+    antwoord = A.app.test_client().post('/login', data={'username': 'beheerder', 'password': 'wachtwoord'})
+    assert antwoord.status_code == 302
+    assert rondes_van(wachtwoordhash(A)) == A.app.config['BCRYPT_LOG_ROUNDS']
+
+
+def test_mislukte_opslag_van_hash(A, oude_hash, monkeypatch, capsys):
+    echte_commit = A.db.session.commit
+    pogingen = []
+
+    def commit():
+        pogingen.append(1)
+        if len(pogingen) == 1:
+            raise RuntimeError('database weg')
+        echte_commit()
+    monkeypatch.setattr(A.db.session, 'commit', commit)
+    client = A.app.test_client()
+    antwoord = client.post('/login', data={'username': 'beheerder', 'password': 'wachtwoord'})
+    assert antwoord.status_code == 302
+    assert 'Kon de nieuwe wachtwoordhash van gebruiker 1 niet opslaan' in capsys.readouterr().out
+    monkeypatch.undo()
+    assert wachtwoordhash(A) == oude_hash
+    assert client.get('/').status_code == 200
@@ -0,0 +1,77 @@
+# Metrics van meerdere workers in één map: elk proces een eigen bestand, gestopte workers tellen mee zonder dat
+# hun bestanden blijven staan, en /metrics is zonder token alleen lokaal te lezen.
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metrics as m
+
+
+def register(map):
+    metrics = m.Metrics(str(map))
+    metrics.counter('requests_total', 'Requests')
+    metrics.histogram('duur_seconds', 'Duur', grenzen=(0.1, 1.0))
+    metrics.gauge('verbindingen', 'Verbindingen')
+    return metrics
+
+
+def gestopt_pid():
+    proces = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proces.wait()
+    return proces.pid
+
+
+def test_hergebruikt_pid_overschrijft_niets(tmp_path):
+    # Twee registers in hetzelfde proces staan voor twee workers met hetzelfde pid.
+    for _ in range(2):
+        metrics = register(tmp_path)
+        metrics.inc('requests_total', 3)
+        metrics.wegschrijven(forceer=True)
+    assert metrics.samenvoegen()[('requests_total', ())] == 6
+
+
+@pytest.mark.skipif(m.fcntl is None, reason='Opruimen gebeurt alleen waar fcntl bestaat')
+def test_gestopte_workers_worden_samengevoegd(tmp_path):
+    gestopt = register(tmp_path)
+    gestopt.inc('requests_total', 5)
+    gestopt.observe('duur_seconds', 0.5)
+    gestopt.set('verbindingen', 4)
+    gestopt.wegschrijven(forceer=True)
+    pad = os.path.join(tmp_path, f'worker-{gestopt._id}.json')
+    with open(pad) as bestand:
+        stand = json.load(bestand)
+    stand['pid'] = gestopt_pid()
+    with open(pad, 'w') as bestand:
+        json.dump(stand, bestand)
+
+    levend = register(tmp_path)
+    levend.inc('requests_total', 2)
+    levend.wegschrijven(forceer=True)
+    for _ in range(2):      # Ook bij een volgende scrape telt de gestopte worker precies één keer mee.
+        totaal = levend.samenvoegen()
+        assert totaal[('requests_total', ())] == 7
+        assert totaal[('duur_seconds', ())] == [0, 1, 0.5, 1]
+        assert ('verbindingen', ()) not in totaal
+        assert not os.path.exists(pad)
+    assert sorted(os.listdir(tmp_path)) == ['samenvoegen.lock', 'totaal.json', f'worker-{levend._id}.json']
+
+
+def test_metrics_zonder_token_alleen_lokaal(A, monkeypatch):
+    monkeypatch.setattr(A, 'METRICS_TOKEN', '')
+    client = A.app.test_client()
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.8'}).status_code == 403
+    assert client.get('/metrics', headers={'X-Forwarded-For': '10.0.0.8'}).status_code == 403
+
+
+def test_metrics_met_token(A, monkeypatch):
+    monkeypatch.setattr(A, 'METRICS_TOKEN', 'geheim')
+    client = A.app.test_client()
+    assert client.get('/metrics').status_code == 403
+    antwoord = client.get('/metrics', headers={'Authorization': 'Bearer geheim'},
+                          environ_base={'REMOTE_ADDR': '10.0.0.8'})
+    assert antwoord.status_code == 200 and b'# TYPE interventie_requests_total counter' in antwoord.data
@@ -0,0 +1,94 @@
+# Het schema van een bestaande database wordt bijgewerkt voordat de catalogus wordt gebruikt, ook door de
+# commando's die buiten een request draaien.
+
+import sqlalchemy as sa
+
+import migrations
+from conftest import vul_app
+
+GROOTTE = dict(instrumenten=10, tags=20, tags_per_instrument=3, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=2, opties_per_vraag=3, tags_per_optie=2)
+
+
+def oude_catalogus_versie(A):
+    """Zet catalogus_versie terug zoals hij was voordat er een kolom gewijzigd bestond."""
+    with A.app.app_context(), A.db.engine.begin() as verbinding:
+        verbinding.execute(sa.text('DROP TABLE catalogus_versie'))
+        verbinding.execute(sa.text('CREATE TABLE catalogus_versie (id INTEGER PRIMARY KEY, versie INTEGER)'))
+        verbinding.execute(sa.text('INSERT INTO catalogus_versie (id, versie) VALUES (1, 7)'))
+        verbinding.execute(migrations.schema_versie.delete().where(migrations.schema_versie.c.versie == 1))
+    A._catalogus = None
+
+
+def kolommen(A):
+    with A.app.app_context():
+        return {kolom['name'] for kolom in sa.inspect(A.db.engine).get_columns('catalogus_versie')}
+
+
+def test_watals_commando_migreert_eerst(A, tmp_path):
+    vul_app(A, sessies=1, **GROOTTE)
+    oude_catalogus_versie(A)
+    scenarios = tmp_path / 'scenarios.json'
+    scenarios.write_text('[{"naam": "een", "opties": [1]}]')
+    uitkomst = A.app.test_cli_runner().invoke(args=['watals', str(scenarios), '--formaat', 'json'])
+    assert uitkomst.exit_code == 0, uitkomst.output
+    assert '"catalogusversie": 7' in uitkomst.output
+    assert 'gewijzigd' in kolommen(A)
+
+
+def test_onderhoud_commando_migreert_eerst(A):
+    vul_app(A, sessies=1, **GROOTTE)
+    oude_catalogus_versie(A)
+    uitkomst = A.app.test_cli_runner().invoke(args=['onderhoud'])
+    assert uitkomst.exit_code == 0, uitkomst.output
+    assert 'gewijzigd' in kolommen(A)
+
+
+def test_gelijktijdige_workers_migreren_een_keer(A, tmp_path):
+    import threading
+    url = 'sqlite:///' + str(tmp_path / 'gelijktijdig.db')
+    uitgevoerd = []
+    fouten = []
+
+    def worker():
+        engine = sa.create_engine(url, connect_args={'timeout': 30})
+        try:
+            uitgevoerd.extend(migrations.migreer(engine, aanmaken=lambda: A.db.Model.metadata.create_all(engine)))
+        except Exception as err:
+            fouten.append(err)
+    workers = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    assert fouten == []
+    assert sorted(uitgevoerd) == sorted(f'{versie}: {naam}' for versie, naam, functie in migrations.MIGRATIES)
+    with sa.create_engine(url).connect() as verbinding:
+        assert verbinding.execute(sa.select(migrations.schema_versie.c.versie)).scalars().all() == \
+            [versie for versie, naam, functie in migrations.MIGRATIES]
+
+
+def test_verlopen_claim_wordt_overgenomen(A, tmp_path):
+    import datetime
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'claim.db'))
+    migrations.schema_versie.create(engine)
+    with engine.begin() as verbinding:
+        verbinding.execute(migrations.schema_versie.insert(), {'versie': migrations.VERGRENDELING, 'naam': 'gestopt',
+                                                               'toegepast': datetime.datetime(2000, 1, 1)})
+    assert len(migrations.migreer(engine, aanmaken=lambda: A.db.Model.metadata.create_all(engine))) == len(migrations.MIGRATIES)
+
+
+def test_mislukte_migratie_stopt_de_app(A, monkeypatch):
+    vul_app(A, sessies=1, **GROOTTE)
+
+    def mislukt(verbinding):
+        raise RuntimeError('kapot')
+    monkeypatch.setattr(migrations, 'MIGRATIES', migrations.MIGRATIES + ((99, 'mislukt', mislukt),))
+    monkeypatch.setattr(A.app, '_got_first_request', False)
+    client = A.app.test_client()
+    assert client.get('/login').status_code == 500
+    assert client.get('/login').status_code == 500      # Het volgende request probeert het opnieuw
+    monkeypatch.setattr(migrations, 'MIGRATIES', migrations.MIGRATIES[:-1])
+    assert client.get('/login').status_code == 200
+    with A.app.app_context(), A.db.engine.connect() as verbinding:
+        assert migrations.VERGRENDELING not in verbinding.execute(sa.select(migrations.schema_versie.c.versie)).scalars().all()
@@ -0,0 +1,53 @@
+# Het geplande onderhoud: alle workers kijken rond hetzelfde moment of het aan de beurt is, maar maar één van hen
+# mag het uitvoeren.
+
+import datetime
+import threading
+
+import sqlalchemy as sa
+
+import onderhoud
+
+
+def planningsdatabase(tmp_path):
+    url = 'sqlite:///' + str(tmp_path / 'onderhoud.db')
+    engine = sa.create_engine(url)
+    onderhoud.metadata.create_all(engine)
+    with engine.begin() as verbinding:
+        onderhoud.planningsrij_aanmaken(verbinding)
+    return url
+
+
+def test_een_worker_claimt_het_onderhoud(tmp_path):
+    url = planningsdatabase(tmp_path)
+    beurten = []
+    start = threading.Barrier(8)
+
+    def worker():
+        engine = sa.create_engine(url, connect_args={'timeout': 30})
+        start.wait()
+        beurten.append(onderhoud.Planning(3600).aan_de_beurt(engine))
+    workers = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    assert sorted(beurten) == [False] * 7 + [True]
+
+
+def test_handmatig_onderhoud_telt_mee(tmp_path):
+    engine = sa.create_engine(planningsdatabase(tmp_path))
+    with engine.begin() as verbinding:
+        verbinding.execute(onderhoud.onderhoud_log.insert(), {'taak': 'motivaties zonder werksessie', 'rijen': 0,
+                                                              'duur': 0, 'tijdstip': datetime.datetime.utcnow()})
+    assert not onderhoud.Planning(3600).aan_de_beurt(engine)
+    assert [regel.taak for regel in onderhoud.geschiedenis(engine)] == ['motivaties zonder werksessie']
+
+
+def test_zonder_planningsrij_wordt_die_teruggezet(tmp_path):
+    engine = sa.create_engine(planningsdatabase(tmp_path))
+    with engine.begin() as verbinding:
+        verbinding.execute(onderhoud.onderhoud_log.delete())
+    planning = onderhoud.Planning(3600)
+    assert planning.aan_de_beurt(engine)
+    assert not planning.aan_de_beurt(engine)
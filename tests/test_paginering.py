@@ -0,0 +1,110 @@
+# Keyset-paginering van de werksessies en gebruikers: de volgende pagina begint na het laatste id of de laatste naam,
+# een zoekterm met % of _ zoekt naar die tekens zelf, en gewone gebruikers zien alleen hun eigen werksessies.
+
+import pytest
+from flask_login import login_user
+
+from conftest import vul_app
+
+GROOTTE = dict(instrumenten=5, tags=10, tags_per_instrument=2, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=1, opties_per_vraag=2, tags_per_optie=1)
+
+
+@pytest.fixture
+def A_leeg(A):
+    vul_app(A, sessies=0, **GROOTTE)
+    with A.app.app_context():
+        A.db.session.add(A.User(id=2, username='gebruiker', password='-', role=0))
+        A.db.session.commit()
+    return A
+
+
+def werksessies_toevoegen(A, namen, eigenaar=1):
+    with A.app.app_context():
+        for naam in namen:
+            A.db.session.add(A.Werksessie(naam=naam, owner=eigenaar))
+        A.db.session.commit()
+
+
+def gebruikers_toevoegen(A, namen):
+    with A.app.app_context():
+        for naam in namen:
+            A.db.session.add(A.User(username=naam, password='-', role=0))
+        A.db.session.commit()
+
+
+def werksessies(A, gebruiker_id=1, **argumenten):
+    """De pagina zoals werksessies_pagina() hem geeft: (namen, zoekterm, cursor voor de volgende pagina)."""
+    with A.app.test_request_context('/', query_string=argumenten):
+        login_user(A.User.query.get(gebruiker_id))
+        pagina, zoek, volgende = A.werksessies_pagina()
+        return [werksessie.naam for werksessie in pagina], zoek, volgende
+
+
+def gebruikers(A, **argumenten):
+    with A.app.test_request_context('/', query_string=argumenten):
+        login_user(A.User.query.get(1))
+        pagina, zoek, volgende = A.gebruikers_pagina()
+        return [gebruiker.username for gebruiker in pagina], zoek, volgende
+
+
+def test_werksessies_per_pagina(A_leeg):
+    A = A_leeg
+    aantal = A.WERKSESSIES_PER_PAGINA
+    werksessies_toevoegen(A, [f'sessie {nummer:02}' for nummer in range(1, aantal + 2)])
+    namen, zoek, volgende = werksessies(A)
+    assert namen == [f'sessie {nummer:02}' for nummer in range(aantal + 1, 1, -1)]
+    assert volgende == 2
+    assert werksessies(A, voor=volgende) == (['sessie 01'], None, None)
+
+
+def test_precies_een_volle_pagina(A_leeg):
+    A = A_leeg
+    werksessies_toevoegen(A, [f'sessie {nummer}' for nummer in range(A.WERKSESSIES_PER_PAGINA)])
+    namen, zoek, volgende = werksessies(A)
+    assert len(namen) == A.WERKSESSIES_PER_PAGINA
+    assert volgende is None
+
+
+def test_zoeken_naar_procent_en_liggend_streepje(A_leeg):
+    A = A_leeg
+    werksessies_toevoegen(A, ['100% zeker', '1000 zeker', 'a_b', 'axb'])
+    assert werksessies(A, zoek='0%')[0] == ['100% zeker']
+    assert werksessies(A, zoek='a_b')[0] == ['a_b']
+    assert werksessies(A, zoek='%')[:2] == (['100% zeker'], '%')
+
+
+def test_gewone_gebruiker_ziet_eigen_werksessies(A_leeg):
+    A = A_leeg
+    werksessies_toevoegen(A, ['van beheerder'])
+    werksessies_toevoegen(A, ['eigen sessie'], eigenaar=2)
+    assert werksessies(A, gebruiker_id=2)[0] == ['eigen sessie']
+    assert werksessies(A, gebruiker_id=2, zoek='beheerder')[0] == []
+    assert werksessies(A)[0] == ['eigen sessie', 'van beheerder']
+
+
+def test_gebruikers_per_pagina(A_leeg):
+    A = A_leeg
+    aantal = A.GEBRUIKERS_PER_PAGINA
+    # Met beheerder en gebruiker erbij zijn er precies aantal + 1 gebruikers.
+    gebruikers_toevoegen(A, [f'naam {nummer:02}' for nummer in range(aantal - 1)])
+    namen, zoek, volgende = gebruikers(A)
+    assert len(namen) == aantal
+    assert namen == sorted(namen) and namen[0] == 'beheerder'
+    assert volgende == namen[-1]
+    assert gebruikers(A, na=volgende) == ([f'naam {aantal - 2:02}'], None, None)
+
+
+def test_gebruikers_precies_een_volle_pagina(A_leeg):
+    A = A_leeg
+    gebruikers_toevoegen(A, [f'naam {nummer:02}' for nummer in range(A.GEBRUIKERS_PER_PAGINA - 2)])
+    namen, zoek, volgende = gebruikers(A)
+    assert len(namen) == A.GEBRUIKERS_PER_PAGINA
+    assert volgende is None
+
+
+def test_gebruikers_zoeken_naar_procent_en_liggend_streepje(A_leeg):
+    A = A_leeg
+    gebruikers_toevoegen(A, ['jan_de_vries', 'janXdeXvries', '50%korting', '500korting'])
+    assert gebruikers(A, gebruiker='n_d')[0] == ['jan_de_vries']
+    assert gebruikers(A, gebruiker='0%')[0] == ['50%korting']
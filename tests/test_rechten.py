@@ -0,0 +1,43 @@
+# Rechten van administrators worden in de database bevestigd, ook als de gebruiker nog in de cache van deze worker
+# staat. Een andere worker (hier: een wijziging direct in de database) kan de rol intussen hebben ingetrokken.
+
+import pytest
+
+from conftest import vul_app, inloggen
+
+GROOTTE = dict(instrumenten=5, tags=10, tags_per_instrument=2, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=1, opties_per_vraag=2, tags_per_optie=1)
+
+
+@pytest.fixture
+def client(A):
+    vul_app(A, sessies=1, **GROOTTE)
+    client = inloggen(A)
+    assert b'Onvoldoende rechten' not in client.get('/question_tools').data     # Nu in de cache, als administrator
+    return client
+
+
+def test_ingetrokken_rol(A, client):
+    with A.app.app_context():
+        A.User.query.get(1).role = 0
+        A.db.session.commit()
+    assert b'Onvoldoende rechten' in client.get('/question_tools').data
+    assert b'Onvoldoende rechten' in client.get('/question_tools').data
+
+
+def test_verwijderde_administrator(A, client):
+    with A.app.app_context():
+        A.db.session.delete(A.User.query.get(1))
+        A.db.session.commit()
+    assert b'Onvoldoende rechten' in client.get('/question_tools').data
+    assert client.get('/account').status_code == 302     # Niet meer ingelogd
+
+
+def test_interne_gegevens_alleen_voor_administrators(A, client):
+    pagina = client.get('/info').data
+    assert b'gemiddelde duur' in pagina and b'Caches van deze worker' in pagina
+    anoniem = A.app.test_client()
+    antwoord = anoniem.get('/info')
+    assert antwoord.status_code == 200
+    assert b'gemiddelde duur' not in antwoord.data
+    assert b'Caches van deze worker' not in antwoord.data
@@ -0,0 +1,119 @@
+# De scoring met TagMatrix, OptieIndex en SessieScore moet precies dezelfde ranglijst opleveren als de oorspronkelijke
+# scoring met lijsten (get_instruments en prioritize_instruments van voor de incidentiematrix), voor elke strategie
+# en elke marge. De oude scoring staat hieronder nog een keer uitgeschreven als referentie.
+
+import random
+
+import pytest
+
+import synthetisch
+from scoring import (STRATEGIEEN, DIFFERENCE, EXCLUDED, WEIGH_DOWN, WEIGH_DOWN_3, PRIO_HI, PRIO_MID, PRIO_LO,
+                     prioritize_instruments, scoor_scenarios)
+
+MARGES = (0, 1, 2, 3)
+# Kleine catalogi met weinig tags, zodat er veel gelijke prioriteiten en veel mintags in scope zijn.
+GROOTTES = (
+    dict(instrumenten=40, tags=25, tags_per_instrument=5, mintags_per_instrument=2, categorieen=3,
+         vragen_per_categorie=4, opties_per_vraag=3, tags_per_optie=3, seed=1),
+    dict(instrumenten=120, tags=60, tags_per_instrument=8, mintags_per_instrument=4, categorieen=4,
+         vragen_per_categorie=5, opties_per_vraag=4, tags_per_optie=4, seed=2),
+    # Veel tags met weinig instrumenten per tag: een antwoord raakt maar een paar instrumenten.
+    dict(instrumenten=400, tags=800, tags_per_instrument=3, mintags_per_instrument=1, categorieen=4,
+         vragen_per_categorie=5, opties_per_vraag=3, tags_per_optie=2, seed=3),
+)
+
+
+def oude_score(catalogus, opties, methode, marge):
+    """De scoring zoals die was: per instrument de tags opzoeken in de lijst met alle tags van de gekozen opties."""
+    tags_in_scope = []
+    for optie_id in sorted(opties):
+        tags_in_scope.extend(catalogus.opties[optie_id].tags)
+
+    prioritized_list = []
+    max_priority = 0
+    for instrument in catalogus.instrumenten:
+        tags = [tag for tag in instrument.tags if tag in tags_in_scope]
+        extags = [tag for tag in instrument.extags if tag in tags_in_scope]
+        tag_hits = len(tags)
+        extag_hits = len(extags)
+        if methode == DIFFERENCE:
+            priority = tag_hits - extag_hits
+        if methode == EXCLUDED:
+            priority = tag_hits * (extag_hits == 0)
+        if methode == WEIGH_DOWN:
+            priority = tag_hits - 2 * extag_hits
+        if methode == WEIGH_DOWN_3:
+            priority = tag_hits - 3 * extag_hits
+        prioritized_list.append([instrument, tag_hits, tags, extag_hits, extags, priority, 0])
+        max_priority = max(priority, max_priority)
+    for instrument in prioritized_list:
+        if instrument[5] == 0:
+            instrument[6] = PRIO_LO
+        elif instrument[5] == max_priority:
+            instrument[6] = PRIO_HI
+        elif instrument[5] >= (max_priority - marge):
+            instrument[6] = PRIO_HI
+        elif instrument[5] > 0:
+            instrument[6] = PRIO_MID
+        else:
+            instrument[6] = PRIO_LO
+    return sorted(prioritized_list, key=lambda instrument: instrument[5], reverse=True)
+
+
+def antwoordreeks(catalogus, seed, stappen=25):
+    """Een werksessie die antwoord voor antwoord wordt ingevuld en bijgesteld: per stap de set gekozen opties."""
+    rnd = random.Random(seed)
+    vragen = [vraag for vraag in catalogus.vragen.values() if vraag.opties]
+    gekozen = set()
+    reeks = [frozenset()]
+    for _ in range(stappen):
+        vraag = rnd.choice(vragen)
+        eerder = {optie.id for optie in vraag.opties} & gekozen
+        if eerder and rnd.random() < 0.3:
+            gekozen -= eerder                           # Antwoord gewist
+        elif vraag.multiselect:
+            gekozen ^= {rnd.choice(vraag.opties).id}    # Vinkje aan of uit
+        else:
+            gekozen = (gekozen - eerder) | {rnd.choice(vraag.opties).id}
+        reeks.append(frozenset(gekozen))
+    return reeks
+
+
+@pytest.fixture(scope='module', params=range(len(GROOTTES)), ids=lambda nummer: f'catalogus{nummer}')
+def catalogus(request):
+    return synthetisch.catalogus(**GROOTTES[request.param])
+
+
+@pytest.mark.parametrize('marge', MARGES)
+@pytest.mark.parametrize('methode', sorted(STRATEGIEEN))
+def test_tagmatrix_gelijk_aan_oude_scoring(catalogus, methode, marge):
+    for opties in antwoordreeks(catalogus, seed=methode * 10 + marge):
+        scope = catalogus.matrix.scope(catalogus.tags_van_opties(opties))
+        nieuw = prioritize_instruments(catalogus.matrix.score(scope), methode, marge)
+        assert nieuw == oude_score(catalogus, opties, methode, marge)
+
+
+@pytest.mark.parametrize('marge', MARGES)
+@pytest.mark.parametrize('methode', sorted(STRATEGIEEN))
+def test_sessiescore_gelijk_aan_oude_scoring(catalogus, methode, marge):
+    sessiescore = catalogus.index.sessiescore(methode, marge)
+    eerdere = []
+    for opties in antwoordreeks(catalogus, seed=methode * 10 + marge + 1):
+        nieuw = sessiescore.score(opties)
+        assert nieuw == oude_score(catalogus, opties, methode, marge)
+        eerdere.append((opties, nieuw))
+    # Lijsten van eerdere antwoorden staan in de cache van app.py en mogen niet meeveranderen.
+    for opties, lijst in eerdere:
+        assert lijst == oude_score(catalogus, opties, methode, marge)
+
+
+@pytest.mark.parametrize('marge', MARGES)
+@pytest.mark.parametrize('methode', sorted(STRATEGIEEN))
+def test_scenarios_gelijk_aan_oude_scoring(catalogus, methode, marge):
+    scenarios = antwoordreeks(catalogus, seed=methode * 10 + marge + 2)
+    for top in (None, 5):
+        for opties, ranglijst in zip(scenarios, scoor_scenarios(catalogus.index, scenarios, methode, marge, top)):
+            oud = oude_score(catalogus, opties, methode, marge)[:top]
+            assert [(catalogus.matrix.instrumenten[i], tag_hits, extag_hits, prioriteit, klasse)
+                    for i, tag_hits, extag_hits, prioriteit, klasse in ranglijst.instrumenten] == \
+                   [(rij[0], rij[1], rij[3], rij[5], rij[6]) for rij in oud]
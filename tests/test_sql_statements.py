@@ -0,0 +1,60 @@
+# Het aantal SQL-statements van de zware pagina's mag niet meegroeien met de catalogus of met het aantal antwoorden
+# (geen N+1-queries). De app draait op SQLite met een synthetische catalogus in twee groottes; per pagina moet het
+# aantal statements (sql_statements(), via de header X-SQL-Statements) bij beide groottes gelijk en klein zijn.
+
+import os
+import shutil
+
+import pytest
+
+from conftest import vul_app, inloggen
+
+KLEIN = dict(instrumenten=20, tags=40, tags_per_instrument=4, mintags_per_instrument=1,
+             categorieen=2, vragen_per_categorie=3, opties_per_vraag=3, tags_per_optie=2)
+GROOT = dict(instrumenten=300, tags=400, tags_per_instrument=10, mintags_per_instrument=3,
+             categorieen=6, vragen_per_categorie=8, opties_per_vraag=5, tags_per_optie=4)
+MAXIMUM = {'koud': 20, 'warm': 8}    # Statements per request; koud is inclusief het laden van de catalogus (elf queries)
+
+
+def statements(client, url):
+    antwoord = client.get(url)
+    assert antwoord.status_code in (200, 302), url
+    return int(antwoord.headers['X-SQL-Statements'])
+
+
+def meet(A, grootte):
+    """Per pagina het aantal statements bij het eerste request na het vullen (koud: de catalogus wordt geladen en
+    de werksessie gescoord) en bij een herhaling (warm)."""
+    vul_app(A, sessies=2, fractie=1.0, **grootte)
+    shutil.rmtree(A.EXPORT_DIR, ignore_errors=True)
+    os.makedirs(A.EXPORT_DIR, exist_ok=True)
+    client = inloggen(A)
+    client.get('/')     # Eerste request van deze app: create_tables en het laden van de gebruiker vallen buiten de meting
+    A._catalogus = None
+    for cache in (A.aanbevelingen_cache, A.sessiescores):
+        cache.invalidate()
+    resultaat = {}
+    for url in ('/questionnaire', '/final', '/export_session'):
+        resultaat[url, 'koud'] = statements(client, url)
+        resultaat[url, 'warm'] = statements(client, url)
+        A._catalogus = None
+        for cache in (A.aanbevelingen_cache, A.sessiescores):
+            cache.invalidate()
+    return resultaat
+
+
+@pytest.fixture(scope='module')
+def metingen(A):
+    A.db_config['sql_statement_header'] = 'TRUE'
+    try:
+        yield meet(A, KLEIN), meet(A, GROOT)
+    finally:
+        A.db_config['sql_statement_header'] = 'FALSE'
+
+
+@pytest.mark.parametrize('url', ('/questionnaire', '/final', '/export_session'))
+@pytest.mark.parametrize('soort', ('koud', 'warm'))
+def test_aantal_statements_constant(metingen, url, soort):
+    klein, groot = metingen
+    assert klein[url, soort] == groot[url, soort]
+    assert groot[url, soort] <= MAXIMUM[soort]
@@ -0,0 +1,60 @@
+# Statische bestanden met een vingerafdruk in de naam (build_assets.py): url_for wijst naar die naam, en de
+# bestanden gaan gecomprimeerd en met een Cache-Control die zegt dat ze nooit veranderen over de lijn.
+
+import gzip
+
+import pytest
+
+import build_assets
+
+CSS = b'body { color: #123456; }\n' * 20
+
+
+@pytest.fixture
+def dist(A, tmp_path, monkeypatch):
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'main.css').write_bytes(CSS)
+    monkeypatch.setattr(build_assets, 'STATIC', str(static))
+    monkeypatch.setattr(build_assets, 'DIST', str(static / 'dist'))
+    monkeypatch.setattr(build_assets, 'MANIFEST', str(static / 'dist' / 'manifest.json'))
+    manifest = build_assets.bouw()
+    monkeypatch.setattr(A.app, 'static_folder', str(static))
+    monkeypatch.setattr(A, 'asset_manifest', manifest)
+    return manifest
+
+
+def test_url_for_geeft_de_naam_met_vingerafdruk(A, dist):
+    with A.app.test_request_context():
+        url = A.url_for('static', filename='css/main.css')
+    assert url == '/static/dist/' + dist['css/main.css']
+    assert url != '/static/dist/css/main.css' and url.endswith('.css')
+
+
+@pytest.mark.parametrize('accept_encoding, codering', [
+    ('br, gzip', 'br' if build_assets.brotli is not None else 'gzip'),
+    ('gzip', 'gzip'),
+    (None, None),
+])
+def test_gecomprimeerd_en_onveranderlijk(A, dist, accept_encoding, codering):
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    with A.app.test_request_context():
+        url = A.url_for('static', filename='css/main.css')
+    antwoord = A.app.test_client().get(url, headers=headers)
+    assert antwoord.status_code == 200
+    assert antwoord.headers.get('Content-Encoding') == codering
+    assert 'Accept-Encoding' in antwoord.headers['Vary']
+    assert antwoord.mimetype == 'text/css'
+    assert antwoord.cache_control.immutable and antwoord.cache_control.public
+    assert antwoord.cache_control.max_age == A.STATIC_MAX_AGE
+    inhoud = antwoord.get_data()
+    if codering == 'gzip':
+        inhoud = gzip.decompress(inhoud)
+    elif codering == 'br':
+        inhoud = build_assets.brotli.decompress(inhoud)
+    assert inhoud == CSS
+    antwoord.close()
+
+
+def test_onbekend_bestand_in_dist(A, dist):
+    assert A.app.test_client().get('/static/dist/css/bestaat.niet.css').status_code == 404
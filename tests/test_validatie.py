@@ -0,0 +1,35 @@
+# Conditionele requests: een 304 alleen als de client precies deze versie heeft. Privé pagina's hangen ook van de
+# gebruiker af; dat zit in de ETag en niet in Last-Modified, dus daar is If-Modified-Since alleen niet genoeg.
+
+import datetime
+
+import pytest
+
+from conftest import vul_app, inloggen
+
+GROOTTE = dict(instrumenten=10, tags=20, tags_per_instrument=3, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=2, opties_per_vraag=3, tags_per_optie=2)
+LATER = 'Fri, 01 Jan 2100 00:00:00 GMT'
+
+
+@pytest.fixture
+def client(A):
+    vul_app(A, sessies=1, **GROOTTE)
+    with A.app.app_context():
+        A.db.session.add(A.CatalogusVersie(id=1, versie=1, gewijzigd=datetime.datetime(2024, 1, 1)))
+        A.db.session.commit()
+    return inloggen(A)
+
+
+@pytest.mark.parametrize('url', ['/summary', '/instrument/1'])
+def test_prive_pagina_vraagt_etag(client, url):
+    eerste = client.get(url)
+    assert eerste.status_code == 200 and eerste.headers['Last-Modified']
+    assert client.get(url, headers={'If-Modified-Since': LATER}).status_code == 200
+    assert client.get(url, headers={'If-None-Match': eerste.headers['ETag']}).status_code == 304
+
+
+def test_publiek_document_met_alleen_tijdstip(client):
+    eerste = client.get('/export_instrument/1')
+    assert eerste.status_code == 200 and 'public' in eerste.headers['Cache-Control']
+    assert client.get('/export_instrument/1', headers={'If-Modified-Since': LATER}).status_code == 304
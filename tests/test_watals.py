@@ -0,0 +1,32 @@
+# Wat-als-scenario's via /api/watals worden direct doorgerekend; het aantal scenario's is begrensd naar het aantal
+# instrumenten dat per scenario in het antwoord komt.
+
+import json
+
+import pytest
+
+from conftest import vul_app, inloggen
+
+GROOTTE = dict(instrumenten=10, tags=20, tags_per_instrument=3, mintags_per_instrument=1,
+               categorieen=1, vragen_per_categorie=2, opties_per_vraag=3, tags_per_optie=2)
+
+
+@pytest.fixture
+def client(A, monkeypatch):
+    vul_app(A, sessies=1, **GROOTTE)
+    monkeypatch.setattr(A, 'WATALS_MAX_RIJEN', 50)
+    return inloggen(A)
+
+
+def scenarios(aantal):
+    return json.dumps([{'naam': f'scenario {nummer}', 'opties': [1, 2]} for nummer in range(aantal)])
+
+
+@pytest.mark.parametrize('top, toegestaan', [(5, 10), (0, 5), (20, 5)])
+def test_maximum_hangt_af_van_top(client, top, toegestaan):
+    antwoord = client.post(f'/api/watals?top={top}', data=scenarios(toegestaan), content_type='application/json')
+    assert antwoord.status_code == 200
+    assert len(antwoord.get_json()['scenarios']) == toegestaan
+    antwoord = client.post(f'/api/watals?top={top}', data=scenarios(toegestaan + 1), content_type='application/json')
+    assert antwoord.status_code == 413
+    assert f'Maximaal {toegestaan} scenario' in antwoord.get_json()['melding']
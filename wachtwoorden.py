@@ -0,0 +1,92 @@
+# Wachtwoorden hashen en controleren zonder de worker te blokkeren.
+#
+# Bcrypt is met opzet traag: een hash kost bij 12 rondes al snel een kwart seconde CPU. In een gevent-worker
+# draait alles in één thread, dus tijdens het hashen staan alle andere requests op die worker stil. Bij de start
+# van een workshop, als iedereen tegelijk inlogt, loopt dat snel op. Daarom gaat het hashen naar een kleine pool
+# van echte threads; bcrypt geeft de GIL vrij tijdens het rekenen. Onder gevent is dat de threadpool van gevent,
+# zonder gevent een gewone ThreadPoolExecutor. Het aantal wachtende aanvragen is begrensd: is de rij vol,
+# dan volgt direct een WachtwoordWachtrijVol in plaats van een request dat minutenlang hangt.
+
+import concurrent.futures
+import threading
+import time
+
+
+class WachtwoordWachtrijVol(Exception):
+    """Er wachten al te veel wachtwoorden om gehasht of gecontroleerd te worden."""
+
+
+def rondes_van(wachtwoord_hash):
+    """Het aantal rondes (log2) waarmee een bcrypt-hash gemaakt is, uit het deel '$2b$12$...'."""
+    if isinstance(wachtwoord_hash, bytes):
+        wachtwoord_hash = wachtwoord_hash.decode('utf-8')
+    try:
+        return int(wachtwoord_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _threadpool(threads):
+    """Geeft een functie die func(*args) in een echte thread uitvoert en op het resultaat wacht."""
+    try:
+        from gevent import monkey
+        from gevent.threadpool import ThreadPool
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        # Na monkey.patch_all() zijn threads van de threading-module greenlets; alleen de threadpool van
+        # gevent levert dan nog echte threads, en wachten daarop blokkeert alleen de eigen greenlet.
+        pool = ThreadPool(threads)
+        return lambda func, *args: pool.apply(func, args)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    return lambda func, *args: executor.submit(func, *args).result()
+
+
+class Wachtwoorden:
+    """Hasht en controleert wachtwoorden met Flask-Bcrypt in een begrensde pool van threads.
+    Houdt per worker bij hoeveel hashes er gemaakt zijn en hoe lang dat duurde; op_klaar(duur) wordt
+    na elke hash aangeroepen."""
+
+    def __init__(self, bcrypt, threads=2, max_wachtend=50, op_klaar=None):
+        self.bcrypt = bcrypt
+        self.op_klaar = op_klaar
+        self.threads = threads
+        self.max_wachtend = max_wachtend
+        self.aantal = 0
+        self.totale_duur = 0.0
+        self.max_duur = 0.0
+        self._plaatsen = threading.BoundedSemaphore(threads + max_wachtend)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _uitvoeren(self, func, *args):
+        if not self._plaatsen.acquire(blocking=False):
+            raise WachtwoordWachtrijVol()
+        try:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = _threadpool(self.threads)
+            begin = time.perf_counter()
+            resultaat = self._pool(func, *args)
+            duur = time.perf_counter() - begin
+        finally:
+            self._plaatsen.release()
+        with self._lock:
+            self.aantal += 1
+            self.totale_duur += duur
+            self.max_duur = max(self.max_duur, duur)
+        if self.op_klaar is not None:
+            self.op_klaar(duur)
+        return resultaat
+
+    def hash(self, wachtwoord, rondes):
+        return self._uitvoeren(self.bcrypt.generate_password_hash, wachtwoord, rondes)
+
+    def controleer(self, wachtwoord_hash, wachtwoord):
+        return self._uitvoeren(self.bcrypt.check_password_hash, wachtwoord_hash, wachtwoord)
+
+    def stats(self):
+        with self._lock:
+            return {'threads': self.threads, 'max wachtend': self.max_wachtend, 'hashes': self.aantal,
+                    'gemiddelde duur': self.totale_duur / self.aantal if self.aantal else 0.0,
+                    'maximale duur': self.max_duur}
@@ -0,0 +1,129 @@
+# Wat-als-scenario's: de ranglijst van instrumenten bij verzonnen sets van gekozen opties.
+#
+# Wie de tags van instrumenten en opties bijstelt, wil zien wat dat met de aanbevelingen doet, zonder een werksessie
+# aan te maken en de keuzehulp door te klikken. Een scenario is een naam met een set optie-id's; alle scenario's
+# worden samen gescoord met de momentopname van de catalogus (scoring.scoor_scenarios). Er wordt niets in de
+# database geschreven.
+#
+# Scenario's komen als JSON of als CSV:
+#   JSON: [{"naam": "...", "opties": [1, 2, 3]}, ...], een lijst van lijsten met id's, of {"naam": [1, 2, 3], ...}
+#   CSV:  per regel een naam en daarna de optie-id's, in losse kolommen of in één kolom gescheiden door ; of spaties.
+#         Een eerste regel die met 'naam' begint is een kopregel.
+#
+# Gebruik: POST /api/watals (alleen administrators) of flask watals <bestand>.
+
+import csv
+import io
+import json
+import re
+from collections import namedtuple
+
+from scoring import STRATEGIEEN, PRIORITEITSKLASSEN, scoor_scenarios
+
+Scenario = namedtuple('Scenario', 'naam opties')
+
+CSV_KOLOMMEN = ('scenario', 'rang', 'instrument_id', 'instrument', 'prioriteit', 'klasse',
+                'tag_hits', 'extag_hits', 'plustags', 'mintags')
+
+_SCHEIDING = re.compile(r'[\s,;]+')
+
+
+class OngeldigeScenarios(ValueError):
+    """De scenario's zijn niet te lezen; de tekst van de fout is bedoeld voor de gebruiker."""
+
+
+def _optie_ids(opties, naam):
+    if isinstance(opties, str):
+        opties = [deel for deel in _SCHEIDING.split(opties) if deel]
+    try:
+        return [int(optie_id) for optie_id in opties]
+    except (TypeError, ValueError):
+        raise OngeldigeScenarios(f'{naam}: de opties moeten een lijst met id\'s (gehele getallen) zijn.')
+
+
+def lees_json(tekst):
+    try:
+        gegevens = json.loads(tekst)
+    except ValueError:
+        raise OngeldigeScenarios('De scenario\'s zijn geen geldige JSON.')
+    if isinstance(gegevens, dict):
+        paren = list(gegevens.items())
+    elif isinstance(gegevens, list):
+        paren = []
+        for nummer, scenario in enumerate(gegevens, 1):
+            if isinstance(scenario, dict):
+                paren.append((scenario.get('naam') or f'scenario {nummer}', scenario.get('opties', [])))
+            else:
+                paren.append((f'scenario {nummer}', scenario))
+    else:
+        raise OngeldigeScenarios('Verwacht een lijst met scenario\'s of een object van naam naar opties.')
+    return [Scenario(str(naam), _optie_ids(opties, naam)) for naam, opties in paren]
+
+
+def lees_csv(tekst):
+    # Excel met Nederlandse instellingen scheidt kolommen met ;. Een komma op de eerste regel betekent dat ; daar
+    # alleen de optie-id's binnen een kolom scheidt.
+    eerste_regel = tekst.split('\n', 1)[0]
+    scheidingsteken = '\t' if '\t' in eerste_regel else ',' if ',' in eerste_regel else ';'
+    scenarios = []
+    for nummer, rij in enumerate(csv.reader(io.StringIO(tekst), delimiter=scheidingsteken)):
+        cellen = [cel.strip() for cel in rij]
+        if not any(cellen) or (nummer == 0 and cellen[0].lower() == 'naam'):
+            continue
+        naam = cellen[0] or f'scenario {len(scenarios) + 1}'
+        scenarios.append(Scenario(naam, _optie_ids(' '.join(cellen[1:]), naam)))
+    return scenarios
+
+
+def lees(tekst):
+    """Leest scenario's uit JSON of CSV; JSON begint met [ of {."""
+    tekst = tekst.lstrip('\ufeff')
+    return lees_json(tekst) if tekst.lstrip()[:1] in ('[', '{') else lees_csv(tekst)
+
+
+def evalueer(catalogus, scenarios, top=None):
+    """Scoort de scenario's met de momentopname van de catalogus. Geeft een dict dat als JSON terug kan, met per
+    scenario de gekozen opties, de opties die niet in de catalogus staan, de actieve tags en de eerste top
+    instrumenten (of alle instrumenten) met dezelfde velden als /api/aanbevelingen."""
+    ranglijsten = scoor_scenarios(catalogus.index, [scenario.opties for scenario in scenarios],
+                                  catalogus.methode, catalogus.marge, top)
+    instrumenten = catalogus.matrix.instrumenten
+    per_ranglijst = {}      # Scenario's met dezelfde scope delen hun ranglijst, en dus ook de uitvoer daarvan
+
+    uitkomsten = []
+    for scenario, ranglijst in zip(scenarios, ranglijsten):
+        lijst = per_ranglijst.get(id(ranglijst))
+        if lijst is None:
+            lijst = per_ranglijst[id(ranglijst)] = [
+                {'id': instrumenten[i].id,
+                 'naam': instrumenten[i].naam,
+                 'tag_hits': tag_hits,
+                 'plustags': [tag.naam for tag in instrumenten[i].tags if tag.id in ranglijst.scope] if tag_hits else [],
+                 'extag_hits': extag_hits,
+                 'mintags': [tag.naam for tag in instrumenten[i].extags if tag.id in ranglijst.scope] if extag_hits else [],
+                 'prioriteit': prioriteit,
+                 'klasse': PRIORITEITSKLASSEN[klasse]}
+                for i, tag_hits, extag_hits, prioriteit, klasse in ranglijst.instrumenten]
+        opties = sorted(set(scenario.opties))
+        uitkomsten.append({'naam': scenario.naam,
+                           'opties': opties,
+                           'onbekende_opties': [optie_id for optie_id in opties if optie_id not in catalogus.opties],
+                           'actieve_tags': [tag.naam for tag in catalogus.tags_van_opties(opties)],
+                           'instrumenten': lijst})
+    return {'catalogusversie': catalogus.versie,
+            'methode': STRATEGIEEN[catalogus.methode].naam,
+            'marge': catalogus.marge,
+            'scenarios': uitkomsten}
+
+
+def naar_csv(uitkomst):
+    """De uitkomst van evalueer als CSV: een regel per scenario per instrument in de ranglijst."""
+    uitvoer = io.StringIO()
+    schrijver = csv.writer(uitvoer)
+    schrijver.writerow(CSV_KOLOMMEN)
+    for scenario in uitkomst['scenarios']:
+        for rang, instrument in enumerate(scenario['instrumenten'], 1):
+            schrijver.writerow((scenario['naam'], rang, instrument['id'], instrument['naam'], instrument['prioriteit'],
+                                instrument['klasse'], instrument['tag_hits'], instrument['extag_hits'],
+                                '; '.join(instrument['plustags']), '; '.join(instrument['mintags'])))
+    return uitvoer.getvalue()